@@ -27,6 +27,11 @@ import torch.nn.functional as F
 from torch.nn.parallel import DistributedDataParallel
 
 from src.datasets.data_manager import init_data
+from src.datasets.utils.batch_ring import (
+    SharedBatchLoader,
+    SharedBatchRing,
+    num_batch_slots,
+)
 from src.masks.random_tube import MaskCollator as TubeMaskCollator
 from src.masks.multiblock3d import MaskCollator as MB3DMaskCollator
 from src.masks.utils import apply_masks
@@ -45,7 +50,11 @@ from app.vjepa.utils import (
     init_video_model,
     init_opt,
 )
-from app.vjepa.transforms import make_transforms
+from app.vjepa.transforms import (
+    make_batch_transforms,
+    make_transforms,
+    uint8_normalize,
+)
 
 
 # --
@@ -74,7 +83,10 @@ def main(args, resume_preempt=False):
     r_file = cfgs_meta.get('read_checkpoint', None)
     seed = cfgs_meta.get('seed', _GLOBAL_SEED)
     save_every_freq = cfgs_meta.get('save_every_freq', -1)
-    skip_batches = cfgs_meta.get('skip_batches', -1)
+    checkpoint_itr_freq = cfgs_meta.get('checkpoint_itr_freq', -1)
+    if cfgs_meta.get('skip_batches', -1) > 0:
+        logger.info('skip_batches is no longer used; checkpoints record '
+                    'the position in the epoch')
     use_sdpa = cfgs_meta.get('use_sdpa', False)
     which_dtype = cfgs_meta.get('dtype')
     logger.info(f'{which_dtype=}')
@@ -120,6 +132,39 @@ def main(args, resume_preempt=False):
     num_workers = cfgs_data.get('num_workers', 1)
     filter_short_videos = cfgs_data.get('filter_short_videos', False)
     decode_one_clip = cfgs_data.get('decode_one_clip', True)
+    use_video_metadata = cfgs_data.get('use_video_metadata', False)
+    shuffle_buffer = cfgs_data.get('shuffle_buffer', 1000)
+    blocklist_dir = cfgs_data.get('blocklist_dir', None)
+    decode_short_side = cfgs_data.get('decode_short_side', None)
+    zero_copy_decode = cfgs_data.get('zero_copy_decode', False)
+    keyframe_aligned_sampling = cfgs_data.get(
+        'keyframe_aligned_sampling', False)
+    keyframe_max_shift = cfgs_data.get('keyframe_max_shift', None)
+    samples_per_video = cfgs_data.get('samples_per_video', 1)
+    sample_pool_size = cfgs_data.get('sample_pool_size', None)
+    echo_factor = cfgs_data.get('echo_factor', 1)
+    clip_cache_dir = cfgs_data.get('clip_cache_dir', None)
+    clip_cache_size_gb = cfgs_data.get('clip_cache_size_gb', 32.)
+    reader_cache_size = cfgs_data.get('reader_cache_size', 0)
+    reader_cache_gb = cfgs_data.get('reader_cache_gb', 1.)
+    video_backend = cfgs_data.get('video_backend', 'decord')
+    thread_budget = cfgs_data.get('thread_budget', False)
+    decode_timeout = cfgs_data.get('decode_timeout', None)
+    max_hung_decodes = cfgs_data.get('max_hung_decodes', 8)
+    out_of_order = cfgs_data.get('out_of_order', False)
+    if out_of_order and checkpoint_itr_freq > 0:
+        # Mid-epoch checkpoints record how many batches were consumed in
+        # sampler order, which does not tell which batches were consumed
+        # when they are delivered out of order
+        raise ValueError(
+            'out_of_order batches cannot be resumed mid-epoch, '
+            'unset checkpoint_itr_freq or out_of_order')
+    cost_balanced_sampling = cfgs_data.get('cost_balanced_sampling', False)
+    use_sample_index = cfgs_data.get('use_sample_index', False)
+    partition_sample_index = cfgs_data.get('partition_sample_index', False)
+    stratified_sampling = cfgs_data.get('stratified_sampling', False)
+    shared_batch_ring = cfgs_data.get('shared_batch_ring', False)
+    uint8_clips = cfgs_data.get('uint8_clips', False)
     log_resource_util_data = cfgs_data.get('log_resource_utilization', False)
 
     # -- DATA AUGS
@@ -129,6 +174,8 @@ def main(args, resume_preempt=False):
     motion_shift = cfgs_data_aug.get('motion_shift', False)
     reprob = cfgs_data_aug.get('reprob', 0.)
     use_aa = cfgs_data_aug.get('auto_augment', False)
+    tensor_aa = cfgs_data_aug.get('tensor_auto_augment', False)
+    use_batch_transform = cfgs_data_aug.get('batch_transform', False)
 
     # -- LOSS
     cfgs_loss = args.get('loss')
@@ -201,6 +248,7 @@ def main(args, resume_preempt=False):
         ('%.5f', 'pred-grad-norm'),
         ('%d', 'gpu-time(ms)'),
         ('%d', 'wall-time(ms)'),
+        ('%d', 'data-time(ms)'),
     )
 
     # -- init model
@@ -221,6 +269,27 @@ def main(args, resume_preempt=False):
     )
     target_encoder = copy.deepcopy(encoder)
 
+    # -- [optional] shared-memory batch slots, enough for all the batches
+    # in flight (prefetched by every worker, and in use by the main process)
+    batch_ring = None
+    if shared_batch_ring:
+        assert dataset_type.lower() != 'multisourcevideodataset', \
+            'Shared batch slots are not supported with multiple loaders'
+        batch_ring = SharedBatchRing(num_slots=num_batch_slots(num_workers))
+
+    # -- [optional] augmentations applied to whole batches by the collator
+    batch_transform = None
+    if use_batch_transform:
+        batch_transform = make_batch_transforms(
+            random_horizontal_flip=True,
+            random_resize_aspect_ratio=ar_range,
+            random_resize_scale=rr_scale,
+            reprob=reprob,
+            auto_augment=use_aa,
+            motion_shift=motion_shift,
+            crop_size=crop_size,
+            uint8_output=uint8_clips)
+
     # -- make data transforms
     if mask_type == 'multiblock3d':
         logger.info('Initializing basic multi-block mask')
@@ -229,7 +298,10 @@ def main(args, resume_preempt=False):
             num_frames=num_frames,
             patch_size=patch_size,
             tubelet_size=tubelet_size,
-            cfgs_mask=cfgs_mask)
+            cfgs_mask=cfgs_mask,
+            batch_ring=batch_ring,
+            concat_clips=uint8_clips,
+            batch_transform=batch_transform)
     else:
         logger.info('Initializing random tube mask')
         mask_collator = TubeMaskCollator(
@@ -237,7 +309,10 @@ def main(args, resume_preempt=False):
             num_frames=num_frames,
             patch_size=patch_size,
             tubelet_size=tubelet_size,
-            cfgs_mask=cfgs_mask)
+            cfgs_mask=cfgs_mask,
+            batch_ring=batch_ring,
+            concat_clips=uint8_clips,
+            batch_transform=batch_transform)
     transform = make_transforms(
         random_horizontal_flip=True,
         random_resize_aspect_ratio=ar_range,
@@ -245,7 +320,9 @@ def main(args, resume_preempt=False):
         reprob=reprob,
         auto_augment=use_aa,
         motion_shift=motion_shift,
-        crop_size=crop_size)
+        crop_size=crop_size,
+        uint8_output=uint8_clips,
+        tensor_auto_augment=tensor_aa)
 
     # -- init data-loaders/samplers
     (unsupervised_loader,
@@ -260,20 +337,59 @@ def main(args, resume_preempt=False):
          decode_one_clip=decode_one_clip,
          duration=duration,
          num_clips=num_clips,
-         transform=transform,
+         transform=None if batch_transform is not None else transform,
          datasets_weights=datasets_weights,
          collator=mask_collator,
          num_workers=num_workers,
          world_size=world_size,
          pin_mem=pin_mem,
          rank=rank,
-         log_dir=folder if log_resource_util_data else None)
+         log_dir=folder if log_resource_util_data else None,
+         use_video_metadata=use_video_metadata,
+         shuffle_buffer=shuffle_buffer,
+         blocklist_dir=blocklist_dir,
+         decode_short_side=decode_short_side,
+         zero_copy_decode=zero_copy_decode,
+         keyframe_aligned_sampling=keyframe_aligned_sampling,
+         keyframe_max_shift=keyframe_max_shift,
+         samples_per_video=samples_per_video,
+         sample_pool_size=sample_pool_size,
+         echo_factor=echo_factor,
+         clip_cache_dir=clip_cache_dir,
+         clip_cache_size_gb=clip_cache_size_gb,
+         reader_cache_size=reader_cache_size,
+         reader_cache_gb=reader_cache_gb,
+         video_backend=video_backend,
+         thread_budget=thread_budget,
+         decode_timeout=decode_timeout,
+         max_hung_decodes=max_hung_decodes,
+         out_of_order=out_of_order,
+         cost_balanced_sampling=cost_balanced_sampling,
+         use_sample_index=use_sample_index,
+         partition_sample_index=partition_sample_index,
+         stratified_sampling=stratified_sampling,
+         ipe=ipe)
+    if batch_ring is not None:
+        unsupervised_loader = SharedBatchLoader(unsupervised_loader, batch_ring)
     try:
         _dlen = len(unsupervised_loader)
     except Exception:  # Different interface for webdataset
         _dlen = unsupervised_loader.num_batches
     if ipe is None:
         ipe = _dlen
+        if partition_sample_index and world_size > 1:
+            # Ranks hold partitions of slightly different sizes, but must
+            # all run the same number of iterations
+            _ipe = torch.tensor([ipe], device=device)
+            torch.distributed.all_reduce(
+                _ipe, op=torch.distributed.ReduceOp.MIN)
+            ipe = int(_ipe)
+    if out_of_order and ipe < _dlen:
+        # Epochs would end (and be checkpointed) in the middle of a pass
+        # over the loader, see checkpoint_itr_freq above
+        raise ValueError(
+            f'out_of_order batches require epochs of a full pass over the '
+            f'loader ({ipe=} < {_dlen} batches)')
     logger.info(f'iterations per epoch/dataest length: {ipe}/{_dlen}')
 
     # -- init optimizer and scheduler
@@ -302,7 +418,10 @@ def main(args, resume_preempt=False):
     momentum_scheduler = (ema[0] + i*(ema[1]-ema[0])/(ipe*num_epochs*ipe_scale)
                           for i in range(int(ipe*num_epochs*ipe_scale)+1))
 
-    start_epoch = 0
+    start_epoch, start_itr = 0, 0
+    # Number of batches consumed from the current pass over the loader,
+    # which may span several epochs
+    loader_itr = 0
     # -- load training checkpoint
     if load_model or os.path.exists(latest_path):
         (
@@ -312,20 +431,37 @@ def main(args, resume_preempt=False):
             optimizer,
             scaler,
             start_epoch,
+            start_itr,
+            loader_itr,
         ) = load_checkpoint(
             r_path=load_path,
             encoder=encoder,
             predictor=predictor,
             target_encoder=target_encoder,
             opt=optimizer,
-            scaler=scaler)
-        for _ in range(start_epoch * ipe):
+            scaler=scaler,
+            sampler=(unsupervised_sampler
+                     if hasattr(unsupervised_sampler, 'load_state_dict')
+                     else None),
+            mask_collator=mask_collator,
+            rank=rank,
+            world_size=world_size)
+        for _ in range(start_epoch * ipe + start_itr):
             scheduler.step()
             wd_scheduler.step()
             next(momentum_scheduler)
-            mask_collator.step()
 
-    def save_checkpoint(epoch, path):
+    def save_checkpoint(epoch, path, itr=0):
+        # Position of every rank in its pass over the loader (gathered before
+        # only rank 0 saves the checkpoint)
+        sampler_states = None
+        if hasattr(unsupervised_sampler, 'state_dict'):
+            sampler_state = unsupervised_sampler.state_dict(loader_itr)
+            sampler_states = [sampler_state]
+            if world_size > 1:
+                sampler_states = [None] * world_size
+                torch.distributed.all_gather_object(
+                    sampler_states, sampler_state)
         if rank != 0:
             return
         save_dict = {
@@ -335,6 +471,10 @@ def main(args, resume_preempt=False):
             'scaler': None if scaler is None else scaler.state_dict(),
             'target_encoder': target_encoder.state_dict(),
             'epoch': epoch,
+            'itr': itr,
+            'loader_itr': loader_itr,
+            'sampler': sampler_states,
+            'mask_collator': mask_collator.state_dict(epoch * ipe + itr),
             'loss': loss_meter.avg,
             'batch_size': batch_size,
             'world_size': world_size,
@@ -346,19 +486,9 @@ def main(args, resume_preempt=False):
             logger.info(f'Encountered exception when saving checkpoint: {e}')
 
     logger.info('Initializing loader...')
-    loader = iter(unsupervised_loader)
-
-    if skip_batches > 0:
-        logger.info(f'Skip {skip_batches} batches')
+    if loader_itr == 0:
         unsupervised_sampler.set_epoch(start_epoch)
-        for itr in range(skip_batches):
-            if itr % 10 == 0:
-                logger.info(f'Skip {itr}/{skip_batches} batches')
-            try:
-                udata = next(loader)
-            except Exception:
-                loader = iter(unsupervised_loader)
-                udata = next(loader)
+    loader = iter(unsupervised_loader)
 
     # -- TRAINING LOOP
     for epoch in range(start_epoch, num_epochs):
@@ -375,8 +505,9 @@ def main(args, resume_preempt=False):
         mask_meters = [AverageMeter() for _ in range(len(cfgs_mask))]
         gpu_time_meter = AverageMeter()
         wall_time_meter = AverageMeter()
+        data_time_meter = AverageMeter()
 
-        for itr in range(ipe):
+        for itr in range(start_itr if epoch == start_epoch else 0, ipe):
             itr_start_time = time.time()
 
             try:
@@ -384,7 +515,12 @@ def main(args, resume_preempt=False):
             except Exception:
                 logger.info('Exhausted data loaders. Refreshing...')
                 loader = iter(unsupervised_loader)
+                loader_itr = 0
                 udata, masks_enc, masks_pred = next(loader)
+            loader_itr += 1
+            # Time spent waiting for the data loader
+            data_elapsed_time_ms = (time.time() - itr_start_time) * 1000.
+            data_time_meter.update(data_elapsed_time_ms)
             assert len(masks_enc) == len(masks_pred), \
                 'Currently require num encoder masks = num predictor masks'
 
@@ -392,7 +528,16 @@ def main(args, resume_preempt=False):
                 # -- unsupervised video clips
                 # Put each clip on the GPU and concatenate along batch
                 # dimension
-                clips = torch.cat([u.to(device, non_blocking=True) for u in udata[0]], dim=0)
+                if uint8_clips:
+                    # Clips come as a single uint8 tensor, converted to
+                    # normalized dtype clips on the GPU
+                    clips = uint8_normalize(
+                        udata[0].to(device, non_blocking=True),
+                        *transform.normalize, dtype=dtype, reprob=reprob)
+                else:
+                    clips = torch.cat(
+                        [u.to(device, non_blocking=True) for u in udata[0]],
+                        dim=0)
 
                 # Put each mask-enc/mask-pred pair on the GPU and reuse the
                 # same mask pair for each clip
@@ -519,7 +664,8 @@ def main(args, resume_preempt=False):
                     grad_stats.global_norm,
                     grad_stats_pred.global_norm,
                     gpu_etime_ms,
-                    iter_elapsed_time_ms)
+                    iter_elapsed_time_ms,
+                    data_elapsed_time_ms)
                 if (itr % log_freq == 0) or np.isnan(loss) or np.isinf(loss):
                     logger.info(
                         '[%d, %5d] loss: %.3f | p%.3f r%.3f | '
@@ -529,6 +675,7 @@ def main(args, resume_preempt=False):
                         '[mem: %.2e] '
                         '[gpu: %.1f ms]'
                         '[wall: %.1f ms]'
+                        '[data: %.1f ms]'
                         % (epoch + 1, itr,
                            loss_meter.avg,
                            jepa_loss_meter.avg,
@@ -540,7 +687,8 @@ def main(args, resume_preempt=False):
                            _new_lr,
                            torch.cuda.max_memory_allocated() / 1024.0**2,
                            gpu_time_meter.avg,
-                           wall_time_meter.avg))
+                           wall_time_meter.avg,
+                           data_time_meter.avg))
 
                     if optim_stats is not None:
                         logger.info(
@@ -575,6 +723,32 @@ def main(args, resume_preempt=False):
             log_stats()
             assert not np.isnan(loss), 'loss is nan'
 
+            # -- Save mid-epoch checkpoint, resumed from the next batch
+            if (checkpoint_itr_freq > 0
+                    and (itr + 1) % checkpoint_itr_freq == 0
+                    and itr + 1 < ipe):
+                save_checkpoint(epoch, latest_path, itr=itr + 1)
+
+        # -- Log data loading stats
+        logger.info(
+            'waited %.1f ms/itr for data (%.1f%% of wall time)'
+            % (data_time_meter.avg,
+               100. * data_time_meter.sum / max(wall_time_meter.sum, 1e-6)))
+        if world_size > 1:
+            # Data wait time of every rank, to spot stragglers
+            data_times = [
+                torch.zeros(1, device=device) for _ in range(world_size)]
+            torch.distributed.all_gather(
+                data_times,
+                torch.tensor([data_time_meter.avg], device=device))
+            logger.info(
+                'data wait per rank (ms/itr): [%s]'
+                % ', '.join('%.1f' % float(t) for t in data_times))
+        data_source = getattr(
+            unsupervised_loader, 'dataset', unsupervised_loader)
+        if hasattr(data_source, 'log_stats'):
+            data_source.log_stats()
+
         # -- Save Checkpoint
         logger.info('avg. loss %.3f' % loss_meter.avg)
         # -- Save Last
@@ -5,10 +5,16 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import numpy as np
+
 import torch
 import torchvision.transforms as transforms
 
 import src.datasets.utils.video.transforms as video_transforms
+from src.datasets.utils.video.batch_transforms import (
+    BatchVideoTransform,
+    random_erase,
+)
 from src.datasets.utils.video.randerase import RandomErasing
 
 
@@ -21,7 +27,9 @@ def make_transforms(
     motion_shift=False,
     crop_size=224,
     normalize=((0.485, 0.456, 0.406),
-               (0.229, 0.224, 0.225))
+               (0.229, 0.224, 0.225)),
+    uint8_output=False,
+    tensor_auto_augment=False,
 ):
 
     _frames_augmentation = VideoTransform(
@@ -33,10 +41,41 @@ def make_transforms(
         motion_shift=motion_shift,
         crop_size=crop_size,
         normalize=normalize,
+        uint8_output=uint8_output,
+        tensor_auto_augment=tensor_auto_augment,
     )
     return _frames_augmentation
 
 
+def make_batch_transforms(
+    random_horizontal_flip=True,
+    random_resize_aspect_ratio=(3/4, 4/3),
+    random_resize_scale=(0.3, 1.0),
+    reprob=0.0,
+    auto_augment=False,
+    motion_shift=False,
+    crop_size=224,
+    normalize=((0.485, 0.456, 0.406),
+               (0.229, 0.224, 0.225)),
+    uint8_output=False,
+):
+    """
+    Augmentations applied to whole batches by the collator (see
+    BatchVideoTransform)
+    """
+    return BatchVideoTransform(
+        random_horizontal_flip=random_horizontal_flip,
+        random_resize_aspect_ratio=random_resize_aspect_ratio,
+        random_resize_scale=random_resize_scale,
+        reprob=reprob,
+        auto_augment=auto_augment,
+        motion_shift=motion_shift,
+        crop_size=crop_size,
+        normalize=normalize,
+        uint8_output=uint8_output,
+    )
+
+
 class VideoTransform(object):
 
     def __init__(
@@ -49,26 +88,34 @@ class VideoTransform(object):
         motion_shift=False,
         crop_size=224,
         normalize=((0.485, 0.456, 0.406),
-                   (0.229, 0.224, 0.225))
+                   (0.229, 0.224, 0.225)),
+        uint8_output=False,
+        tensor_auto_augment=False,
     ):
 
+        # [Optional] Output cropped uint8 clips, normalized (and randomly
+        # erased) later on the training device (see uint8_normalize)
+        self.uint8_output = uint8_output
+        self.normalize = normalize
+
         self.random_horizontal_flip = random_horizontal_flip
         self.random_resize_aspect_ratio = random_resize_aspect_ratio
         self.random_resize_scale = random_resize_scale
         self.auto_augment = auto_augment
         self.motion_shift = motion_shift
         self.crop_size = crop_size
-        self.mean = torch.tensor(normalize[0], dtype=torch.float32)
-        self.std = torch.tensor(normalize[1], dtype=torch.float32)
-        if not self.auto_augment:
-            # Without auto-augment, PIL and tensor conversions simply scale uint8 space by 255.
-            self.mean *= 255.
-            self.std *= 255.
+        # Clips are normalized in uint8 space
+        self.mean = torch.tensor(normalize[0], dtype=torch.float32) * 255.
+        self.std = torch.tensor(normalize[1], dtype=torch.float32) * 255.
 
+        # [Optional] RandAugment of whole uint8 clips by tensor ops, rather
+        # than of every frame as a PIL image
+        self.tensor_auto_augment = tensor_auto_augment
         self.autoaug_transform = video_transforms.create_random_augment(
             input_size=(crop_size, crop_size),
             auto_augment='rand-m7-n4-mstd0.5-inc1',
             interpolation='bicubic',
+            tensor=tensor_auto_augment,
         )
 
         self.spatial_transform = video_transforms.random_resized_crop_with_shift \
@@ -85,14 +132,18 @@ class VideoTransform(object):
 
     def __call__(self, buffer):
 
-        if self.auto_augment:
-            buffer = [transforms.ToPILImage()(frame) for frame in buffer]
+        # Keep the decoded uint8 frames, only the cropped region is
+        # converted to float by the spatial transform
+        buffer = torch.from_numpy(np.asarray(buffer))
+        if self.auto_augment and self.tensor_auto_augment:
+            buffer = buffer.permute(0, 3, 1, 2)  # T H W C -> T C H W
+            buffer = self.autoaug_transform(buffer).permute(0, 2, 3, 1)
+        elif self.auto_augment:
+            buffer = [
+                transforms.ToPILImage()(frame) for frame in buffer.numpy()]
             buffer = self.autoaug_transform(buffer)
-            buffer = [transforms.ToTensor()(img) for img in buffer]
-            buffer = torch.stack(buffer)  # T C H W
-            buffer = buffer.permute(0, 2, 3, 1)  # T H W C
-        else:
-            buffer = torch.tensor(buffer, dtype=torch.float32)
+            buffer = np.stack([np.asarray(img) for img in buffer])
+            buffer = torch.from_numpy(buffer)
 
         buffer = buffer.permute(3, 0, 1, 2)  # T H W C -> C T H W
 
@@ -106,6 +157,9 @@ class VideoTransform(object):
         if self.random_horizontal_flip:
             buffer, _ = video_transforms.horizontal_flip(0.5, buffer)
 
+        if self.uint8_output:
+            return buffer.round_().clamp_(0, 255).to(torch.uint8)
+
         buffer = _tensor_normalize_inplace(buffer, self.mean, self.std)
         if self.reprob > 0:
             buffer = buffer.permute(1, 0, 2, 3)
@@ -135,6 +189,30 @@ def tensor_normalize(tensor, mean, std):
     return tensor
 
 
+def uint8_normalize(clips, mean, std, dtype=torch.float32, reprob=0.0):
+    """
+    Convert uint8 clips to normalized clips of the given dtype, in a single
+    fused operation (meant to run on the training device), computed in
+    float32 before casting to dtype.
+    Args:
+        clips (tensor): uint8 clips (with dimensions B, C, T, H, W).
+        mean (tensor or list): mean value to subtract (in 0 to 1 floats).
+        std (tensor or list): std to divide (in 0 to 1 floats).
+        reprob (float): probability of randomly erasing a box of every clip
+            after normalization (see random_erase).
+    """
+    device = clips.device
+    mean = torch.as_tensor(mean, dtype=torch.float32, device=device)
+    std = torch.as_tensor(std, dtype=torch.float32, device=device)
+    mean, std = mean.view(1, -1, 1, 1, 1), std.view(1, -1, 1, 1, 1)
+    # (x / 255 - mean) / std = x * scale + bias
+    scale, bias = 1. / (255. * std), -mean / std
+    clips = torch.addcmul(bias, clips.float(), scale)
+    if reprob > 0:
+        clips = random_erase(clips, reprob)
+    return clips.to(dtype)
+
+
 def _tensor_normalize_inplace(tensor, mean, std):
     """
     Normalize a given tensor by subtracting the mean and dividing the std.
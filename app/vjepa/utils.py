@@ -32,13 +32,17 @@ def load_checkpoint(
     target_encoder,
     opt,
     scaler,
+    sampler=None,
+    mask_collator=None,
+    rank=0,
+    world_size=1,
 ):
     try:
         checkpoint = torch.load(r_path, map_location=torch.device('cpu'))
     except Exception as e:
         logger.info(f'Encountered exception when loading checkpoint {e}')
 
-    epoch = 0
+    epoch, itr, loader_itr = 0, 0, 0
     try:
         epoch = checkpoint['epoch']
 
@@ -66,12 +70,27 @@ def load_checkpoint(
         if scaler is not None:
             scaler.load_state_dict(checkpoint['scaler'])
         logger.info(f'loaded optimizers from epoch {epoch}')
+
+        # -- loading position in the epoch (sampler and mask collator)
+        itr = checkpoint.get('itr', 0)
+        sampler_states = checkpoint.get('sampler')
+        if sampler is not None and sampler_states is not None:
+            if len(sampler_states) == world_size:
+                sampler.load_state_dict(sampler_states[rank])
+                loader_itr = checkpoint['loader_itr']
+                logger.info(f'loaded sampler state from epoch {epoch} '
+                            f'itr {itr}: {sampler_states[rank]}')
+            else:
+                logger.info('world size changed; not loading the sampler state')
+        if (mask_collator is not None
+                and checkpoint.get('mask_collator') is not None):
+            mask_collator.load_state_dict(checkpoint['mask_collator'])
         logger.info(f'read-path: {r_path}')
         del checkpoint
 
     except Exception as e:
         logger.info(f'Encountered exception when loading checkpoint {e}')
-        epoch = 0
+        epoch, itr, loader_itr = 0, 0, 0
 
     return (
         encoder,
@@ -80,6 +99,8 @@ def load_checkpoint(
         opt,
         scaler,
         epoch,
+        itr,
+        loader_itr,
     )
 
 
@@ -98,6 +98,10 @@ def main(args_eval, resume_preempt=False):
     eval_frame_step = args_pretrain.get('frame_step', 4)
     eval_duration = args_pretrain.get('clip_duration', None)
     eval_num_views_per_segment = args_data.get('num_views_per_segment', 1)
+    clip_cache_dir = args_data.get('clip_cache_dir', None)
+    clip_cache_size_gb = args_data.get('clip_cache_size_gb', 32.)
+    deterministic_val_clips = args_data.get('deterministic_val_clips', False)
+    tensor_auto_augment = args_data.get('tensor_auto_augment', False)
 
     # -- OPTIMIZATION
     args_opt = args_eval.get('optimization')
@@ -199,6 +203,9 @@ def main(args_eval, resume_preempt=False):
         batch_size=batch_size,
         world_size=world_size,
         rank=rank,
+        clip_cache_dir=clip_cache_dir,
+        clip_cache_size_gb=clip_cache_size_gb,
+        tensor_auto_augment=tensor_auto_augment,
         training=True)
     val_loader = make_dataloader(
         dataset_type=dataset_type,
@@ -213,6 +220,9 @@ def main(args_eval, resume_preempt=False):
         batch_size=batch_size,
         world_size=world_size,
         rank=rank,
+        clip_cache_dir=clip_cache_dir,
+        clip_cache_size_gb=clip_cache_size_gb,
+        deterministic_clips=deterministic_val_clips,
         training=False)
     ipe = len(train_loader)
     logger.info(f'Dataloader created... iterations per epoch: {ipe}')
@@ -290,6 +300,9 @@ def main(args_eval, resume_preempt=False):
             use_bfloat16=use_bfloat16)
 
         logger.info('[%5d] train: %.3f%% test: %.3f%%' % (epoch + 1, train_acc, val_acc))
+        for loader in (train_loader, val_loader):
+            if hasattr(loader.dataset, 'log_stats'):
+                loader.dataset.log_stats()
         if rank == 0:
             csv_logger.log(epoch + 1, train_acc, val_acc)
         save_checkpoint(epoch + 1)
@@ -454,8 +467,15 @@ def make_dataloader(
     allow_segment_overlap=True,
     training=False,
     num_workers=12,
-    subset_file=None
+    subset_file=None,
+    clip_cache_dir=None,
+    clip_cache_size_gb=32.,
+    deterministic_clips=False,
+    tensor_auto_augment=False,
 ):
+    if deterministic_clips and not training:
+        logger.info('Sampling validation clips at the start of their segment')
+
     # Make Video Transforms
     transform = make_transforms(
         training=training,
@@ -467,6 +487,7 @@ def make_dataloader(
         auto_augment=True,
         motion_shift=False,
         crop_size=resolution,
+        tensor_auto_augment=tensor_auto_augment,
     )
 
     data_loader, _ = init_data(
@@ -484,7 +505,10 @@ def make_dataloader(
         num_workers=num_workers,
         copy_data=False,
         drop_last=False,
-        subset_file=subset_file)
+        subset_file=subset_file,
+        random_clip_sampling=training or not deterministic_clips,
+        clip_cache_dir=clip_cache_dir,
+        clip_cache_size_gb=clip_cache_size_gb)
     return data_loader
 
 
@@ -170,7 +170,8 @@ def make_transforms(
     crop_size=224,
     num_views_per_clip=1,
     normalize=((0.485, 0.456, 0.406),
-               (0.229, 0.224, 0.225))
+               (0.229, 0.224, 0.225)),
+    tensor_auto_augment=False,
 ):
 
     if not training and num_views_per_clip > 1:
@@ -192,6 +193,7 @@ def make_transforms(
             motion_shift=motion_shift,
             crop_size=crop_size,
             normalize=normalize,
+            tensor_auto_augment=tensor_auto_augment,
         )
     return _frames_augmentation
 
@@ -209,7 +211,8 @@ class VideoTransform(object):
         motion_shift=False,
         crop_size=224,
         normalize=((0.485, 0.456, 0.406),
-                   (0.229, 0.224, 0.225))
+                   (0.229, 0.224, 0.225)),
+        tensor_auto_augment=False,
     ):
 
         self.training = training
@@ -230,10 +233,14 @@ class VideoTransform(object):
         self.crop_size = crop_size
         self.normalize = torch.tensor(normalize)
 
+        # [Optional] RandAugment of whole uint8 clips by tensor ops, rather
+        # than of every frame as a PIL image
+        self.tensor_auto_augment = tensor_auto_augment
         self.autoaug_transform = video_transforms.create_random_augment(
             input_size=(crop_size, crop_size),
             auto_augment='rand-m7-n4-mstd0.5-inc1',
             interpolation='bicubic',
+            tensor=tensor_auto_augment,
         )
 
         self.spatial_transform = video_transforms.random_resized_crop_with_shift \
@@ -253,16 +260,19 @@ class VideoTransform(object):
         if not self.training:
             return [self.eval_transform(buffer)]
 
-        buffer = [transforms.ToPILImage()(frame) for frame in buffer]
-
-        if self.auto_augment:
+        # Keep the decoded uint8 frames, only the cropped region is
+        # converted to float by the spatial transform
+        buffer = torch.from_numpy(np.asarray(buffer))
+        if self.auto_augment and self.tensor_auto_augment:
+            buffer = buffer.permute(0, 3, 1, 2)  # T H W C -> T C H W
+            buffer = self.autoaug_transform(buffer).permute(0, 2, 3, 1)
+        elif self.auto_augment:
+            buffer = [
+                transforms.ToPILImage()(frame) for frame in buffer.numpy()]
             buffer = self.autoaug_transform(buffer)
+            buffer = np.stack([np.asarray(img) for img in buffer])
+            buffer = torch.from_numpy(buffer)
 
-        buffer = [transforms.ToTensor()(img) for img in buffer]
-        buffer = torch.stack(buffer)  # T C H W
-        buffer = buffer.permute(0, 2, 3, 1)  # T H W C
-
-        buffer = tensor_normalize(buffer, self.normalize[0], self.normalize[1])
         buffer = buffer.permute(3, 0, 1, 2)  # T H W C -> C T H W
 
         buffer = self.spatial_transform(
@@ -272,6 +282,10 @@ class VideoTransform(object):
             scale=self.random_resize_scale,
             ratio=self.random_resize_aspect_ratio,
         )
+        buffer = buffer.div_(255.)
+        mean = self.normalize[0].view(-1, 1, 1, 1)
+        std = self.normalize[1].view(-1, 1, 1, 1)
+        buffer = buffer.sub_(mean).div_(std)
         if self.random_horizontal_flip:
             buffer, _ = video_transforms.horizontal_flip(0.5, buffer)
 
@@ -0,0 +1,359 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import os
+
+from logging import getLogger
+
+import numpy as np
+
+import torch
+
+from src.datasets.utils.thread_budget import ThreadBudget
+from src.datasets.utils.video.functional import get_resize_sizes
+from src.datasets.utils.weighted_sampler import (
+    DistributedWeightedSampler,
+    ResumableSampler,
+)
+from src.datasets.video_dataset import read_video_list, sample_clip_indices
+
+_GLOBAL_SEED = 0
+logger = getLogger()
+
+# Each record of a shard index points to the contiguous [num_frames, height,
+# width, 3] uint8 frames of one video inside one of the shard files
+_INDEX_FNAME = 'index.npy'
+_SHARD_FNAME = 'shard_{:05d}.bin'
+_INDEX_DTYPE = np.dtype([
+    ('shard', np.int32),
+    ('offset', np.int64),
+    ('num_frames', np.int32),
+    ('height', np.int32),
+    ('width', np.int32),
+    ('fps', np.float32),
+    ('size', np.int64),
+    ('label', np.int64),
+])
+
+
+def make_clipsharddataset(
+    data_paths,
+    batch_size,
+    frames_per_clip=8,
+    frame_step=4,
+    num_clips=1,
+    random_clip_sampling=True,
+    allow_clip_overlap=False,
+    filter_short_videos=False,
+    filter_long_videos=int(10**9),
+    transform=None,
+    shared_transform=None,
+    rank=0,
+    world_size=1,
+    datasets_weights=None,
+    collator=None,
+    drop_last=True,
+    num_workers=10,
+    pin_mem=True,
+    duration=None,
+    log_dir=None,
+    thread_budget=False,
+):
+    # [Optional] Split cores between workers and their torch threads (clips
+    # are read from the shards, not decoded)
+    worker_init_fn = None
+    if thread_budget:
+        worker_init_fn = ThreadBudget(num_workers)
+        num_workers = worker_init_fn.num_workers
+
+    dataset = ClipShardDataset(
+        data_paths=data_paths,
+        datasets_weights=datasets_weights,
+        frames_per_clip=frames_per_clip,
+        frame_step=frame_step,
+        num_clips=num_clips,
+        random_clip_sampling=random_clip_sampling,
+        allow_clip_overlap=allow_clip_overlap,
+        filter_short_videos=filter_short_videos,
+        filter_long_videos=filter_long_videos,
+        duration=duration,
+        shared_transform=shared_transform,
+        transform=transform)
+
+    logger.info('ClipShardDataset dataset created')
+    if datasets_weights is not None:
+        dist_sampler = DistributedWeightedSampler(
+            dataset.sample_weights,
+            num_replicas=world_size,
+            rank=rank,
+            shuffle=True)
+    else:
+        dist_sampler = torch.utils.data.distributed.DistributedSampler(
+            dataset,
+            num_replicas=world_size,
+            rank=rank,
+            shuffle=True)
+    dist_sampler = ResumableSampler(dist_sampler, batch_size=batch_size)
+
+    data_loader = torch.utils.data.DataLoader(
+        dataset,
+        collate_fn=collator,
+        sampler=dist_sampler,
+        batch_size=batch_size,
+        drop_last=drop_last,
+        pin_memory=pin_mem,
+        num_workers=num_workers,
+        worker_init_fn=worker_init_fn,
+        persistent_workers=num_workers > 0)
+    logger.info('ClipShardDataset unsupervised data loader created')
+
+    return dataset, data_loader, dist_sampler
+
+
+class ClipShardDataset(torch.utils.data.Dataset):
+    """
+    Video dataset reading pre-decoded uint8 frames from memory-mapped shard
+    files (see write_clip_shards), so that loading a clip is a slice of the
+    shard rather than a decode of the original container.
+    """
+
+    def __init__(
+        self,
+        data_paths,
+        datasets_weights=None,
+        frames_per_clip=16,
+        frame_step=4,
+        num_clips=1,
+        transform=None,
+        shared_transform=None,
+        random_clip_sampling=True,
+        allow_clip_overlap=False,
+        filter_short_videos=False,
+        filter_long_videos=int(10**9),
+        duration=None,  # duration in seconds
+    ):
+        self.data_paths = data_paths
+        self.datasets_weights = datasets_weights
+        self.frames_per_clip = frames_per_clip
+        self.frame_step = frame_step
+        self.num_clips = num_clips
+        self.transform = transform
+        self.shared_transform = shared_transform
+        self.random_clip_sampling = random_clip_sampling
+        self.allow_clip_overlap = allow_clip_overlap
+        self.filter_short_videos = filter_short_videos
+        self.filter_long_videos = filter_long_videos
+        self.duration = duration
+
+        # Load shard indices; each entry in data_paths is a directory
+        # produced by write_clip_shards from one .csv/.npy dataset file
+        records, dataset_ids = [], []
+        self.num_samples_per_dataset = []
+        for data_path in self.data_paths:
+            index = np.load(os.path.join(data_path, _INDEX_FNAME))
+            keep = index['size'] <= self.filter_long_videos
+            if self.filter_short_videos:
+                clip_len = \
+                    self._frame_steps(index['fps']) * self.frames_per_clip
+                keep &= index['num_frames'] >= clip_len
+            index = index[keep]
+            records.append(index)
+            dataset_ids.append(
+                np.full(len(index), len(records) - 1, dtype=np.int32))
+            self.num_samples_per_dataset.append(len(index))
+        self.records = np.concatenate(records)
+        self.dataset_ids = np.concatenate(dataset_ids)
+        logger.info(f'Loaded {len(self.records)} clip shard records')
+
+        # [Optional] Weights for each sample to be used by downstream
+        # weighted video sampler
+        self.sample_weights = None
+        if self.datasets_weights is not None:
+            self.sample_weights = []
+            num_samples = self.num_samples_per_dataset
+            for dw, ns in zip(self.datasets_weights, num_samples):
+                self.sample_weights += [dw / ns] * ns
+
+        # Shard memory-maps are opened lazily in each worker process
+        self._shards = {}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_shards'] = {}
+        return state
+
+    def _frame_steps(self, fps):
+        if self.duration is None:
+            return np.full_like(fps, self.frame_step, dtype=np.int64)
+        return (self.duration * fps / self.frames_per_clip).astype(np.int64)
+
+    def _get_shard(self, shard_dir, shard):
+        key = (shard_dir, int(shard))
+        if key not in self._shards:
+            fname = os.path.join(shard_dir, _SHARD_FNAME.format(int(shard)))
+            self._shards[key] = np.memmap(fname, dtype=np.uint8, mode='r')
+        return self._shards[key]
+
+    def __getitem__(self, index):
+        record = self.records[index]
+        buffer, clip_indices = self.loadvideo_shard(index)  # [T H W 3]
+
+        # Label/annotations for video
+        label = int(record['label'])
+
+        def split_into_clips(video):
+            """ Split video into a list of clips """
+            fpc = self.frames_per_clip
+            nc = self.num_clips
+            return [video[i*fpc:(i+1)*fpc] for i in range(nc)]
+
+        # Parse video into frames & apply data augmentations
+        if self.shared_transform is not None:
+            buffer = self.shared_transform(buffer)
+        buffer = split_into_clips(buffer)
+        if self.transform is not None:
+            buffer = [self.transform(clip) for clip in buffer]
+
+        return buffer, label, clip_indices
+
+    def loadvideo_shard(self, index):
+        """ Slice sampled frames out of the memory-mapped shard """
+        record = self.records[index]
+        vlen = int(record['num_frames'])
+        h, w = int(record['height']), int(record['width'])
+
+        fpc = self.frames_per_clip
+        fstp = int(self._frame_steps(np.asarray(record['fps'])))
+
+        all_indices, clip_indices = sample_clip_indices(
+            vlen=vlen,
+            frames_per_clip=fpc,
+            frame_step=fstp,
+            num_clips=self.num_clips,
+            random_clip_sampling=self.random_clip_sampling,
+            allow_clip_overlap=self.allow_clip_overlap)
+
+        shard = self._get_shard(
+            self.data_paths[self.dataset_ids[index]], record['shard'])
+        offset = int(record['offset'])
+        video = shard[offset:offset + vlen * h * w * 3].reshape(vlen, h, w, 3)
+        buffer = video[np.asarray(all_indices)]
+        return buffer, clip_indices
+
+    def __len__(self):
+        return len(self.records)
+
+
+def write_clip_shards(
+    data_path,
+    out_dir,
+    short_side=256,
+    max_frames=None,
+    shard_size=4 * 1024**3,
+    chunk_size=64,
+):
+    """
+    Decode every video listed in a .csv/.npy dataset file and write its frames,
+    resized to the given short side, as raw uint8 arrays into shard files of
+    roughly shard_size bytes, along with an index of per-video offsets.
+
+    :param data_path: .csv/.npy dataset file (same format as VideoDataset)
+    :param out_dir: directory in which to write the shards and index
+    :param short_side: short side (in pixels) of the stored frames
+    :param max_frames: [optional] maximum number of frames stored per video
+    :param shard_size: size (in bytes) after which a new shard is started
+    :param chunk_size: number of frames decoded at a time
+    """
+    from decord import VideoReader, cpu
+
+    os.makedirs(out_dir, exist_ok=True)
+    samples, labels = read_video_list(data_path)
+
+    records = []
+    shard, offset = 0, 0
+    f = open(os.path.join(out_dir, _SHARD_FNAME.format(shard)), 'wb')
+    for i, (fname, label) in enumerate(zip(samples, labels)):
+        if i % 1000 == 0:
+            logger.info(
+                f'[{i}/{len(samples)}] writing clip shards to {out_dir}')
+
+        try:
+            vr = VideoReader(fname, num_threads=-1, ctx=cpu(0))
+            h, w = vr[0].shape[:2]
+            if short_side is not None and min(h, w) > short_side:
+                h, w = get_resize_sizes(h, w, short_side)
+            vr = VideoReader(
+                fname, width=w, height=h, num_threads=-1, ctx=cpu(0))
+            fps = vr.get_avg_fps()
+            num_frames = len(vr)
+            if max_frames is not None:
+                num_frames = min(num_frames, max_frames)
+        except Exception as e:
+            logger.info(f'skipping unreadable video {fname=} ({e})')
+            continue
+
+        if offset > 0 and offset + num_frames * h * w * 3 > shard_size:
+            f.close()
+            shard, offset = shard + 1, 0
+            f = open(os.path.join(out_dir, _SHARD_FNAME.format(shard)), 'wb')
+
+        start = offset
+        try:
+            for s in range(0, num_frames, chunk_size):
+                frames = vr.get_batch(
+                    range(s, min(s + chunk_size, num_frames))).asnumpy()
+                f.write(np.ascontiguousarray(frames, dtype=np.uint8).tobytes())
+                offset += frames.nbytes
+        except Exception as e:
+            # Drop the partially written video
+            logger.info(f'skipping video that failed to decode {fname=} ({e})')
+            f.seek(start)
+            f.truncate()
+            offset = start
+            continue
+
+        records.append((
+            shard, start, num_frames, h, w, fps, os.path.getsize(fname),
+            int(label)))
+
+    f.close()
+    index = np.array(records, dtype=_INDEX_DTYPE)
+    np.save(os.path.join(out_dir, _INDEX_FNAME), index)
+    logger.info(
+        f'Wrote {len(index)}/{len(samples)} videos into {shard + 1} shards')
+    return index
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--data-path', type=str, required=True,
+        help='.csv/.npy dataset file listing the videos to convert')
+    parser.add_argument(
+        '--out-dir', type=str, required=True,
+        help='directory in which to write the clip shards')
+    parser.add_argument(
+        '--short-side', type=int, default=256,
+        help='short side (in pixels) of the stored frames')
+    parser.add_argument(
+        '--max-frames', type=int, default=None,
+        help='maximum number of frames stored per video')
+    parser.add_argument(
+        '--shard-size-gb', type=float, default=4.,
+        help='approximate size of each shard file (in GB)')
+    args = parser.parse_args()
+
+    write_clip_shards(
+        data_path=args.data_path,
+        out_dir=args.out_dir,
+        short_side=args.short_side,
+        max_frames=args.max_frames,
+        shard_size=int(args.shard_size_gb * 1024**3))
@@ -43,6 +43,29 @@ def init_data(
     repeat_wds=False,
     ipe=300,
     log_dir=None,
+    use_video_metadata=False,
+    shuffle_buffer=1000,
+    blocklist_dir=None,
+    decode_short_side=None,
+    zero_copy_decode=False,
+    keyframe_aligned_sampling=False,
+    keyframe_max_shift=None,
+    samples_per_video=1,
+    sample_pool_size=None,
+    echo_factor=1,
+    clip_cache_dir=None,
+    clip_cache_size_gb=32.,
+    reader_cache_size=0,
+    reader_cache_gb=1.,
+    video_backend='decord',
+    thread_budget=False,
+    decode_timeout=None,
+    max_hung_decodes=8,
+    out_of_order=False,
+    cost_balanced_sampling=False,
+    use_sample_index=False,
+    partition_sample_index=False,
+    stratified_sampling=False,
 ):
 
     if (data.lower() == 'imagenet') \
@@ -63,7 +86,8 @@ def init_data(
             persistent_workers=persistent_workers,
             copy_data=copy_data,
             drop_last=drop_last,
-            subset_file=subset_file)
+            subset_file=subset_file,
+            thread_budget=thread_budget)
 
     elif data.lower() == 'videodataset':
         from src.datasets.video_dataset import make_videodataset
@@ -86,6 +110,128 @@ def init_data(
             world_size=world_size,
             rank=rank,
             drop_last=drop_last,
-            log_dir=log_dir)
+            log_dir=log_dir,
+            use_video_metadata=use_video_metadata,
+            blocklist_dir=blocklist_dir,
+            decode_short_side=decode_short_side,
+            zero_copy_decode=zero_copy_decode,
+            keyframe_aligned_sampling=keyframe_aligned_sampling,
+            keyframe_max_shift=keyframe_max_shift,
+            samples_per_video=samples_per_video,
+            sample_pool_size=sample_pool_size,
+            echo_factor=echo_factor,
+            clip_cache_dir=clip_cache_dir,
+            clip_cache_size_gb=clip_cache_size_gb,
+            reader_cache_size=reader_cache_size,
+            reader_cache_gb=reader_cache_gb,
+            video_backend=video_backend,
+            thread_budget=thread_budget,
+            decode_timeout=decode_timeout,
+            max_hung_decodes=max_hung_decodes,
+            out_of_order=out_of_order,
+            cost_balanced_sampling=cost_balanced_sampling,
+            use_sample_index=use_sample_index,
+            partition_sample_index=partition_sample_index,
+            stratified_sampling=stratified_sampling)
+
+    elif data.lower() == 'multisourcevideodataset':
+        from src.datasets.multi_source_dataset import (
+            make_multisourcevideodataset,
+        )
+        dataset, data_loader, dist_sampler = make_multisourcevideodataset(
+            data_paths=root_path,
+            batch_size=batch_size,
+            frames_per_clip=clip_len,
+            frame_step=frame_sample_rate,
+            duration=duration,
+            num_clips=num_clips,
+            random_clip_sampling=random_clip_sampling,
+            allow_clip_overlap=allow_clip_overlap,
+            filter_short_videos=filter_short_videos,
+            filter_long_videos=filter_long_videos,
+            shared_transform=shared_transform,
+            transform=transform,
+            datasets_weights=datasets_weights,
+            collator=collator,
+            num_workers=num_workers,
+            pin_mem=pin_mem,
+            world_size=world_size,
+            rank=rank,
+            drop_last=drop_last,
+            log_dir=log_dir,
+            use_video_metadata=use_video_metadata,
+            blocklist_dir=blocklist_dir,
+            decode_short_side=decode_short_side,
+            zero_copy_decode=zero_copy_decode,
+            keyframe_aligned_sampling=keyframe_aligned_sampling,
+            keyframe_max_shift=keyframe_max_shift,
+            samples_per_video=samples_per_video,
+            sample_pool_size=sample_pool_size,
+            echo_factor=echo_factor,
+            clip_cache_dir=clip_cache_dir,
+            clip_cache_size_gb=clip_cache_size_gb,
+            reader_cache_size=reader_cache_size,
+            reader_cache_gb=reader_cache_gb,
+            video_backend=video_backend,
+            thread_budget=thread_budget,
+            decode_timeout=decode_timeout,
+            max_hung_decodes=max_hung_decodes,
+            out_of_order=out_of_order,
+            use_sample_index=use_sample_index,
+            partition_sample_index=partition_sample_index,
+            stratified_sampling=stratified_sampling)
+
+    elif data.lower() == 'videotardataset':
+        from src.datasets.video_tar_dataset import make_videotardataset
+        assert ipe is not None, \
+            'Must specify the number of batches per epoch for streaming ' \
+            'datasets'
+        dataset, data_loader, dist_sampler = make_videotardataset(
+            data_paths=root_path,
+            batch_size=batch_size,
+            num_batches=ipe,
+            frames_per_clip=clip_len,
+            frame_step=frame_sample_rate,
+            duration=duration,
+            num_clips=num_clips,
+            random_clip_sampling=random_clip_sampling,
+            allow_clip_overlap=allow_clip_overlap,
+            filter_short_videos=filter_short_videos,
+            filter_long_videos=filter_long_videos,
+            shared_transform=shared_transform,
+            transform=transform,
+            datasets_weights=datasets_weights,
+            collator=collator,
+            num_workers=num_workers,
+            pin_mem=pin_mem,
+            world_size=world_size,
+            rank=rank,
+            shuffle_buffer=shuffle_buffer,
+            log_dir=log_dir,
+            thread_budget=thread_budget)
+
+    elif data.lower() == 'clipsharddataset':
+        from src.datasets.clip_shard_dataset import make_clipsharddataset
+        dataset, data_loader, dist_sampler = make_clipsharddataset(
+            data_paths=root_path,
+            batch_size=batch_size,
+            frames_per_clip=clip_len,
+            frame_step=frame_sample_rate,
+            duration=duration,
+            num_clips=num_clips,
+            random_clip_sampling=random_clip_sampling,
+            allow_clip_overlap=allow_clip_overlap,
+            filter_short_videos=filter_short_videos,
+            filter_long_videos=filter_long_videos,
+            shared_transform=shared_transform,
+            transform=transform,
+            datasets_weights=datasets_weights,
+            collator=collator,
+            num_workers=num_workers,
+            world_size=world_size,
+            rank=rank,
+            drop_last=drop_last,
+            log_dir=log_dir,
+            thread_budget=thread_budget)
 
     return (data_loader, dist_sampler)
@@ -12,6 +12,8 @@ from logging import getLogger
 import torch
 import torchvision
 
+from src.datasets.utils.thread_budget import ThreadBudget
+
 _GLOBAL_SEED = 0
 logger = getLogger()
 
@@ -53,7 +55,8 @@ def make_imagedataset(
     copy_data=False,
     drop_last=True,
     persistent_workers=False,
-    subset_file=None
+    subset_file=None,
+    thread_budget=False,
 ):
     dataset = ImageFolder(
         root=root_path,
@@ -61,6 +64,13 @@ def make_imagedataset(
         transform=transform,
         train=training)
     logger.info('ImageFolder dataset created')
+
+    # [Optional] Split cores between workers and torch threads
+    worker_init_fn = None
+    if thread_budget:
+        worker_init_fn = ThreadBudget(num_workers)
+        num_workers = worker_init_fn.num_workers
+
     dist_sampler = torch.utils.data.distributed.DistributedSampler(
         dataset=dataset,
         num_replicas=world_size,
@@ -73,6 +83,7 @@ def make_imagedataset(
         drop_last=drop_last,
         pin_memory=pin_mem,
         num_workers=num_workers,
+        worker_init_fn=worker_init_fn,
         persistent_workers=persistent_workers)
     logger.info('ImageFolder unsupervised data loader created')
 
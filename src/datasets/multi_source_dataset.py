@@ -0,0 +1,255 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import inspect
+
+from logging import getLogger
+
+import numpy as np
+
+import torch
+
+from src.datasets.utils.thread_budget import ThreadBudget
+from src.datasets.video_dataset import make_videodataset
+
+_GLOBAL_SEED = 0
+logger = getLogger()
+
+# Dataset samplers get a distinct epoch for every pass over their dataset
+# within an epoch (see _sampler_epoch)
+_MAX_PASSES_PER_EPOCH = 1 << 20
+
+
+def _sampler_epoch(epoch, num_passes):
+    """ Epoch of a dataset sampler on its num_passes-th pass of an epoch """
+    return epoch * _MAX_PASSES_PER_EPOCH + num_passes
+
+
+def make_multisourcevideodataset(
+    data_paths,
+    batch_size,
+    datasets_weights=None,
+    collator=None,
+    drop_last=True,
+    num_workers=10,
+    pin_mem=True,
+    rank=0,
+    world_size=1,
+    thread_budget=False,
+    out_of_order=False,
+    **kwargs,
+):
+    """
+    Create one VideoDataset (and sampler) per dataset in data_paths, all
+    served by a MultiSourceVideoLoader; kwargs are passed to
+    make_videodataset
+    """
+    datasets, samplers = [], []
+    for data_path in data_paths:
+        dataset, _, dist_sampler = make_videodataset(
+            data_paths=[data_path],
+            batch_size=batch_size,
+            collator=collator,
+            num_workers=0,
+            rank=rank,
+            world_size=world_size,
+            **kwargs)
+        datasets.append(dataset)
+        samplers.append(dist_sampler)
+
+    loader = MultiSourceVideoLoader(
+        datasets=datasets,
+        samplers=samplers,
+        batch_size=batch_size,
+        datasets_weights=datasets_weights,
+        collator=collator,
+        drop_last=drop_last,
+        num_workers=num_workers,
+        pin_mem=pin_mem,
+        rank=rank,
+        thread_budget=thread_budget,
+        out_of_order=out_of_order)
+    logger.info('MultiSourceVideoLoader created')
+
+    return datasets, loader, loader
+
+
+class MultiSourceVideoLoader(object):
+    """
+    Data loader serving several video datasets, each with its own
+    dataloader (and pool of workers), so that slow datasets (e.g., long
+    videos) do not hold up fast ones.
+
+    Every batch comes from a single dataset, drawn at random according to
+    datasets_weights. The num_workers workers are split between datasets in
+    proportion to the decoding time they need, i.e., their sampling weight
+    times their measured time per sample, and rebalanced at every epoch.
+    """
+
+    def __init__(
+        self,
+        datasets,
+        samplers,
+        batch_size,
+        datasets_weights=None,
+        collator=None,
+        drop_last=True,
+        num_workers=10,
+        pin_mem=True,
+        rank=0,
+        thread_budget=False,
+        out_of_order=False,
+    ):
+        self.datasets = datasets
+        self.samplers = samplers
+        self.batch_size = batch_size
+        self.collator = collator
+        self.drop_last = drop_last
+        self.pin_mem = pin_mem
+        self.rank = rank
+        self.epoch = 0
+        self._resume = None
+        self._pass_epoch = 0  # epoch the current pass started with
+
+        if datasets_weights is None:
+            datasets_weights = [1.] * len(datasets)
+        self.datasets_weights = np.array(datasets_weights, dtype=np.float64)
+        self.datasets_weights /= self.datasets_weights.sum()
+
+        self.worker_init_fn = None
+        if thread_budget:
+            self.worker_init_fn = ThreadBudget(num_workers)
+            num_workers = self.worker_init_fn.num_workers
+        self.num_workers = max(num_workers, len(datasets))
+
+        self.loader_kwargs = {}
+        loader_signature = inspect.signature(torch.utils.data.DataLoader)
+        if out_of_order and 'in_order' in loader_signature.parameters:
+            self.loader_kwargs['in_order'] = False
+
+        # Initially, split workers according to the sampling weights only
+        self.workers_per_dataset = self._split_workers(self.datasets_weights)
+        self.loaders = [
+            self._make_loader(i, n)
+            for i, n in enumerate(self.workers_per_dataset)]
+        # Incremented when the loader of a dataset is re-created
+        self._loader_versions = [0] * len(datasets)
+
+    def _split_workers(self, shares):
+        """ Split workers in proportion to shares, with at least one worker
+        per dataset """
+        shares = np.asarray(shares, dtype=np.float64)
+        spare = self.num_workers - len(shares)
+        ideal = spare * shares / shares.sum()
+        workers = np.floor(ideal).astype(np.int64)
+        # Largest remainder rounding
+        for i in np.argsort(workers - ideal)[:spare - workers.sum()]:
+            workers[i] += 1
+        return [int(n) + 1 for n in workers]
+
+    def _make_loader(self, i, num_workers):
+        return torch.utils.data.DataLoader(
+            self.datasets[i],
+            collate_fn=self.collator,
+            sampler=self.samplers[i],
+            batch_size=self.batch_size,
+            drop_last=self.drop_last,
+            pin_memory=self.pin_mem,
+            num_workers=num_workers,
+            worker_init_fn=self.worker_init_fn,
+            persistent_workers=num_workers > 0,
+            **self.loader_kwargs)
+
+    def rebalance(self):
+        """ Split workers according to the time per sample measured for each
+        dataset """
+        time_per_sample = np.array(
+            [d.sample_time_meter.avg for d in self.datasets])
+        if (time_per_sample <= 0).any():
+            return  # not measured yet
+        workers = self._split_workers(self.datasets_weights * time_per_sample)
+        stats = zip(self.datasets, time_per_sample, workers)
+        for i, (d, t, n) in enumerate(stats):
+            logger.info(
+                '[%s] %.1f samples/s per worker, %d -> %d workers'
+                % (d.data_paths[0], 1. / t, self.workers_per_dataset[i], n))
+            d.sample_time_meter.reset()
+            if n != self.workers_per_dataset[i]:
+                self.loaders[i] = self._make_loader(i, n)
+                self._loader_versions[i] += 1
+        self.workers_per_dataset = workers
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        for s in self.samplers:
+            s.set_epoch(_sampler_epoch(epoch, 0))
+        if epoch > 0:
+            self.rebalance()
+
+    def state_dict(self, num_batches_consumed):
+        """
+        Cursor after the first num_batches_consumed batches of the current
+        pass; the datasets the batches were drawn from, and hence the
+        position of every dataset sampler, follow from the seed of the pass
+        """
+        return dict(epoch=self._pass_epoch, start=num_batches_consumed)
+
+    def load_state_dict(self, state_dict):
+        """ Resume the next pass from a saved cursor """
+        self._resume = state_dict
+
+    def log_stats(self, reset=True):
+        for d in self.datasets:
+            d.log_stats(reset=reset)
+
+    def __len__(self):
+        return sum(len(loader) for loader in self.loaders)
+
+    def __iter__(self):
+        epoch, start = self.epoch, 0
+        if self._resume is not None:
+            epoch, start = self._resume['epoch'], self._resume['start']
+            self._resume = None
+        self._pass_epoch = epoch
+        num_batches = len(self)
+        rng = np.random.default_rng([_GLOBAL_SEED, epoch, self.rank])
+        iterators = [None] * len(self.loaders)
+        versions = list(self._loader_versions)
+        passes = [0] * len(self.loaders)
+
+        if start > 0:
+            # Replay the draws of the batches already consumed, and move the
+            # sampler of every dataset to its position in its current pass
+            consumed = np.zeros(len(self.loaders), dtype=np.int64)
+            for _ in range(start):
+                d = rng.choice(len(self.loaders), p=self.datasets_weights)
+                consumed[d] += 1
+            for i, (c, loader) in enumerate(zip(consumed, self.loaders)):
+                passes[i] = int(c) // len(loader)
+                self.samplers[i].load_state_dict(dict(
+                    epoch=_sampler_epoch(epoch, passes[i]),
+                    start=(int(c) % len(loader)) * self.batch_size))
+        else:
+            # Every pass over the loader starts the first pass of every
+            # dataset
+            for s in self.samplers:
+                s.set_epoch(_sampler_epoch(epoch, 0))
+
+        for _ in range(start, num_batches):
+            i = rng.choice(len(self.loaders), p=self.datasets_weights)
+            if iterators[i] is None or versions[i] != self._loader_versions[i]:
+                iterators[i] = iter(self.loaders[i])
+                versions[i] = self._loader_versions[i]
+            try:
+                yield next(iterators[i])
+            except StopIteration:
+                # Datasets are cycled through independently of each other,
+                # with a different order on every pass
+                passes[i] += 1
+                self.samplers[i].set_epoch(_sampler_epoch(epoch, passes[i]))
+                iterators[i] = iter(self.loaders[i])
+                yield next(iterators[i])
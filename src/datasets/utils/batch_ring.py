@@ -0,0 +1,291 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import atexit
+import collections
+import math
+import os
+import tempfile
+import time
+import uuid
+
+from logging import getLogger
+from multiprocessing import Array, Value
+
+import torch
+
+logger = getLogger()
+
+_DTYPES = (torch.float32, torch.float16, torch.bfloat16, torch.uint8)
+_MAX_DIMS = 8
+
+
+def concat_clips(clips):
+    """
+    Collate the clips of a batch (one list of num_clips tensors per sample)
+    into a single contiguous [num_clips * batch_size, ...] tensor, ordered by
+    clip then sample; in a dataloader worker, the tensor is allocated in
+    shared memory (as done by default_collate) so that it is not copied again
+    to be sent to the main process
+    """
+    clips = [sample[c] for c in range(len(clips[0])) for sample in clips]
+    out = None
+    if torch.utils.data.get_worker_info() is not None:
+        numel = sum(clip.numel() for clip in clips)
+        storage = clips[0]._typed_storage()._new_shared(
+            numel, device=clips[0].device)
+        out = clips[0].new(storage).resize_(len(clips), *clips[0].shape)
+    return torch.stack(clips, out=out)
+
+
+def collate_clips(clips, batch_ring=None, concat=False):
+    """
+    Collate the clips of a batch, given as one list of num_clips tensors per
+    sample, or as a single (num_clips x batch_size x ...) tensor
+
+    :param batch_ring: [optional] SharedBatchRing to write the clips into
+    :param concat: whether to collate the clips into a single tensor (see
+        concat_clips) rather than one tensor per clip
+    """
+    if torch.is_tensor(clips):
+        if batch_ring is not None:
+            samples = [list(sample) for sample in clips.transpose(0, 1)]
+            return batch_ring.collate(samples, concat=concat)
+        return clips.flatten(0, 1) if concat else list(clips)
+    if batch_ring is not None:
+        return batch_ring.collate(clips, concat=concat)
+    if concat:
+        return concat_clips(clips)
+    return torch.utils.data.default_collate(clips)
+
+
+class SlotRef(object):
+    """ Placeholder for the clips of a batch written in a slot of a
+    SharedBatchRing """
+
+    def __init__(self, slot, batch_size, concat=False):
+        self.slot = slot
+        self.batch_size = batch_size
+        self.concat = concat
+
+
+class SharedBatchRing(object):
+    """
+    Ring of preallocated batch slots in a shared-memory file, into which
+    dataloader workers collate the clips of their batches, so that batches
+    are neither copied through worker IPC nor copied again by pin_memory.
+
+    A worker takes a free slot, writes the clips of every sample of its
+    batch into it and returns a SlotRef in place of the clips; the main
+    process resolves SlotRefs (see SharedBatchLoader) into views of the
+    slot, which is mapped once and page-locked with cudaHostRegister, so
+    that the batch is already pinned and contiguous. Slots are released
+    once the batch that used them has been consumed.
+
+    The slots are sized from the first batch, so all batches must have the
+    same number of clips, clip shape and dtype.
+
+    :param num_slots: number of slots, at least the number of batches in
+        flight (see num_batch_slots)
+    :param timeout: seconds a worker waits for a free slot before failing,
+        e.g., if the slots are not released, or are too few
+    """
+
+    def __init__(self, num_slots, shm_dir=None, timeout=300.):
+        self.num_slots = num_slots
+        self.timeout = timeout
+        if shm_dir is None and os.path.isdir('/dev/shm'):
+            shm_dir = '/dev/shm'
+        shm_dir = tempfile.gettempdir() if shm_dir is None else shm_dir
+        self.fname = os.path.join(
+            shm_dir, f'vjepa-batches-{os.getpid()}-{uuid.uuid4().hex[:8]}')
+        # State of every slot (0: free, 1: taken), and layout of a slot
+        # ([num_clips, batch_size, *clip_shape] and dtype), set by the first
+        # worker to collate a batch
+        self._taken = Array('b', num_slots)
+        self._layout = Array('q', _MAX_DIMS + 1)
+        self._dtype = Value('i', -1)
+        self._buffer = None
+        self._pinned = False
+        atexit.register(self._unlink)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffer'] = None  # mapped again by each process
+        state['_pinned'] = False
+        return state
+
+    def _unlink(self):
+        if os.path.exists(self.fname):
+            os.unlink(self.fname)
+
+    @property
+    def shape(self):
+        ndim = self._layout[0]
+        return tuple(self._layout[1:1 + ndim])
+
+    def _slot_numel(self):
+        return math.prod(self.shape)
+
+    def _map(self):
+        """ Shared-memory buffer of all slots ([num_slots, num_clips,
+        batch_size, *clip_shape]) """
+        if self._buffer is None:
+            dtype = _DTYPES[self._dtype.value]
+            numel = self.num_slots * self._slot_numel()
+            self._buffer = torch.from_file(
+                self.fname, shared=True, size=numel, dtype=dtype)
+            self._buffer = self._buffer.view(self.num_slots, *self.shape)
+        return self._buffer
+
+    def _create(self, num_clips, batch_size, clip):
+        """ Size the slots from a first batch (called with the slot lock
+        held) """
+        if clip.dtype not in _DTYPES:
+            raise ValueError(f'Unsupported clip dtype {clip.dtype}')
+        shape = (num_clips, batch_size) + tuple(clip.shape)
+        if len(shape) > _MAX_DIMS:
+            raise ValueError(f'Clips of shape {tuple(clip.shape)} have too '
+                             'many dimensions')
+        self._layout[0] = len(shape)
+        self._layout[1:1 + len(shape)] = shape
+        self._dtype.value = _DTYPES.index(clip.dtype)
+        self._map()
+
+    def _acquire(self):
+        start_time = time.time()
+        while True:
+            with self._taken.get_lock():
+                for slot in range(self.num_slots):
+                    if self._taken[slot] == 0:
+                        self._taken[slot] = 1
+                        return slot
+            if time.time() - start_time > self.timeout:
+                raise RuntimeError(
+                    f'No free batch slot after {self.timeout}s, all '
+                    f'{self.num_slots} slots are in flight')
+            time.sleep(0.001)  # all slots are in flight
+
+    def release(self, slot):
+        with self._taken.get_lock():
+            self._taken[slot] = 0
+
+    def collate(self, clips, concat=False):
+        """
+        Write the clips of a batch (one list of num_clips tensors per sample)
+        into a free slot
+
+        :param concat: whether the batch resolves into a single tensor (see
+            concat_clips) rather than one tensor per clip
+        :returns: SlotRef of the slot
+        """
+        num_clips, batch_size = len(clips[0]), len(clips)
+        with self._taken.get_lock():
+            if self._dtype.value < 0:
+                self._create(num_clips, batch_size, clips[0][0])
+        if batch_size > self.shape[1] or num_clips != self.shape[0]:
+            raise ValueError(f'Batch of {batch_size}x{num_clips} clips does '
+                             f'not fit slots of shape {self.shape}')
+
+        slot = self._acquire()
+        buffer = self._map()[slot]
+        for i, sample in enumerate(clips):
+            for c, clip in enumerate(sample):
+                buffer[c, i].copy_(clip)
+        return SlotRef(slot, batch_size, concat=concat)
+
+    def resolve(self, ref):
+        """ Views (one per clip) of the batch written in a slot """
+        buffer = self._map()
+        if not self._pinned and torch.cuda.is_available():
+            # Page-lock the slots once, so that copies to the device are
+            # asynchronous and do not go through a staging buffer
+            err = torch.cuda.cudart().cudaHostRegister(
+                buffer.data_ptr(), buffer.numel() * buffer.element_size(), 0)
+            if int(err) != 0:
+                logger.info(f'Unable to pin shared batch slots (error {err})')
+        self._pinned = True
+        if ref.concat:
+            return buffer[ref.slot, :, :ref.batch_size].flatten(0, 1)
+        return [clip[:ref.batch_size] for clip in buffer[ref.slot]]
+
+
+def num_batch_slots(num_workers, prefetch_factor=2):
+    """
+    Number of slots of a SharedBatchRing fed by a DataLoader with
+    num_workers workers: the batches prefetched by the workers, plus the
+    batches held by a SharedBatchLoader
+    """
+    return max(1, num_workers) * prefetch_factor + SharedBatchLoader.num_held
+
+
+class SharedBatchLoader(object):
+    """
+    Data loader wrapper resolving the SlotRefs of the batches of a loader
+    whose collator writes into a SharedBatchRing.
+
+    The slots of a batch are released when the batch after next is
+    requested, once the work enqueued on the current CUDA stream before the
+    next batch was requested (e.g., non_blocking copies of the batch to the
+    device) has completed, or when the next batch is requested without
+    CUDA. So a batch (and its views) must not be used after the next batch
+    has been requested, other than by such copies.
+    """
+
+    # Batches whose slots are held: the one in use, and the previous one,
+    # which asynchronous copies to the device may still be reading
+    num_held = 2
+
+    def __init__(self, loader, ring):
+        self.loader = loader
+        self.ring = ring
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['loader'], name)
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _resolve(self, batch, slots):
+        if isinstance(batch, SlotRef):
+            slots.append(batch.slot)
+            return self.ring.resolve(batch)
+        if isinstance(batch, (list, tuple)):
+            return type(batch)(self._resolve(b, slots) for b in batch)
+        return batch
+
+    def __iter__(self):
+        # Slots of the batches handed out, with an event recorded on the
+        # current stream when the next batch was requested
+        held = collections.deque()
+        slots = []
+        loader = iter(self.loader)
+        try:
+            while True:
+                event = None
+                if torch.cuda.is_available():
+                    event = torch.cuda.Event()
+                    event.record()
+                held.append((event, slots))
+                slots = []
+                while len(held) >= self.num_held or (held and event is None):
+                    self._release(*held.popleft())
+                try:
+                    batch = next(loader)
+                except StopIteration:
+                    return
+                yield self._resolve(batch, slots)
+        finally:
+            held.append((None, slots))
+            while held:
+                self._release(*held.popleft())
+
+    def _release(self, event, slots):
+        if event is not None:
+            event.synchronize()
+        for slot in slots:
+            self.ring.release(slot)
@@ -0,0 +1,65 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import glob
+import json
+import os
+import time
+
+from logging import getLogger
+
+logger = getLogger()
+
+
+class SampleBlocklist(object):
+    """
+    Persistent record of samples that failed to load (missing, truncated or
+    corrupt videos) along with the reason of the failure.
+
+    Every rank appends its failures to its own file in blocklist_dir, and the
+    files of all ranks are merged when the blocklist is loaded, so that
+    samples which failed on any rank are excluded from later runs.
+    """
+
+    def __init__(self, blocklist_dir, rank=0):
+        self.blocklist_dir = blocklist_dir
+        self.fname = os.path.join(blocklist_dir, f'blocklist_r{rank}.jsonl')
+        os.makedirs(blocklist_dir, exist_ok=True)
+        self.entries = {}
+        self.load()
+
+    def load(self):
+        """ Merge the blocklist files written by all ranks """
+        pattern = os.path.join(self.blocklist_dir, 'blocklist_r*.jsonl')
+        for fname in glob.glob(pattern):
+            with open(fname, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # partially written line
+                    self.entries[entry['path']] = entry['reason']
+        logger.info(f'Loaded {len(self.entries)} blocklisted samples '
+                    f'from {self.blocklist_dir}')
+        return self.entries
+
+    def add(self, path, reason):
+        if path in self.entries:
+            return
+        self.entries[path] = reason
+        line = json.dumps(dict(path=path, reason=reason, time=time.time()))
+        try:
+            with open(self.fname, 'a') as f:
+                f.write(line + '\n')
+        except OSError as e:
+            logger.info(f'Failed to update blocklist {self.fname}: {e}')
+
+    def __contains__(self, path):
+        return path in self.entries
+
+    def __len__(self):
+        return len(self.entries)
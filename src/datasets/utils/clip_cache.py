@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import fcntl
+import hashlib
+import os
+
+from contextlib import contextmanager
+from logging import getLogger
+
+import numpy as np
+
+from src.utils.logging import SharedAverageMeter
+
+logger = getLogger()
+
+
+class SharedClipCache(object):
+    """
+    Cache of decoded uint8 clips shared by all the processes of a node.
+
+    Clips are stored as .npy files in cache_dir, which should live on a
+    memory-backed filesystem (e.g., /dev/shm), so that any dataloader worker
+    of any rank can reuse a clip decoded by another one. The total size of
+    the cache is bounded by max_bytes; when it is exceeded, the least
+    recently used clips are evicted.
+    """
+
+    _LOCK_FNAME = '.lock'
+    _USAGE_FNAME = '.usage'
+
+    def __init__(self, cache_dir, max_bytes, low_watermark=0.9):
+        self.cache_dir = cache_dir
+        self.max_bytes = int(max_bytes)
+        self.low_watermark = low_watermark
+        os.makedirs(cache_dir, exist_ok=True)
+        # Fraction of lookups that hit the cache, across dataloader workers
+        self.hit_meter = SharedAverageMeter()
+        logger.info(f'Using shared clip cache in {cache_dir} '
+                    f'({self.max_bytes / 1024**3:.1f} GB)')
+
+    @staticmethod
+    def make_key(path, indices, *args):
+        """ Key of the clip made of the given frames of a video """
+        key = repr((str(path), [int(i) for i in indices]) + args)
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npy')
+
+    @contextmanager
+    def _lock(self):
+        with open(os.path.join(self.cache_dir, self._LOCK_FNAME), 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _read_usage(self):
+        try:
+            fname = os.path.join(self.cache_dir, self._USAGE_FNAME)
+            with open(fname, 'r') as f:
+                return int(f.read() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _write_usage(self, usage):
+        with open(os.path.join(self.cache_dir, self._USAGE_FNAME), 'w') as f:
+            f.write(str(usage))
+
+    def _evict(self, target):
+        """ Delete least recently used clips until the cache fits in target
+        bytes """
+        entries = []
+        with os.scandir(self.cache_dir) as it:
+            for e in it:
+                if e.name.endswith('.npy'):
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, e.path))
+        # Usage is recomputed from the files on disk, which also corrects
+        # for clips that were removed by other means
+        usage = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if usage <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            usage -= size
+        return usage
+
+    def get(self, key):
+        """ Cached clip associated with key, or None on a cache miss """
+        fname = self._path(key)
+        try:
+            buffer = np.load(fname)
+            os.utime(fname)  # Mark clip as recently used
+        except (OSError, ValueError):
+            # Missing (or concurrently evicted) clip
+            self.hit_meter.update(0.)
+            return None
+        self.hit_meter.update(1.)
+        return buffer
+
+    def put(self, key, buffer):
+        """ Add a clip to the cache, evicting old clips if needed """
+        fname = self._path(key)
+        if buffer.nbytes > self.max_bytes or os.path.exists(fname):
+            return
+        tmp_fname = f'{fname}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_fname, 'wb') as f:
+                np.save(f, np.ascontiguousarray(buffer))
+            size = os.path.getsize(tmp_fname)
+            with self._lock():
+                usage = self._read_usage() + size
+                if usage > self.max_bytes:
+                    target = int(self.low_watermark * self.max_bytes) - size
+                    usage = self._evict(target) + size
+                # Atomic rename, so that readers never see partial clips
+                os.replace(tmp_fname, fname)
+                self._write_usage(usage)
+        except OSError as e:
+            logger.info(f'Failed to add clip to cache {self.cache_dir}: {e}')
+            if os.path.exists(tmp_fname):
+                os.remove(tmp_fname)
+
+    def log_stats(self, reset=True):
+        logger.info(
+            'clip cache: %.1f%% hits over %d lookups'
+            % (100. * self.hit_meter.avg, self.hit_meter.count))
+        if reset:
+            self.hit_meter.reset()
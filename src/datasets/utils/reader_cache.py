@@ -0,0 +1,90 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import time
+
+from collections import OrderedDict
+from logging import getLogger
+
+from src.utils.logging import SharedAverageMeter
+
+logger = getLogger()
+
+
+class VideoReaderCache(object):
+    """
+    Least-recently-used cache of open video readers, local to each
+    dataloader worker, so that videos sampled repeatedly are not re-opened
+    (and their container re-parsed) every time.
+
+    The cache holds at most max_readers readers, and at most max_bytes of
+    videos, using the size of the video files as a proxy for the memory
+    held by their readers.
+    """
+
+    def __init__(self, max_readers=8, max_bytes=1024**3):
+        self.max_readers = max_readers
+        self.max_bytes = max_bytes
+        self._readers = OrderedDict()  # key -> (reader, size)
+        self._bytes = 0
+        # Time spent opening readers, and number of lookups that hit the
+        # cache, across dataloader workers
+        self.open_meter = SharedAverageMeter()
+        self.hit_meter = SharedAverageMeter()
+
+    def __getstate__(self):
+        # Open readers are not shared with (nor pickled for) other processes
+        state = self.__dict__.copy()
+        state['_readers'] = OrderedDict()
+        state['_bytes'] = 0
+        return state
+
+    def get(self, fname, open_fn, key=None):
+        """
+        Reader of fname from the cache, or opened with open_fn(fname) (and
+        cached) on a miss
+
+        :param key: [optional] cache key, if readers of the same file can
+            differ (defaults to fname)
+        """
+        key = fname if key is None else key
+        if key in self._readers:
+            self._readers.move_to_end(key)
+            self.hit_meter.update(1.)
+            return self._readers[key][0]
+
+        start_time = time.time()
+        reader = open_fn(fname)
+        self.open_meter.update(time.time() - start_time)
+        self.hit_meter.update(0.)
+
+        size = os.path.getsize(fname)
+        if size <= self.max_bytes:
+            self._readers[key] = (reader, size)
+            self._bytes += size
+            while (len(self._readers) > self.max_readers
+                   or self._bytes > self.max_bytes):
+                self._bytes -= self._readers.popitem(last=False)[1][1]
+        return reader
+
+    def invalidate(self, key):
+        """ Drop the reader of a video that failed, so that it is re-opened """
+        if key in self._readers:
+            self._bytes -= self._readers.pop(key)[1]
+
+    def log_stats(self, reset=True):
+        # Every hit saves about the average time taken to open a reader
+        num_hits = self.hit_meter.sum
+        logger.info(
+            'reader cache: %.1f%% hits over %d lookups '
+            '(~%.1f s of opening saved)'
+            % (100. * self.hit_meter.avg, self.hit_meter.count,
+               num_hits * self.open_meter.avg))
+        if reset:
+            self.hit_meter.reset()
+            self.open_meter.reset()
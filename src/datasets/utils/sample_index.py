@@ -0,0 +1,204 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import os
+
+from logging import getLogger
+
+import numpy as np
+
+logger = getLogger()
+
+_ARRAYS = ('offsets', 'blob', 'labels')
+
+
+def sample_index_path(data_path):
+    """ Directory of the sample index written next to a .csv/.npy dataset
+    file """
+    return f'{data_path}.index'
+
+
+class SampleIndex(object):
+    """
+    Compact index of the (path, label) samples of a dataset.
+
+    Paths are stored as a single utf-8 blob along with their offsets in the
+    blob, and labels as an int array, instead of Python lists of strings,
+    which are costly to hold and to pickle into every dataloader worker.
+    An index loaded from disk is memory-mapped, and is pickled as a
+    reference to its files, so that workers attach to the page cache
+    instead of receiving a copy of the index.
+    """
+
+    def __init__(
+        self,
+        offsets,
+        blob,
+        labels,
+        fname=None,
+        partition=None,
+        total_len=None,
+    ):
+        self.offsets = offsets
+        self.blob = blob
+        self.labels = labels
+        # Directory (and partition) the index was loaded from, if any, and
+        # number of samples in the whole index
+        self.fname = fname
+        self.partition = partition
+        self.total_len = len(labels) if total_len is None else total_len
+
+    @classmethod
+    def from_lists(cls, paths, labels):
+        encoded = [str(p).encode('utf-8') for p in paths]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(e) for e in encoded], out=offsets[1:])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, blob, np.asarray(labels, dtype=np.int64))
+
+    @classmethod
+    def load(cls, fname, partition=None):
+        """
+        Memory-map an index saved with save
+
+        :param partition: [optional] (rank, world_size), to only load the
+            rank-th of world_size equally sized contiguous partitions (the
+            remaining len % world_size samples are dropped)
+        """
+        offsets = np.load(os.path.join(fname, 'offsets.npy'), mmap_mode='r')
+        blob = np.load(os.path.join(fname, 'blob.npy'), mmap_mode='r')
+        labels = np.load(os.path.join(fname, 'labels.npy'), mmap_mode='r')
+        total_len = len(labels)
+        if partition is not None:
+            start, stop = cls.partition_range(total_len, *partition)
+            offsets, labels = offsets[start:stop + 1], labels[start:stop]
+        return cls(
+            offsets, blob, labels,
+            fname=fname, partition=partition, total_len=total_len)
+
+    @staticmethod
+    def partition_range(num_samples, rank, world_size):
+        size = num_samples // world_size
+        return rank * size, (rank + 1) * size
+
+    def save(self, fname):
+        os.makedirs(fname, exist_ok=True)
+        for name in _ARRAYS:
+            np.save(os.path.join(fname, f'{name}.npy'),
+                    np.ascontiguousarray(getattr(self, name)))
+
+    def __getstate__(self):
+        if self.fname is not None:
+            return dict(fname=self.fname, partition=self.partition)
+        return self.__dict__.copy()
+
+    def __setstate__(self, state):
+        if 'offsets' not in state:
+            state = SampleIndex.load(
+                state['fname'], partition=state['partition']).__dict__
+        self.__dict__.update(state)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __getitem__(self, index):
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def isin(self, paths):
+        """
+        Mask of the samples whose path is in paths, matched against the
+        encoded paths of the index (grouped by length) instead of decoding
+        every path of the index
+        """
+        by_length = {}
+        for path in paths:
+            encoded = str(path).encode('utf-8')
+            by_length.setdefault(len(encoded), []).append(encoded)
+        lengths = np.diff(self.offsets)
+        mask = np.zeros(len(self), dtype=bool)
+        for length, encoded in by_length.items():
+            candidates = np.flatnonzero(lengths == length)
+            if length == 0 or len(candidates) == 0:
+                mask[candidates] = True
+                continue
+            starts = np.asarray(self.offsets[candidates])
+            rows = np.asarray(self.blob)[starts[:, None] + np.arange(length)]
+            mask[candidates] = np.isin(
+                rows.view(f'S{length}').ravel(),
+                np.array(encoded, dtype=f'S{length}'))
+        return mask
+
+    def select(self, keep):
+        """ In-memory index of the samples selected by the boolean mask keep """
+        keep = np.asarray(keep, dtype=bool)
+        lengths = np.diff(self.offsets)
+        offsets = np.zeros(keep.sum() + 1, dtype=np.int64)
+        np.cumsum(lengths[keep], out=offsets[1:])
+        blob = np.asarray(self.blob[self.offsets[0]:self.offsets[-1]])
+        blob = blob[np.repeat(keep, lengths)]
+        return SampleIndex(offsets, blob, np.asarray(self.labels)[keep])
+
+    @staticmethod
+    def concat(indices):
+        """ Concatenate several indices, without copying their paths """
+        if len(indices) == 1:
+            return indices[0]
+        return ConcatSampleIndex(indices)
+
+
+class ConcatSampleIndex(object):
+    """ Concatenation of several sample indices (e.g., one per dataset) """
+
+    def __init__(self, indices):
+        self.indices = indices
+        self.ends = np.cumsum([len(index) for index in indices])
+        self.labels = np.concatenate(
+            [np.asarray(index.labels) for index in indices])
+
+    def __len__(self):
+        return int(self.ends[-1])
+
+    def __getitem__(self, index):
+        i = int(np.searchsorted(self.ends, index, side='right'))
+        return self.indices[i][index - (self.ends[i-1] if i > 0 else 0)]
+
+    def __iter__(self):
+        for index in self.indices:
+            yield from index
+
+
+def write_sample_index(data_path):
+    """ Write the sample index of a .csv/.npy dataset file next to it """
+    from src.datasets.video_dataset import read_video_list
+
+    samples, labels = read_video_list(data_path)
+    index = SampleIndex.from_lists(samples, labels)
+    index.save(sample_index_path(data_path))
+    logger.info(
+        f'Wrote index of {len(index)} samples '
+        f'({index.blob.nbytes / 1024**2:.1f} MB of paths) '
+        f'to {sample_index_path(data_path)}')
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--data-paths', type=str, nargs='+', required=True,
+        help='.csv/.npy dataset files to index')
+    args = parser.parse_args()
+
+    for data_path in args.data_paths:
+        write_sample_index(data_path)
@@ -0,0 +1,79 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+
+from logging import getLogger
+
+import torch
+
+logger = getLogger()
+
+
+def local_world_size():
+    """ Number of ranks running on this node """
+    for key in ('LOCAL_WORLD_SIZE', 'SLURM_NTASKS_PER_NODE'):
+        try:
+            return max(1, int(os.environ[key].split('(')[0]))
+        except (KeyError, ValueError):
+            pass
+    return max(1, torch.cuda.device_count())
+
+
+def cpus_per_rank():
+    """
+    Number of cores available to this rank: the cores this process is bound
+    to if the scheduler already restricted its affinity, otherwise an equal
+    share of the cores of the node
+    """
+    num_cpus = os.cpu_count() or 1
+    try:
+        num_affinity = len(os.sched_getaffinity(0))
+    except AttributeError:
+        num_affinity = num_cpus
+    if num_affinity < num_cpus:
+        return num_affinity
+    return max(1, num_cpus // local_world_size())
+
+
+class ThreadBudget(object):
+    """
+    Split the cores of a rank between its dataloader workers, so that the
+    decoding threads and the torch (and OpenCV) intra-op threads of all the
+    workers of all the ranks of a node do not oversubscribe its cores.
+
+    One core is kept for the main training process, the number of workers
+    is capped by the remaining cores, and each worker gets an equal share of
+    them, used both for decoding and for torch ops (which run one after the
+    other in a worker). Instances are used as worker_init_fn.
+    """
+
+    def __init__(self, num_workers, num_cpus=None):
+        num_cpus = cpus_per_rank() if num_cpus is None else num_cpus
+        available = max(1, num_cpus - 1)
+        self.num_workers = min(num_workers, available)
+        self.threads_per_worker = max(1, available // max(1, self.num_workers))
+        logger.info(
+            f'Thread budget: {num_cpus} cores, {self.num_workers} workers '
+            f'with {self.threads_per_worker} threads each')
+        if self.num_workers < num_workers:
+            logger.info(f'Reduced number of dataloader workers from '
+                        f'{num_workers} to {self.num_workers}')
+
+    def __call__(self, worker_id):
+        torch.set_num_threads(self.threads_per_worker)
+        try:
+            import cv2
+            cv2.setNumThreads(self.threads_per_worker)
+        except ImportError:
+            pass
+
+        # Datasets that decode videos read the number of decoding threads
+        # from the dataset copy of the worker
+        dataset = torch.utils.data.get_worker_info().dataset
+        if hasattr(dataset, 'num_decode_threads'):
+            dataset.num_decode_threads = self.threads_per_worker
@@ -0,0 +1,344 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import time
+
+from collections import defaultdict
+from logging import getLogger
+
+import numpy as np
+
+import torch
+
+from src.datasets.utils.video.functional import get_resize_sizes
+
+logger = getLogger()
+
+# Frames further apart than this are decoded after a new seek rather than
+# by decoding all the frames in between
+_MAX_DECODE_GAP = 256
+
+# Frame size (height, width) of the videos opened by this process, so that
+# the size of a video decoded at a reduced resolution is only probed once
+_FRAME_SIZES = {}
+_MAX_FRAME_SIZES = 1 << 20
+
+
+def probe_frame_size(fname):
+    """ (height, width) of the video stream of a file, read from the
+    container headers without decoding any frame (None if unknown) """
+    try:
+        import av
+        with av.open(fname) as container:
+            codec_context = container.streams.video[0].codec_context
+            if codec_context.height > 0 and codec_context.width > 0:
+                return codec_context.height, codec_context.width
+    except Exception:
+        pass
+    return None
+
+
+class DecordReader(object):
+    """ Video reader based on decord """
+
+    name = 'decord'
+
+    def __init__(
+        self,
+        fname,
+        short_side=None,
+        frame_size=None,
+        num_threads=-1,
+        zero_copy=False,
+    ):
+        from decord import VideoReader, cpu
+
+        self.zero_copy = zero_copy
+        self.vr = None
+        if short_side is not None and frame_size is None:
+            frame_size = _FRAME_SIZES.get(fname) or probe_frame_size(fname)
+            if frame_size is None:
+                # Read the frame size from a full resolution reader, which
+                # is kept if the frames do not need to be resized
+                self.vr = VideoReader(
+                    fname, num_threads=num_threads, ctx=cpu(0))
+                frame_size = self.vr[0].shape[:2]
+            if len(_FRAME_SIZES) < _MAX_FRAME_SIZES:
+                _FRAME_SIZES[fname] = tuple(frame_size)
+
+        if short_side is not None and min(frame_size) > short_side:
+            # Let the decoder downscale frames instead of resizing full
+            # resolution frames in the transforms
+            h, w = get_resize_sizes(*frame_size, short_side)
+            self.vr = VideoReader(
+                fname, width=w, height=h, num_threads=num_threads, ctx=cpu(0))
+        elif self.vr is None:
+            self.vr = VideoReader(fname, num_threads=num_threads, ctx=cpu(0))
+
+    def __len__(self):
+        return len(self.vr)
+
+    def get_avg_fps(self):
+        return self.vr.get_avg_fps()
+
+    def get_key_indices(self):
+        return self.vr.get_key_indices()
+
+    def get_batch(self, indices):
+        self.vr.seek(0)  # Go to start of video before sampling frames
+        buffer = self.vr.get_batch(indices)
+        if self.zero_copy:
+            # Hand the decoded frames over through DLPack, so that the numpy
+            # array is a view of the decord buffer rather than a copy of it
+            return torch.utils.dlpack.from_dlpack(buffer.to_dlpack()).numpy()
+        return buffer.asnumpy()
+
+
+class PyAVReader(object):
+    """ Video reader based on PyAV, with frame indices derived from
+    timestamps """
+
+    name = 'pyav'
+
+    def __init__(
+        self,
+        fname,
+        short_side=None,
+        frame_size=None,
+        num_threads=0,
+        zero_copy=False,
+    ):
+        import av
+
+        self.container = av.open(fname)
+        self.stream = self.container.streams.video[0]
+        self.stream.thread_type = 'AUTO'
+        if num_threads > 0:
+            self.stream.codec_context.thread_count = num_threads
+
+        rate = self.stream.average_rate or self.stream.guessed_rate
+        self.fps = float(rate)
+        self.time_base = float(self.stream.time_base)
+        self.start_pts = self.stream.start_time or 0
+        self.num_frames = self.stream.frames
+        if self.num_frames == 0 and self.stream.duration is not None:
+            self.num_frames = int(
+                self.stream.duration * self.time_base * self.fps)
+        if self.num_frames == 0:
+            raise ValueError(f'unknown number of frames in {fname}')
+
+        h, w = self.stream.codec_context.height, self.stream.codec_context.width
+        if short_side is not None and min(h, w) > short_side:
+            h, w = get_resize_sizes(h, w, short_side)
+        self.height, self.width = h, w
+        self._key_indices = None
+
+    def __len__(self):
+        return self.num_frames
+
+    def get_avg_fps(self):
+        return self.fps
+
+    def _to_index(self, pts):
+        return int(round((pts - self.start_pts) * self.time_base * self.fps))
+
+    def get_key_indices(self):
+        if self._key_indices is None:
+            # Demux (without decoding) the whole stream once
+            self.container.seek(self.start_pts, stream=self.stream)
+            self._key_indices = sorted(
+                self._to_index(p.pts) for p in self.container.demux(self.stream)
+                if p.is_keyframe and p.pts is not None)
+        return self._key_indices
+
+    def get_batch(self, indices):
+        wanted = np.unique(indices)
+        wanted_set = set(wanted.tolist())
+        frames = {}
+        # Decode each group of nearby frames after seeking to the keyframe
+        # preceding the group
+        splits = np.nonzero(np.diff(wanted) > _MAX_DECODE_GAP)[0] + 1
+        for group in np.split(wanted, splits):
+            pts = self.start_pts + int(group[0] / self.fps / self.time_base)
+            self.container.seek(pts, stream=self.stream, backward=True)
+            for frame in self.container.decode(self.stream):
+                if frame.pts is None:
+                    continue
+                i = self._to_index(frame.pts)
+                if i > group[-1]:
+                    break
+                if i in wanted_set:
+                    frames[i] = frame.to_ndarray(
+                        format='rgb24', width=self.width, height=self.height)
+        if len(frames) == 0:
+            raise RuntimeError('no frames decoded')
+
+        # Timestamps do not always map exactly onto frame indices, so missing
+        # frames are replaced with the closest decoded frame
+        decoded = np.array(sorted(frames))
+        distances = np.abs(decoded[None] - np.asarray(indices)[:, None])
+        nearest = decoded[distances.argmin(1)]
+        return np.stack([frames[i] for i in nearest])
+
+
+class TorchvisionReader(object):
+    """ Video reader based on torchvision.io """
+
+    name = 'torchvision'
+
+    def __init__(
+        self,
+        fname,
+        short_side=None,
+        frame_size=None,
+        num_threads=0,
+        zero_copy=False,
+    ):
+        from torchvision.io import read_video_timestamps
+
+        self.fname = fname
+        self.short_side = short_side
+        self.pts, self.fps = read_video_timestamps(fname, pts_unit='sec')
+        if len(self.pts) == 0:
+            raise ValueError(f'no frames found in {fname}')
+
+    def __len__(self):
+        return len(self.pts)
+
+    def get_avg_fps(self):
+        return self.fps
+
+    def get_key_indices(self):
+        return []  # not exposed by torchvision
+
+    def get_batch(self, indices):
+        from torchvision.io import read_video
+
+        indices = np.asarray(indices)
+        wanted = np.unique(indices)
+        frames = {}
+        splits = np.nonzero(np.diff(wanted) > _MAX_DECODE_GAP)[0] + 1
+        for group in np.split(wanted, splits):
+            video, _, _ = read_video(
+                self.fname,
+                start_pts=self.pts[group[0]],
+                end_pts=self.pts[group[-1]],
+                pts_unit='sec',
+                output_format='THWC')
+            if len(video) == 0:
+                raise RuntimeError('no frames decoded')
+            for i in group:
+                frames[i] = video[min(i - group[0], len(video) - 1)]
+        buffer = torch.stack([frames[i] for i in indices])
+
+        h, w = buffer.shape[1:3]
+        if self.short_side is not None and min(h, w) > self.short_side:
+            h, w = get_resize_sizes(h, w, self.short_side)
+            buffer = torch.nn.functional.interpolate(
+                buffer.permute(0, 3, 1, 2).float(), size=(h, w),
+                mode='bilinear', antialias=True)
+            buffer = buffer.round().clamp(0, 255).to(torch.uint8)
+            buffer = buffer.permute(0, 2, 3, 1)
+        return buffer.numpy()
+
+
+VIDEO_BACKENDS = {
+    'decord': DecordReader,
+    'pyav': PyAVReader,
+    'torchvision': TorchvisionReader,
+}
+
+# Module (and attribute) required by each backend; recent torchvision
+# releases no longer provide video decoding
+_BACKEND_MODULES = {
+    'decord': ('decord', 'VideoReader'),
+    'pyav': ('av', 'open'),
+    'torchvision': ('torchvision.io', 'read_video'),
+}
+
+
+def available_backends():
+    """ Names of the backends whose library can be imported """
+    import importlib
+    names = []
+    for name, (module, attr) in _BACKEND_MODULES.items():
+        try:
+            if hasattr(importlib.import_module(module), attr):
+                names.append(name)
+        except ImportError:
+            pass
+    return names
+
+
+def open_video(backend, fname, **kwargs):
+    """ Open a video with the given backend (see VIDEO_BACKENDS) """
+    if backend not in VIDEO_BACKENDS:
+        raise ValueError(f'Unknown video backend {backend}')
+    return VIDEO_BACKENDS[backend](fname, **kwargs)
+
+
+def video_format(fname, codec=''):
+    """ Key used to select a backend for a video: (container, codec) """
+    return (os.path.splitext(fname)[1].lower(), codec)
+
+
+def calibrate_backends(
+    fnames,
+    codecs=None,
+    backends=None,
+    frames_per_clip=16,
+    frame_step=4,
+    videos_per_format=4,
+    **kwargs,
+):
+    """
+    Benchmark the decoding of a few clips with each backend, for each video
+    format (container, codec) found in fnames, and select the fastest
+    backend for each format; backends that fail on any video of a format
+    are not selected for it.
+
+    :param codecs: [optional] codec of each video, otherwise videos are
+        only distinguished by their container
+    :returns: dict mapping each video format to a list of backends, sorted
+        from fastest to slowest
+    """
+    backends = available_backends() if backends is None else backends
+    codecs = [''] * len(fnames) if codecs is None else codecs
+    groups = defaultdict(list)
+    for fname, codec in zip(fnames, codecs):
+        groups[video_format(fname, codec)].append(fname)
+
+    rng = np.random.default_rng(0)
+    selection = {}
+    for fmt, group in groups.items():
+        selected = rng.permutation(len(group))[:videos_per_format]
+        group = [group[i] for i in selected]
+        # Position of the clip in each video, drawn once so that every
+        # backend decodes the same clips
+        offsets = rng.random(len(group))
+        timings = {}
+        for backend in backends:
+            try:
+                start_time = time.time()
+                for fname, offset in zip(group, offsets):
+                    reader = open_video(backend, fname, **kwargs)
+                    clip_len = min(frames_per_clip * frame_step, len(reader))
+                    start = int(offset * (len(reader) - clip_len + 1))
+                    reader.get_batch(
+                        list(range(start, start + clip_len, frame_step)))
+                timings[backend] = time.time() - start_time
+            except Exception as e:
+                logger.info(
+                    f'video backend {backend} failed on format {fmt}: {e}')
+        if len(timings) == 0:
+            continue
+        selection[fmt] = sorted(timings, key=timings.get)
+        logger.info(
+            f'video format {fmt}: ' + ', '.join(
+                f'{b} {timings[b] / len(group):.3f}s' for b in selection[fmt]))
+    return selection
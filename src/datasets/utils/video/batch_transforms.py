@@ -0,0 +1,211 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import math
+
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+
+import src.datasets.utils.video.transforms as video_transforms
+
+
+class BatchVideoTransform(object):
+    """
+    Batch counterpart of the per-clip VideoTransform, applied to all the
+    clips of a batch at once (e.g., in the collator) rather than to one clip
+    at a time in the dataset.
+
+    As in VideoTransform, RandAugment is applied to whole frames before
+    cropping, to all the clips of the same size at once. The random resized
+    crops (and horizontal flips) of all clips are then resampled with a
+    single grid_sample call: each uint8 crop is sliced from its clip and
+    converted to float into a tensor of crops padded to a common size, which
+    are resized through per-frame sampling grids (which follow the moving
+    crop boxes of every clip with motion_shift). Normalization and random
+    erasing are vectorized over the batch. Random parameters are still drawn
+    independently for every clip.
+    """
+
+    def __init__(
+        self,
+        random_horizontal_flip=True,
+        random_resize_aspect_ratio=(3/4, 4/3),
+        random_resize_scale=(0.3, 1.0),
+        reprob=0.0,
+        auto_augment=False,
+        motion_shift=False,
+        crop_size=224,
+        normalize=((0.485, 0.456, 0.406),
+                   (0.229, 0.224, 0.225)),
+        uint8_output=False,
+    ):
+        self.random_horizontal_flip = random_horizontal_flip
+        self.random_resize_aspect_ratio = random_resize_aspect_ratio
+        self.random_resize_scale = random_resize_scale
+        self.reprob = reprob
+        self.auto_augment = auto_augment
+        self.motion_shift = motion_shift
+        self.crop_size = crop_size
+        self.normalize = normalize
+        # [Optional] Output uint8 clips, normalized (and randomly erased)
+        # later on the training device (see uint8_normalize)
+        self.uint8_output = uint8_output
+
+        # Normalization of 0 to 255 floats:
+        # (x / 255 - mean) / std = x * scale + bias
+        mean = torch.tensor(normalize[0], dtype=torch.float32)
+        std = torch.tensor(normalize[1], dtype=torch.float32)
+        mean, std = mean.view(1, -1, 1, 1, 1), std.view(1, -1, 1, 1, 1)
+        self.scale, self.bias = 1. / (255. * std), -mean / std
+
+        self.autoaug_transform = video_transforms.create_random_augment(
+            input_size=(crop_size, crop_size),
+            auto_augment='rand-m7-n4-mstd0.5-inc1',
+            interpolation='bicubic',
+            tensor=True,
+        )
+
+    def __call__(self, clips):
+        """
+        :param clips: clips of the batch, one list of num_clips uint8 clips
+            (T x H x W x C, as decoded) per sample
+        :returns: tensor of all clips (num_clips x B x C x T x H x W)
+        """
+        num_clips, batch_size = len(clips[0]), len(clips)
+        # Clips ordered by clip then sample
+        clips = [torch.as_tensor(np.asarray(sample[c]))
+                 for c in range(num_clips) for sample in clips]
+        if self.auto_augment:
+            clips = self._auto_augment(clips)
+
+        # Crop boxes of every frame (N x T x 4)
+        num_frames = clips[0].shape[0]
+        if self.motion_shift:
+            boxes = torch.stack([
+                video_transforms._get_param_spatial_crop_with_shift(
+                    self.random_resize_scale,
+                    self.random_resize_aspect_ratio,
+                    clip.shape[1],
+                    clip.shape[2],
+                    num_frames)
+                for clip in clips])
+        else:
+            boxes = torch.tensor([
+                video_transforms._get_param_spatial_crop(
+                    self.random_resize_scale,
+                    self.random_resize_aspect_ratio,
+                    clip.shape[1],
+                    clip.shape[2])
+                for clip in clips])
+            boxes = boxes[:, None].repeat(1, num_frames, 1)
+        crops = self._slice_crops(clips, boxes)
+
+        flip = None
+        if self.random_horizontal_flip:
+            flip = (torch.rand(len(clips)) < 0.5).repeat_interleave(num_frames)
+
+        # Crops now start at the origin of the padded crops tensor
+        boxes[..., :2] = 0
+        N, T, H, W, C = crops.shape
+        grid = video_transforms.crop_resize_grid(
+            boxes.view(N * T, 4), (H, W), (self.crop_size, self.crop_size),
+            flip=flip)
+        buffer = F.grid_sample(
+            # channels-last frames
+            crops.view(N * T, H, W, C).permute(0, 3, 1, 2),
+            grid,
+            mode='bilinear',
+            padding_mode='border',
+            align_corners=False)
+        buffer = buffer.view(N, T, C, self.crop_size, self.crop_size)
+        buffer = buffer.permute(0, 2, 1, 3, 4)
+
+        if self.uint8_output:
+            buffer = buffer.round_().clamp_(0, 255).to(torch.uint8).contiguous()
+        else:
+            buffer = torch.addcmul(
+                self.bias, buffer, self.scale, out=torch.empty(buffer.shape))
+            if self.reprob > 0:
+                buffer = random_erase(buffer, self.reprob)
+        return buffer.view(num_clips, batch_size, *buffer.shape[1:])
+
+    def _auto_augment(self, clips):
+        """ RandAugment of the (uint8, T x H x W x C) frames of every clip """
+        # Clips of the same size are augmented together
+        groups = {}
+        for i, clip in enumerate(clips):
+            groups.setdefault(tuple(clip.shape), []).append(i)
+        out = [None] * len(clips)
+        for index in groups.values():
+            x = torch.stack([clips[i] for i in index])
+            x = self.autoaug_transform(x.permute(0, 1, 4, 2, 3))  # N T C H W
+            for i, clip in zip(index, x.permute(0, 1, 3, 4, 2)):
+                out[i] = clip
+        return out
+
+    def _slice_crops(self, clips, boxes):
+        """
+        Crops of every frame converted to float, padded to a common size
+        (N x T x H x W x C) with zeros: bilinear sampling on the last row
+        (column) of a crop also reads the next one with a zero weight, so
+        the padding must not be left uninitialized (0 * nan is nan)
+        """
+        T, C = clips[0].shape[0], clips[0].shape[3]
+        H, W = int(boxes[..., 2].max()), int(boxes[..., 3].max())
+        crops = torch.empty((len(clips), T, H, W, C))
+        for crop, clip, clip_boxes in zip(crops, clips, boxes.tolist()):
+            if self.motion_shift:
+                for t, (i, j, h, w) in enumerate(clip_boxes):
+                    crop[t, :h, :w] = clip[t, i:i + h, j:j + w]
+                    crop[t, h:] = 0
+                    crop[t, :h, w:] = 0
+            else:
+                i, j, h, w = clip_boxes[0]
+                crop[:, :h, :w] = clip[:, i:i + h, j:j + w]
+                crop[:, h:] = 0
+                crop[:, :h, w:] = 0
+        return crops
+
+
+def random_erase(
+    buffer,
+    reprob,
+    min_area=0.02,
+    max_area=1/3,
+    min_aspect=0.3,
+    num_attempts=100,
+):
+    """
+    Vectorized RandomErasing (mode='pixel', cube=True) of normalized clips
+    (N x C x T x H x W), on their device: with probability reprob, a random
+    box of every clip is replaced with per-pixel normal noise in all of its
+    frames
+    """
+    N, _, _, H, W = buffer.shape
+    device = buffer.device
+    log_ratio = torch.empty((N, num_attempts), device=device).uniform_(
+        math.log(min_aspect), -math.log(min_aspect))
+    target_area = torch.empty((N, num_attempts), device=device).uniform_(
+        min_area, max_area) * H * W
+    h = torch.sqrt(target_area * log_ratio.exp()).round().long()
+    w = torch.sqrt(target_area / log_ratio.exp()).round().long()
+    valid = (h < H) & (w < W)
+    # First valid attempt of every clip
+    attempt = valid.long().argmax(dim=1, keepdim=True)
+    h, w = h.gather(1, attempt)[:, 0], w.gather(1, attempt)[:, 0]
+    apply = (torch.rand(N, device=device) < reprob) & valid.any(dim=1)
+
+    top = (torch.rand(N, device=device) * (H - h + 1)).long()
+    left = (torch.rand(N, device=device) * (W - w + 1)).long()
+    ys = torch.arange(H, device=device)
+    xs = torch.arange(W, device=device)
+    mask_y = (ys[None] >= top[:, None]) & (ys[None] < (top + h)[:, None])
+    mask_x = (xs[None] >= left[:, None]) & (xs[None] < (left + w)[:, None])
+    mask = mask_y[:, :, None] & mask_x[:, None, :] & apply[:, None, None]
+    return torch.where(mask[:, None, None], torch.randn_like(buffer), buffer)
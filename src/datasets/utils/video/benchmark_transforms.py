@@ -0,0 +1,127 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import random
+import time
+
+from logging import getLogger
+
+import numpy as np
+
+import torch
+import torchvision.transforms as transforms
+
+import src.datasets.utils.video.transforms as video_transforms
+
+logger = getLogger()
+
+_MEAN = torch.tensor((0.485, 0.456, 0.406)).view(-1, 1, 1, 1)
+_STD = torch.tensor((0.229, 0.224, 0.225)).view(-1, 1, 1, 1)
+
+
+def _crop(buffer, crop_size, motion_shift):
+    spatial_transform = video_transforms.random_resized_crop_with_shift \
+        if motion_shift else video_transforms.random_resized_crop
+    buffer = spatial_transform(
+        images=buffer,
+        target_height=crop_size,
+        target_width=crop_size,
+        scale=(0.3, 1.0),
+        ratio=(3/4, 4/3))
+    buffer, _ = video_transforms.horizontal_flip(0.5, buffer)
+    return buffer
+
+
+def pil_transform(buffer, crop_size, motion_shift=False):
+    """ Frames through PIL and converted to float before cropping """
+    buffer = [transforms.ToTensor()(transforms.ToPILImage()(frame))
+              for frame in buffer]
+    buffer = torch.stack(buffer).permute(1, 0, 2, 3)  # T C H W -> C T H W
+    buffer = (buffer - _MEAN) / _STD
+    return _crop(buffer, crop_size, motion_shift)
+
+
+def float_transform(buffer, crop_size, motion_shift=False):
+    """ Whole buffer converted to float before cropping """
+    buffer = torch.tensor(buffer, dtype=torch.float32).permute(3, 0, 1, 2)
+    buffer = _crop(buffer, crop_size, motion_shift)
+    return (buffer / 255. - _MEAN) / _STD
+
+
+def tensor_transform(buffer, crop_size, motion_shift=False):
+    """ uint8 buffer cropped first, only the crop is converted to float """
+    buffer = torch.from_numpy(buffer).permute(3, 0, 1, 2)
+    buffer = _crop(buffer, crop_size, motion_shift)
+    return buffer.div_(255.).sub_(_MEAN).div_(_STD)
+
+
+_TRANSFORMS = {
+    'pil': pil_transform,
+    'float': float_transform,
+    'tensor': tensor_transform,
+}
+
+
+def benchmark(
+    num_frames=16,
+    height=360,
+    width=640,
+    crop_size=224,
+    num_clips=20,
+    motion_shift=False,
+):
+    """
+    Time each transform pipeline on random clips, and report how far they
+    are from the float pipeline (for the same random crops and flips; the
+    transform classes themselves are tested in tests/test_video_transforms.py)
+    """
+    rng = np.random.default_rng(0)
+    shape = (num_frames, height, width, 3)
+    clips = [rng.integers(0, 256, shape, dtype=np.uint8)
+             for _ in range(num_clips)]
+    outputs, timings = {}, {}
+    for name, transform in _TRANSFORMS.items():
+        random.seed(0)
+        np.random.seed(0)
+        torch.manual_seed(0)
+        start_time = time.time()
+        outputs[name] = [
+            transform(clip, crop_size, motion_shift) for clip in clips]
+        timings[name] = (time.time() - start_time) / num_clips
+
+    for name in _TRANSFORMS:
+        max_diff = max((a - b).abs().max().item()
+                       for a, b in zip(outputs[name], outputs['float']))
+        logger.info(
+            f'{name:>8}: {1000. * timings[name]:.1f} ms/clip '
+            f'({timings["float"] / timings[name]:.2f}x vs. float), '
+            f'max abs. diff {max_diff:.2e}')
+    return timings
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-frames', type=int, default=16)
+    parser.add_argument('--height', type=int, default=360)
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--crop-size', type=int, default=224)
+    parser.add_argument('--num-clips', type=int, default=20)
+    parser.add_argument('--motion-shift', action='store_true')
+    args = parser.parse_args()
+
+    torch.set_num_threads(1)  # as in a dataloader worker
+    benchmark(
+        num_frames=args.num_frames,
+        height=args.height,
+        width=args.width,
+        crop_size=args.crop_size,
+        num_clips=args.num_clips,
+        motion_shift=args.motion_shift)
@@ -0,0 +1,160 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import argparse
+import os
+
+from logging import getLogger
+from multiprocessing import Pool
+
+import numpy as np
+
+logger = getLogger()
+
+_KEYFRAME_KEYS = ('keyframe_offsets', 'keyframes')
+
+
+def metadata_path(data_path):
+    """ Path of the metadata sidecar written next to a .csv/.npy dataset
+    file """
+    return f'{data_path}.meta.npz'
+
+
+def probe_codec(fname):
+    """ Name of the codec of the video stream of a file ('' if unknown) """
+    try:
+        import av
+        with av.open(fname) as container:
+            return container.streams.video[0].codec_context.name
+    except Exception:
+        return ''
+
+
+def probe_video(fname):
+    """
+    Probe a single video container.
+
+    :returns: (file size in bytes, number of frames, average fps, keyframe
+        indices, frame height, frame width, codec name); the file size is -1
+        if the file does not exist and the number of frames is 0 if the
+        container could not be read
+    """
+    from decord import VideoReader, cpu
+
+    if not os.path.exists(fname):
+        return -1, 0, 0., [], 0, 0, ''
+    fsize = os.path.getsize(fname)
+    if fsize < 1 * 1024:  # avoid hanging issue
+        return fsize, 0, 0., [], 0, 0, ''
+    try:
+        vr = VideoReader(fname, num_threads=1, ctx=cpu(0))
+        height, width = vr[0].shape[:2]
+        codec = probe_codec(fname)
+        return (fsize, len(vr), vr.get_avg_fps(), list(vr.get_key_indices()),
+                height, width, codec)
+    except Exception:
+        return fsize, 0, 0., [], 0, 0, ''
+
+
+def write_video_metadata(data_path, num_workers=8):
+    """
+    Probe every video listed in a .csv/.npy dataset file and save its size,
+    frame count, fps, keyframe positions, frame size and codec into a
+    sidecar file, so that
+    VideoDataset can filter videos and compute clip indices without opening
+    them.
+    """
+    from src.datasets.video_dataset import read_video_list
+
+    samples, _ = read_video_list(data_path)
+    logger.info(f'Probing {len(samples)} videos from {data_path}')
+    with Pool(num_workers) as pool:
+        probes = pool.map(probe_video, samples, chunksize=64)
+
+    keyframes = [p[3] for p in probes]
+    keyframe_offsets = np.cumsum([0] + [len(k) for k in keyframes])
+    np.savez(
+        metadata_path(data_path),
+        size=np.array([p[0] for p in probes], dtype=np.int64),
+        num_frames=np.array([p[1] for p in probes], dtype=np.int64),
+        fps=np.array([p[2] for p in probes], dtype=np.float32),
+        keyframe_offsets=keyframe_offsets.astype(np.int64),
+        keyframes=np.array([k for kf in keyframes for k in kf], dtype=np.int64),
+        height=np.array([p[4] for p in probes], dtype=np.int64),
+        width=np.array([p[5] for p in probes], dtype=np.int64),
+        codec=np.array([p[6] for p in probes], dtype=str))
+
+    num_bad = sum(p[1] == 0 for p in probes)
+    logger.info(
+        f'Wrote {metadata_path(data_path)} ({num_bad} unreadable videos)')
+
+
+def load_video_metadata(data_path, num_samples):
+    """
+    Load the metadata sidecar of a .csv/.npy dataset file as a dict of arrays
+    aligned with the rows of the dataset file
+    """
+    fname = metadata_path(data_path)
+    if not os.path.exists(fname):
+        raise FileNotFoundError(
+            f'No video metadata found for {data_path}; create it with '
+            f'"python -m src.datasets.utils.video.metadata '
+            f'--data-paths {data_path}"')
+    metadata = dict(np.load(fname))
+    if len(metadata['size']) != num_samples:
+        raise ValueError(
+            f'Video metadata {fname} is out of date with {data_path}')
+    return metadata
+
+
+def select_video_metadata(metadata, keep):
+    """ Keep the metadata of the videos selected by the boolean mask keep """
+    num_keyframes = np.diff(metadata['keyframe_offsets'])
+    selected = {
+        k: v[keep] for k, v in metadata.items() if k not in _KEYFRAME_KEYS}
+    selected['keyframe_offsets'] = np.concatenate(
+        [[0], np.cumsum(num_keyframes[keep])]).astype(np.int64)
+    selected['keyframes'] = \
+        metadata['keyframes'][np.repeat(keep, num_keyframes)]
+    return selected
+
+
+def concat_video_metadata(metadatas):
+    """ Concatenate the metadata of several datasets """
+    keyframe_offsets, base = [np.zeros(1, dtype=np.int64)], 0
+    for m in metadatas:
+        keyframe_offsets.append(m['keyframe_offsets'][1:] + base)
+        base += m['keyframe_offsets'][-1]
+    # Only keep the fields present in the metadata of all datasets
+    keys = set.intersection(*[set(m) for m in metadatas]) - set(_KEYFRAME_KEYS)
+    concat = {k: np.concatenate([m[k] for m in metadatas]) for k in keys}
+    concat['keyframe_offsets'] = np.concatenate(keyframe_offsets)
+    concat['keyframes'] = np.concatenate([m['keyframes'] for m in metadatas])
+    return concat
+
+
+def get_keyframes(metadata, index):
+    """ Keyframe indices of the video at position index """
+    offsets = metadata['keyframe_offsets']
+    return metadata['keyframes'][offsets[index]:offsets[index+1]]
+
+
+if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--data-paths', type=str, nargs='+', required=True,
+        help='.csv/.npy dataset files to index')
+    parser.add_argument(
+        '--num-workers', type=int, default=8,
+        help='number of processes used to probe videos')
+    args = parser.parse_args()
+
+    for data_path in args.data_paths:
+        write_video_metadata(data_path, num_workers=args.num_workers)
@@ -328,6 +328,7 @@ class AugmentOp:
 
     def __init__(self, name, prob=0.5, magnitude=10, hparams=None):
         hparams = hparams or _HPARAMS_DEFAULT
+        self.name = name
         self.aug_fn = NAME_TO_OP[name]
         self.level_fn = LEVEL_TO_ARG[name]
         self.prob = prob
@@ -348,19 +349,26 @@ class AugmentOp:
         # NOTE This is my own hack, being tested, not in papers or reference impls.
         self.magnitude_std = self.hparams.get("magnitude_std", 0)
 
-    def __call__(self, img_list):
+    def sample_level_args(self):
+        """ Arguments of the op for one application, or None if it is
+        skipped """
         if self.prob < 1.0 and random.random() > self.prob:
-            return img_list
+            return None
         magnitude = self.magnitude
         if self.magnitude_std and self.magnitude_std > 0:
             magnitude = random.gauss(magnitude, self.magnitude_std)
         magnitude = min(_MAX_LEVEL, max(0, magnitude))  # clip to valid range
-        level_args = (
+        return (
             self.level_fn(magnitude, self.hparams)
             if self.level_fn is not None
             else ()
         )
 
+    def __call__(self, img_list):
+        level_args = self.sample_level_args()
+        if level_args is None:
+            return img_list
+
         if isinstance(img_list, list):
             return [
                 self.aug_fn(img, *level_args, **self.kwargs) for img in img_list
@@ -452,36 +460,25 @@ class RandAugment:
         self.num_layers = num_layers
         self.choice_weights = choice_weights
 
-    def __call__(self, img):
+    def sample_ops(self):
         # no replacement when using weighted choice
-        ops = np.random.choice(
+        return np.random.choice(
             self.ops,
             self.num_layers,
             replace=self.choice_weights is None,
             p=self.choice_weights,
         )
-        for op in ops:
+
+    def __call__(self, img):
+        for op in self.sample_ops():
             img = op(img)
         return img
 
 
-def rand_augment_transform(config_str, hparams):
+def parse_rand_augment_config(config_str, hparams):
     """
-    RandAugment: Practical automated data augmentation... - https://arxiv.org/abs/1909.13719
-
-    Create a RandAugment transform
-    :param config_str: String defining configuration of random augmentation. Consists of multiple sections separated by
-    dashes ('-'). The first section defines the specific variant of rand augment (currently only 'rand'). The remaining
-    sections, not order sepecific determine
-        'm' - integer magnitude of rand augment
-        'n' - integer num layers (number of transform ops selected per image)
-        'w' - integer probabiliy weight index (index of a set of weights to influence choice of op)
-        'mstd' -  float std deviation of magnitude noise applied
-        'inc' - integer (bool), use augmentations that increase in severity with magnitude (default: 0)
-    Ex 'rand-m9-n3-mstd0.5' results in RandAugment with magnitude 9, num_layers 3, magnitude_std 0.5
-    'rand-mstd1-w0' results in magnitude_std 1.0, weights 0, default magnitude of 10 and num_layers 2
-    :param hparams: Other hparams (kwargs) for the RandAugmentation scheme
-    :return: A PyTorch compatible Transform
+    Parse a RandAugment config string (see rand_augment_transform)
+    :return: ops, num_layers and choice_weights of the RandAugment transform
     """
     magnitude = _MAX_LEVEL  # default to _MAX_LEVEL for magnitude (currently 10)
     num_layers = 2  # default to 2 ops per image
@@ -515,4 +512,33 @@ def rand_augment_transform(config_str, hparams):
     choice_weights = (
         None if weight_idx is None else _select_rand_weights(weight_idx)
     )
+    return ra_ops, num_layers, choice_weights
+
+
+def rand_augment_transform(config_str, hparams):
+    """
+    RandAugment: Practical automated data augmentation...
+    - https://arxiv.org/abs/1909.13719
+
+    Create a RandAugment transform
+    :param config_str: String defining configuration of random augmentation.
+    Consists of multiple sections separated by dashes ('-'). The first
+    section defines the specific variant of rand augment (currently only
+    'rand'). The remaining sections, not order sepecific determine
+        'm' - integer magnitude of rand augment
+        'n' - integer num layers (number of transform ops selected per image)
+        'w' - integer probabiliy weight index (index of a set of weights to
+            influence choice of op)
+        'mstd' -  float std deviation of magnitude noise applied
+        'inc' - integer (bool), use augmentations that increase in severity
+            with magnitude (default: 0)
+    Ex 'rand-m9-n3-mstd0.5' results in RandAugment with magnitude 9,
+    num_layers 3, magnitude_std 0.5
+    'rand-mstd1-w0' results in magnitude_std 1.0, weights 0, default
+    magnitude of 10 and num_layers 2
+    :param hparams: Other hparams (kwargs) for the RandAugmentation scheme
+    :return: A PyTorch compatible Transform
+    """
+    ra_ops, num_layers, choice_weights = parse_rand_augment_config(
+        config_str, hparams)
     return RandAugment(ra_ops, num_layers, choice_weights=choice_weights)
@@ -0,0 +1,331 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+"""
+Tensor implementation of the RandAugment ops of randaugment.py, applied to
+whole clips (T x C x H x W) or batches of clips (N x T x C x H x W) of
+uint8 frames at once instead of to PIL images frame by frame.
+
+Ops follow the PIL implementations (lookup tables, rounding, pixel-center
+affine transforms with fill outside of the image), and their random
+arguments are drawn per clip with the same RandAugment/AugmentOp logic, so
+that outputs statistically match the PIL path. Ops take float clips of
+uint8 values, with one argument per clip, and may transform them in place.
+"""
+
+import math
+import random
+
+import numpy as np
+
+import torch
+import torch.nn.functional as F
+
+from PIL import Image
+
+from src.datasets.utils.video.randaugment import parse_rand_augment_config
+
+_INTERPOLATION_MODES = {
+    Image.NEAREST: 'nearest',
+    Image.BILINEAR: 'bilinear',
+    Image.BICUBIC: 'bicubic',
+}
+
+# PIL ITU-R 601-2 luma transform, in 16-bit fixed point
+_LUMA_WEIGHTS = (19595., 38470., 7471.)
+
+
+def _blend(degenerate, x, factor):
+    """ PIL Image.blend(degenerate, x, factor), truncated to uint8 values
+    (in place) """
+    return torch.lerp(degenerate, x, factor, out=x).clamp_(0, 255).floor_()
+
+
+def _grayscale(x):
+    """ PIL convert('L') of RGB frames (... x 3 x H x W), keeping a channel
+    dimension """
+    r, g, b = x.unbind(dim=-3)
+    w_r, w_g, w_b = _LUMA_WEIGHTS
+    gray = (r * w_r + g * w_g + b * w_b + 32768.) / 65536.
+    return gray.floor_().unsqueeze(-3)
+
+
+def _factor(level, x):
+    return level.to(x.dtype).view(-1, *([1] * (x.dim() - 1)))
+
+
+def _affine(x, matrix, fillcolor, resample):
+    """
+    PIL Image.transform(size, AFFINE, matrix) of every clip: the output
+    pixel centered at (x, y) samples the input at matrix @ (x, y, 1), and
+    is set to fillcolor if that point is outside of the input image
+
+    :param matrix: affine matrices of the clips (N x 2 x 3)
+    """
+    N, T, C, H, W = x.shape
+    ys, xs = torch.meshgrid(
+        torch.arange(H, dtype=x.dtype) + 0.5,
+        torch.arange(W, dtype=x.dtype) + 0.5,
+        indexing='ij')
+    coords = torch.stack([xs, ys, torch.ones_like(xs)], dim=-1)
+    # N x H x W x 2
+    src = torch.einsum('hwk,njk->nhwj', coords, matrix.to(x.dtype))
+    inside = (src[..., 0] >= 0) & (src[..., 0] < W) \
+        & (src[..., 1] >= 0) & (src[..., 1] < H)
+    grid = src * torch.tensor([2. / W, 2. / H], dtype=x.dtype) - 1
+    out = F.grid_sample(
+        x.reshape(N, T * C, H, W),
+        grid,
+        mode=_INTERPOLATION_MODES[resample],
+        padding_mode='border',
+        align_corners=False)
+    out = out.view(N, T, C, H, W).round_().clamp_(0, 255)
+    fill = torch.tensor(fillcolor[:C], dtype=x.dtype).view(1, 1, C, 1, 1)
+    return torch.where(inside.view(N, 1, 1, H, W), out, fill)
+
+
+def _affine_matrix(a, b, c, d, e, f):
+    rows = [torch.stack([a, b, c], dim=-1), torch.stack([d, e, f], dim=-1)]
+    return torch.stack(rows, dim=-2)
+
+
+def shear_x(x, factor, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(factor), torch.ones_like(factor)
+    matrix = _affine_matrix(ones, factor, zeros, zeros, ones, zeros)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def shear_y(x, factor, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(factor), torch.ones_like(factor)
+    matrix = _affine_matrix(ones, zeros, zeros, factor, ones, zeros)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def translate_x_rel(x, pct, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(pct), torch.ones_like(pct)
+    pixels = pct * x.shape[-1]
+    matrix = _affine_matrix(ones, zeros, pixels, zeros, ones, zeros)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def translate_y_rel(x, pct, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(pct), torch.ones_like(pct)
+    pixels = pct * x.shape[-2]
+    matrix = _affine_matrix(ones, zeros, zeros, zeros, ones, pixels)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def translate_x_abs(x, pixels, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(pixels), torch.ones_like(pixels)
+    matrix = _affine_matrix(ones, zeros, pixels, zeros, ones, zeros)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def translate_y_abs(x, pixels, fillcolor, resample, **__):
+    zeros, ones = torch.zeros_like(pixels), torch.ones_like(pixels)
+    matrix = _affine_matrix(ones, zeros, zeros, zeros, ones, pixels)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def rotate(x, degrees, fillcolor, resample, **__):
+    # Rotation (counter-clockwise) around the center of the frames, as PIL
+    # Image.rotate
+    H, W = x.shape[-2:]
+    cx, cy = W / 2., H / 2.
+    angle = -degrees * (math.pi / 180.)
+    cos, sin = torch.cos(angle), torch.sin(angle)
+    c = cos * -cx + sin * -cy + cx
+    f = -sin * -cx + cos * -cy + cy
+    matrix = _affine_matrix(cos, sin, c, -sin, cos, f)
+    return _affine(x, matrix, fillcolor, resample)
+
+
+def auto_contrast(x, *_, **__):
+    # Per-frame and per-channel stretch of [min, max] to [0, 255]
+    # with the lookup tables of PIL ImageOps.autocontrast (double precision)
+    lo = x.amin(dim=(-2, -1), keepdim=True).double()
+    hi = x.amax(dim=(-2, -1), keepdim=True).double()
+    stretch = hi > lo
+    # (a scalar over a tensor divides by a reciprocal, which rounds off PIL)
+    scale = torch.full_like(hi, 255.).div_((hi - lo).clamp_(min=1))
+    scale = torch.where(stretch, scale, 1.)
+    offset = -lo * scale * stretch
+    out = (x.double() * scale + offset).floor_().clamp_(0, 255)
+    return out.to(x.dtype)
+
+
+def equalize(x, *_, **__):
+    # Per-frame and per-channel histogram equalization, with the lookup
+    # tables of PIL ImageOps.equalize
+    shape = x.shape
+    num_channels, num_pixels = math.prod(shape[:-2]), shape[-2] * shape[-1]
+    index = x.reshape(num_channels, num_pixels).to(torch.int64)
+    # value index in every channel
+    index += torch.arange(0, 256 * num_channels, 256).view(-1, 1)
+    hist = torch.bincount(index.view(-1), minlength=256 * num_channels)
+    hist = hist.view(num_channels, 256)
+    top = x.reshape(num_channels, num_pixels).amax(dim=1, keepdim=True).long()
+    last = hist.gather(1, top)  # count of the last non-empty bin
+    step = (num_pixels - last) // 255
+    # number of pixels below every value
+    cumsum = torch.cumsum(hist, dim=1) - hist
+    lut = ((step // 2 + cumsum) // step.clamp(min=1)).clamp_(max=255)
+    lut = torch.where(step > 0, lut, torch.arange(256)).to(x.dtype)
+    return torch.take(lut, index).view(shape)
+
+
+def invert(x, *_, **__):
+    return x.neg_().add_(255.)
+
+
+def solarize(x, thresh, **__):
+    # x + (255 - 2x) = 255 - x above the threshold
+    return x.addcmul_(x >= _factor(thresh, x), x.mul(-2.).add_(255.))
+
+
+def solarize_add(x, add, thresh=128, **__):
+    return x.add_((x < thresh) * _factor(add, x)).clamp_(max=255)
+
+
+def posterize(x, bits_to_keep, **__):
+    mask = (0xFF << (8 - bits_to_keep.long().clamp(max=8))) & 0xFF
+    out = x.to(torch.uint8) & _factor(mask, x).to(torch.uint8)
+    return out.float()
+
+
+def contrast(x, factor, **__):
+    # Blend with the (rounded) mean gray level of every frame
+    mean = _grayscale(x).mean(dim=(-3, -2, -1), keepdim=True)
+    return _blend((mean + 0.5).floor_(), x, _factor(factor, x))
+
+
+def color(x, factor, **__):
+    return _blend(_grayscale(x), x, _factor(factor, x))
+
+
+def brightness(x, factor, **__):
+    return x.mul_(_factor(factor, x)).clamp_(0, 255).floor_()
+
+
+def sharpness(x, factor, **__):
+    # Blend with PIL ImageFilter.SMOOTH, which leaves border pixels unchanged
+    # (kernel of ones with a center weight of 5, i.e., a 3x3 box sum plus 4
+    # times the center, divided by 13)
+    rows = x[..., :-2, :] + x[..., 1:-1, :] + x[..., 2:, :]
+    box = rows[..., :-2] + rows[..., 1:-1] + rows[..., 2:]
+    degenerate = x.clone()
+    center = degenerate[..., 1:-1, 1:-1]
+    center.add_(box, alpha=1. / 4.).mul_(4. / 13.).round_()
+    return _blend(degenerate, x, _factor(factor, x))
+
+
+NAME_TO_OP = {
+    "AutoContrast": auto_contrast,
+    "Equalize": equalize,
+    "Invert": invert,
+    "Rotate": rotate,
+    "Posterize": posterize,
+    "PosterizeIncreasing": posterize,
+    "PosterizeOriginal": posterize,
+    "Solarize": solarize,
+    "SolarizeIncreasing": solarize,
+    "SolarizeAdd": solarize_add,
+    "Color": color,
+    "ColorIncreasing": color,
+    "Contrast": contrast,
+    "ContrastIncreasing": contrast,
+    "Brightness": brightness,
+    "BrightnessIncreasing": brightness,
+    "Sharpness": sharpness,
+    "SharpnessIncreasing": sharpness,
+    "ShearX": shear_x,
+    "ShearY": shear_y,
+    "TranslateX": translate_x_abs,
+    "TranslateY": translate_y_abs,
+    "TranslateXRel": translate_x_rel,
+    "TranslateYRel": translate_y_rel,
+}
+
+
+class TensorRandAugment:
+    """
+    RandAugment of clips (T x C x H x W) or batches of clips
+    (N x T x C x H x W) of uint8 frames.
+
+    As with RandAugment of PIL frames, num_layers ops are drawn for every
+    clip, each applied with its own probability and magnitude, and with the
+    same arguments to all the frames of the clip. The clips of a batch get
+    independent draws, and, at every layer, the clips drawn the same op are
+    transformed together.
+    """
+
+    def __init__(self, ops, num_layers=2, choice_weights=None):
+        self.ops = ops
+        self.num_layers = num_layers
+        self.choice_weights = choice_weights
+
+    def _sample_op_args(self):
+        """ Op, arguments and interpolation of every layer for one clip (None
+        if skipped) """
+        # no replacement when using weighted choice
+        ops = np.random.choice(
+            self.ops,
+            self.num_layers,
+            replace=self.choice_weights is None,
+            p=self.choice_weights,
+        )
+        layers = []
+        for op in ops:
+            level_args = op.sample_level_args()
+            resample = op.kwargs["resample"]
+            if isinstance(resample, (list, tuple)):
+                resample = random.choice(resample)
+            if level_args is None:
+                layers.append(None)
+            else:
+                layers.append((op, level_args, resample))
+        return layers
+
+    def __call__(self, clips):
+        batched = clips.dim() == 5
+        x = clips if batched else clips.unsqueeze(0)
+        x = x.to(torch.float32, memory_format=torch.contiguous_format,
+                 copy=True)
+        draws = [self._sample_op_args() for _ in range(len(x))]
+
+        for layer in range(self.num_layers):
+            # Clips transformed together share an op and an interpolation
+            groups = {}
+            for i, draw in enumerate(draws):
+                if draw[layer] is not None:
+                    op, level_args, resample = draw[layer]
+                    group = groups.setdefault((op.name, resample), (op, []))
+                    group[1].append((i, level_args))
+            for (name, resample), (op, members) in groups.items():
+                index = torch.tensor([i for i, _ in members])
+                level_args = [
+                    torch.tensor([a[k] for _, a in members],
+                                 dtype=torch.float32)
+                    for k in range(len(members[0][1]))]
+                kwargs = dict(op.kwargs, resample=resample)
+                if len(members) == len(x):
+                    x = NAME_TO_OP[name](x, *level_args, **kwargs)
+                else:
+                    x[index] = NAME_TO_OP[name](x[index], *level_args, **kwargs)
+
+        out = x.to(clips.dtype) if clips.dtype == torch.uint8 else x
+        return out if batched else out[0]
+
+
+def tensor_rand_augment_transform(config_str, hparams):
+    """
+    Create a TensorRandAugment transform from a RandAugment config string
+    (see rand_augment_transform), e.g., 'rand-m7-n4-mstd0.5-inc1'
+    """
+    ra_ops, num_layers, choice_weights = parse_rand_augment_config(
+        config_str, hparams)
+    return TensorRandAugment(ra_ops, num_layers, choice_weights=choice_weights)
@@ -19,6 +19,9 @@ from torchvision import transforms
 
 import src.datasets.utils.video.functional as FF
 from src.datasets.utils.video.randaugment import rand_augment_transform
+from src.datasets.utils.video.tensor_randaugment import (
+    tensor_rand_augment_transform,
+)
 
 
 _pil_interpolation_to_str = {
@@ -542,6 +545,51 @@ def _get_param_spatial_crop(
     return i, j, h, w
 
 
+def crop_resize_grid(boxes, in_size, out_size, flip=None):
+    """
+    Sampling grid (for grid_sample with align_corners=False) resizing crops
+    of images to a common size, matching interpolate (bilinear,
+    align_corners=False) applied to each crop separately.
+
+    Args:
+        boxes (tensor): crop boxes (top, left, height, width) in pixels.
+            Dimension is `num crops` x 4.
+        in_size: (height, width) of the images.
+        out_size: (height, width) of the resized crops.
+        flip (tensor): optional. Whether to mirror each crop horizontally.
+            Dimension is `num crops`.
+    Returns:
+        grid (tensor): dimension is `num crops` x `out height` x
+            `out width` x 2.
+    """
+    boxes = boxes.to(torch.float32)
+    top, left, h, w = boxes.unbind(1)
+    (in_h, in_w), (out_h, out_w) = in_size, out_size
+
+    # Center of every output pixel, as a fraction of the crop
+    ys = (torch.arange(out_h, device=boxes.device) + 0.5) / out_h
+    xs = (torch.arange(out_w, device=boxes.device) + 0.5) / out_w
+    ys, xs = ys.expand(len(boxes), out_h), xs.expand(len(boxes), out_w)
+    if flip is not None:
+        xs = torch.where(flip[:, None], 1. - xs, xs)
+
+    # Source pixel coordinates, clamped to the crop as done by interpolate
+    py = top[:, None] + ys * h[:, None] - 0.5
+    px = left[:, None] + xs * w[:, None] - 0.5
+    py = torch.minimum(
+        torch.maximum(py, top[:, None]), (top + h - 1)[:, None])
+    px = torch.minimum(
+        torch.maximum(px, left[:, None]), (left + w - 1)[:, None])
+
+    # Normalized coordinates of grid_sample
+    gy = (2. * py + 1.) / in_h - 1.
+    gx = (2. * px + 1.) / in_w - 1.
+    return torch.stack([
+        gx[:, None, :].expand(-1, out_h, -1),
+        gy[:, :, None].expand(-1, -1, out_w),
+    ], dim=-1)
+
+
 def random_resized_crop(
     images,
     target_height,
@@ -557,7 +605,8 @@ def random_resized_crop(
     Inception networks.
 
     Args:
-        images: Images to perform resizing and cropping.
+        images: Images to perform resizing and cropping (uint8 images are
+            only converted to float once cropped).
         target_height: Desired height after cropping.
         target_width: Desired width after cropping.
         scale: Scale range of Inception-style area based random resizing.
@@ -569,6 +618,8 @@ def random_resized_crop(
 
     i, j, h, w = _get_param_spatial_crop(scale, ratio, height, width)
     cropped = images[:, :, i:i + h, j:j + w]
+    if not cropped.is_floating_point():
+        cropped = cropped.float()
     return torch.nn.functional.interpolate(
         cropped,
         size=(target_height, target_width),
@@ -577,6 +628,19 @@ def random_resized_crop(
     )
 
 
+def _get_param_spatial_crop_with_shift(scale, ratio, height, width, num_frames):
+    """
+    Boxes (top, left, height, width) of every frame, linearly interpolated
+    between two boxes sampled for the first and last frame.
+    Dimension is `num frames` x 4.
+    """
+    first = _get_param_spatial_crop(scale, ratio, height, width)
+    last = _get_param_spatial_crop(scale, ratio, height, width)
+    boxes = [torch.linspace(a, b, steps=num_frames)
+             for a, b in zip(first, last)]
+    return torch.stack(boxes, dim=1).long()
+
+
 def random_resized_crop_with_shift(
     images,
     target_height,
@@ -589,8 +653,13 @@ def random_resized_crop_with_shift(
     boxes (for cropping) for the first and last frame. It then linearly
     interpolates the two boxes for other frames.
 
+    All frames are resampled with a single grid_sample call: the crop of
+    every frame is converted to float into a tensor of crops padded to a
+    common size, which are resized through per-frame sampling grids.
+
     Args:
-        images: Images to perform resizing and cropping.
+        images: Images to perform resizing and cropping (uint8 images are
+            only converted to float once cropped).
         target_height: Desired height after cropping.
         target_width: Desired width after cropping.
         scale: Scale range of Inception-style area based random resizing.
@@ -600,32 +669,36 @@ def random_resized_crop_with_shift(
     height = images.shape[2]
     width = images.shape[3]
 
-    i, j, h, w = _get_param_spatial_crop(scale, ratio, height, width)
-    i_, j_, h_, w_ = _get_param_spatial_crop(scale, ratio, height, width)
-    i_s = [int(i) for i in torch.linspace(i, i_, steps=t).tolist()]
-    j_s = [int(i) for i in torch.linspace(j, j_, steps=t).tolist()]
-    h_s = [int(i) for i in torch.linspace(h, h_, steps=t).tolist()]
-    w_s = [int(i) for i in torch.linspace(w, w_, steps=t).tolist()]
-    out = torch.zeros((3, t, target_height, target_width))
-    for ind in range(t):
-        out[:, ind:ind + 1, :, :] = torch.nn.functional.interpolate(
-            images[
-                :,
-                ind:ind + 1,
-                i_s[ind]:i_s[ind] + h_s[ind],
-                j_s[ind]:j_s[ind] + w_s[ind],
-            ],
-            size=(target_height, target_width),
-            mode='bilinear',
-            align_corners=False,
-        )
-    return out
+    boxes = _get_param_spatial_crop_with_shift(scale, ratio, height, width, t)
+    crop_height, crop_width = boxes[:, 2].max().item(), boxes[:, 3].max().item()
+    crops = torch.empty((t, images.shape[0], crop_height, crop_width))
+    for ind, (i, j, h, w) in enumerate(boxes.tolist()):
+        crops[ind, :, :h, :w] = images[:, ind, i:i + h, j:j + w]
+        # Bilinear sampling on the last row (column) of a crop also reads
+        # the next one with a zero weight, so the padding is zeroed rather
+        # than left uninitialized (0 * nan is nan)
+        crops[ind, :, h:] = 0
+        crops[ind, :, :h, w:] = 0
+    boxes[:, :2] = 0
+
+    grid = crop_resize_grid(
+        boxes, (crop_height, crop_width), (target_height, target_width))
+    out = torch.nn.functional.grid_sample(
+        crops,
+        grid,
+        mode='bilinear',
+        padding_mode='border',
+        align_corners=False,
+    )
+    # Contiguous C T H W clips, as for random_resized_crop
+    return out.transpose(0, 1).contiguous()
 
 
 def create_random_augment(
     input_size,
     auto_augment=None,
     interpolation='bilinear',
+    tensor=False,
 ):
     """
     Get video randaug transform.
@@ -636,6 +709,9 @@ def create_random_augment(
             "rand-m7-n4-mstd0.5-inc1" (m is the magnitude and n is the number
             of operations to apply).
         interpolation: Interpolation method.
+        tensor: Whether to transform uint8 clip tensors (T x C x H x W, or
+            batches of clips N x T x C x H x W) rather than lists of PIL
+            images.
     """
     if isinstance(input_size, tuple):
         img_size = input_size[-2:]
@@ -652,6 +728,8 @@ def create_random_augment(
         if interpolation and interpolation != 'random':
             aa_params['interpolation'] = _pil_interp(interpolation)
         if auto_augment.startswith('rand'):
+            if tensor:
+                return tensor_rand_augment_transform(auto_augment, aa_params)
             return transforms.Compose(
                 [rand_augment_transform(auto_augment, aa_params)]
             )
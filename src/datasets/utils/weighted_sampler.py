@@ -5,6 +5,8 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import itertools
+
 from typing import Iterator, Optional
 from operator import itemgetter
 import numpy as np
@@ -95,3 +97,236 @@ class DistributedWeightedSampler(DistributedSamplerWrapper):
             rank=rank,
             shuffle=shuffle,
         )
+
+
+class CostBalancedDistributedSampler(Sampler):
+    """
+    Distributed sampler balancing the decoding cost of batches across ranks.
+
+    Every epoch, all ranks draw the same samples (weighted by weights, if
+    given, as DistributedWeightedSampler does), split them into global
+    steps of num_replicas * batch_size samples, and deal the samples of each
+    step to ranks by decreasing cost in serpentine order, so that every rank
+    gets a batch of similar total cost at every step. Only the assignment of
+    samples to ranks changes, not which samples are drawn.
+
+    Costs are read from dataset.sample_costs at the start of every epoch,
+    after merging the costs measured on all ranks. They are not part of the
+    resume cursor (see ResumableSampler), so a resumed epoch has the same
+    steps, but their samples may be dealt to different ranks.
+    """
+
+    def __init__(
+        self,
+        dataset,
+        batch_size,
+        weights=None,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        seed: int = 0,
+    ):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        if weights is not None:
+            weights = np.asarray(weights, dtype=np.float64)
+        self.weights = weights
+        self.num_replicas = 1 if num_replicas is None else num_replicas
+        self.rank = 0 if rank is None else rank
+        self.seed = seed
+        self.epoch = 0
+        self.num_steps = len(dataset) // (self.num_replicas * batch_size)
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    @staticmethod
+    def _all_reduce_max(costs):
+        """ Merge the costs measured on every rank """
+        dist = torch.distributed
+        if not (dist.is_available() and dist.is_initialized()
+                and dist.get_world_size() > 1):
+            return costs
+        device = 'cuda' if dist.get_backend() == 'nccl' else 'cpu'
+        costs = torch.from_numpy(costs).to(device)
+        dist.all_reduce(costs, op=dist.ReduceOp.MAX)
+        return costs.cpu().numpy()
+
+    def __iter__(self) -> Iterator[int]:
+        costs = self.dataset.sample_costs(reduce_fn=self._all_reduce_max)
+
+        # Same samples, in the same order, on all ranks
+        rng = np.random.default_rng(self.seed + self.epoch)
+        num_samples = self.num_steps * self.num_replicas * self.batch_size
+        if self.weights is None:
+            indices = rng.permutation(len(self.dataset))[:num_samples]
+        else:
+            indices = rng.choice(
+                len(self.weights), size=num_samples, replace=False,
+                p=self.weights / self.weights.sum())
+
+        # Serpentine dealing: rank order 0..R-1, R-1..0, ... over the
+        # samples of each step sorted by decreasing cost
+        steps = indices.reshape(self.num_steps, -1)
+        order = np.argsort(-costs[steps], axis=1, kind='stable')
+        steps = np.take_along_axis(steps, order, axis=1)
+        num_replicas = self.num_replicas
+        deal = np.arange(num_replicas * self.batch_size) % (2 * num_replicas)
+        deal = np.where(deal < num_replicas, deal, 2 * num_replicas - 1 - deal)
+        return iter(steps[:, deal == self.rank].reshape(-1).tolist())
+
+    def __len__(self) -> int:
+        return self.num_steps * self.batch_size
+
+
+def _mix(x, key):
+    """ Keyed 64-bit hash of an array of uint64 """
+    x = (x ^ np.uint64(key)) * np.uint64(0x9E3779B97F4A7C15)
+    x ^= x >> np.uint64(31)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    return x ^ (x >> np.uint64(29))
+
+
+def feistel_permutation(x, n, key, num_rounds=4):
+    """
+    Image of the positions x under a pseudo-random permutation of range(n)
+    determined by key, computed without materializing the permutation (a
+    Feistel network over the smallest even number of bits covering n, with
+    cycle-walking to stay within range(n))
+    """
+    half = max(1, (int(n - 1).bit_length() + 1) // 2)
+    mask = np.uint64((1 << half) - 1)
+    keys = [int(_mix(np.array([key + i], dtype=np.uint64), 0x5bd1e995)[0])
+            for i in range(num_rounds)]
+
+    def encrypt(v):
+        left, right = v >> np.uint64(half), v & mask
+        for k in keys:
+            left, right = right, left ^ (_mix(right, k) & mask)
+        return (left << np.uint64(half)) | right
+
+    with np.errstate(over='ignore'):
+        x = encrypt(np.asarray(x, dtype=np.uint64))
+        out = x >= n
+        while out.any():
+            x[out] = encrypt(x[out])
+            out = x >= n
+    return x.astype(np.int64)
+
+
+class StratifiedDistributedSampler(Sampler):
+    """
+    Distributed weighted sampler using O(1) memory in the number of samples.
+
+    Every sample first draws a dataset according to datasets_weights, then
+    the next index of a pseudo-random permutation of that dataset (see
+    feistel_permutation), whose positions are interleaved across ranks so
+    that ranks draw disjoint samples within each pass over a dataset.
+    Sampling is deterministic given the seed, rank and epoch.
+    """
+
+    def __init__(
+        self,
+        num_samples_per_dataset,
+        datasets_weights=None,
+        num_replicas: Optional[int] = None,
+        rank: Optional[int] = None,
+        seed: int = 0,
+        chunk_size: int = 65536,
+    ):
+        self.num_samples_per_dataset = np.asarray(
+            num_samples_per_dataset, dtype=np.int64)
+        if datasets_weights is None:
+            datasets_weights = self.num_samples_per_dataset
+        self.datasets_weights = np.asarray(datasets_weights, dtype=np.float64)
+        self.datasets_weights /= self.datasets_weights.sum()
+        self.dataset_offsets = np.concatenate(
+            [[0], np.cumsum(self.num_samples_per_dataset)[:-1]])
+        self.num_replicas = 1 if num_replicas is None else num_replicas
+        self.rank = 0 if rank is None else rank
+        self.seed = seed
+        self.chunk_size = chunk_size
+        self.epoch = 0
+        self.num_samples = \
+            int(self.num_samples_per_dataset.sum()) // self.num_replicas
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        rng = np.random.default_rng([self.seed, self.epoch, self.rank])
+        counters = np.zeros(len(self.num_samples_per_dataset), dtype=np.int64)
+        for start in range(0, self.num_samples, self.chunk_size):
+            size = min(self.chunk_size, self.num_samples - start)
+            datasets = rng.choice(
+                len(self.datasets_weights), size=size,
+                p=self.datasets_weights)
+            indices = np.empty(size, dtype=np.int64)
+            for d in np.unique(datasets):
+                sel = datasets == d
+                n = int(self.num_samples_per_dataset[d])
+                # Position of the draws of this rank in the (per-pass)
+                # permutations of the dataset
+                pos = counters[d] + np.arange(sel.sum())
+                pos = pos * self.num_replicas + self.rank
+                counters[d] += sel.sum()
+                passes, pos = pos // n, pos % n
+                perm = np.empty_like(pos)
+                for p in np.unique(passes):
+                    key = np.random.SeedSequence(
+                        [self.seed, self.epoch, int(d), int(p)])
+                    perm[passes == p] = feistel_permutation(
+                        pos[passes == p], n, int(key.generate_state(1)[0]))
+                indices[sel] = self.dataset_offsets[d] + perm
+            yield from indices.tolist()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+class ResumableSampler(Sampler):
+    """
+    Wrapper making a (distributed) sampler resumable mid-pass.
+
+    The DataLoader draws the indices of its k-th batch from positions
+    [k * batch_size, (k + 1) * batch_size) of the sampler, so the cursor of
+    a pass over the loader is the epoch the pass started with and the number
+    of indices consumed; a resumed pass regenerates the same indices and
+    drops the consumed ones, without loading any sample.
+
+    Note that this is only exact if batches are delivered in order (i.e.,
+    not with out_of_order).
+    """
+
+    def __init__(self, sampler, batch_size):
+        self.sampler = sampler
+        self.batch_size = batch_size
+        self.epoch = 0
+        self._resume = None
+        self._pass_epoch = 0  # epoch the current pass started with
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+        self.sampler.set_epoch(epoch)
+
+    def state_dict(self, num_batches_consumed):
+        """ Cursor after the first num_batches_consumed batches of the
+        current pass """
+        return dict(epoch=self._pass_epoch,
+                    start=num_batches_consumed * self.batch_size)
+
+    def load_state_dict(self, state_dict):
+        """ Resume the next pass from a saved cursor """
+        self._resume = state_dict
+
+    def __iter__(self) -> Iterator[int]:
+        epoch, start = self.epoch, 0
+        if self._resume is not None:
+            epoch, start = self._resume['epoch'], self._resume['start']
+            self._resume = None
+            self.sampler.set_epoch(epoch)
+        self._pass_epoch = epoch
+        return itertools.islice(iter(self.sampler), start, None)
+
+    def __len__(self) -> int:
+        start = 0 if self._resume is None else self._resume['start']
+        return max(0, len(self.sampler) - start)
@@ -5,20 +5,46 @@
 # LICENSE file in the root directory of this source tree.
 #
 
+import inspect
 import os
 import pathlib
+import threading
+import time
 import warnings
 
+from collections import deque
 from logging import getLogger
+from multiprocessing.sharedctypes import RawArray
 
 import numpy as np
 import pandas as pd
 
-from decord import VideoReader, cpu
-
 import torch
 
-from src.datasets.utils.weighted_sampler import DistributedWeightedSampler
+from src.datasets.utils.blocklist import SampleBlocklist
+from src.datasets.utils.clip_cache import SharedClipCache
+from src.datasets.utils.reader_cache import VideoReaderCache
+from src.datasets.utils.sample_index import SampleIndex, sample_index_path
+from src.datasets.utils.thread_budget import ThreadBudget
+from src.datasets.utils.video.backends import (
+    available_backends,
+    calibrate_backends,
+    open_video,
+    video_format,
+)
+from src.datasets.utils.weighted_sampler import (
+    CostBalancedDistributedSampler,
+    DistributedWeightedSampler,
+    ResumableSampler,
+    StratifiedDistributedSampler,
+)
+from src.datasets.utils.video.metadata import (
+    load_video_metadata,
+    select_video_metadata,
+    concat_video_metadata,
+    get_keyframes,
+)
+from src.utils.logging import SharedAverageMeter, SharedHistogram
 
 _GLOBAL_SEED = 0
 logger = getLogger()
@@ -45,7 +71,68 @@ def make_videodataset(
     pin_mem=True,
     duration=None,
     log_dir=None,
+    use_video_metadata=False,
+    blocklist_dir=None,
+    decode_short_side=None,
+    zero_copy_decode=False,
+    keyframe_aligned_sampling=False,
+    keyframe_max_shift=None,
+    samples_per_video=1,
+    sample_pool_size=None,
+    echo_factor=1,
+    clip_cache_dir=None,
+    clip_cache_size_gb=32.,
+    reader_cache_size=0,
+    reader_cache_gb=1.,
+    video_backend='decord',
+    thread_budget=False,
+    decode_timeout=None,
+    max_hung_decodes=8,
+    out_of_order=False,
+    cost_balanced_sampling=False,
+    use_sample_index=False,
+    partition_sample_index=False,
+    stratified_sampling=False,
 ):
+    blocklist = None
+    if blocklist_dir is not None:
+        blocklist = SampleBlocklist(blocklist_dir, rank=rank)
+
+    clip_cache = None
+    if clip_cache_dir is not None and random_clip_sampling:
+        # Randomly sampled clips are almost never sampled again, so caching
+        # them would only fill the cache
+        logger.info(
+            'Clip cache requires deterministic clip sampling, ignoring')
+    elif clip_cache_dir is not None:
+        clip_cache = SharedClipCache(
+            clip_cache_dir, max_bytes=clip_cache_size_gb * 1024**3)
+
+    reader_cache = None
+    if reader_cache_size > 0:
+        reader_cache = VideoReaderCache(
+            max_readers=reader_cache_size,
+            max_bytes=reader_cache_gb * 1024**3)
+
+    # [Optional] Split cores between workers, decoding and torch threads
+    worker_init_fn = None
+    if thread_budget:
+        worker_init_fn = ThreadBudget(num_workers)
+        num_workers = worker_init_fn.num_workers
+
+    # [Optional] Hand out batches as soon as any worker has one ready,
+    # rather than in sampler order, so that a slow video only delays its
+    # own batch; batches are the same, only their (non-deterministic)
+    # order changes, so a pass cannot be resumed mid-way
+    loader_kwargs = {}
+    if out_of_order:
+        loader_signature = inspect.signature(torch.utils.data.DataLoader)
+        if 'in_order' in loader_signature.parameters:
+            loader_kwargs['in_order'] = False
+        else:
+            logger.info('Out-of-order batches require a more recent version '
+                        'of PyTorch, ignoring')
+
     dataset = VideoDataset(
         data_paths=data_paths,
         datasets_weights=datasets_weights,
@@ -57,11 +144,50 @@ def make_videodataset(
         filter_short_videos=filter_short_videos,
         filter_long_videos=filter_long_videos,
         duration=duration,
+        use_video_metadata=use_video_metadata,
+        blocklist=blocklist,
+        decode_short_side=decode_short_side,
+        zero_copy_decode=zero_copy_decode,
+        keyframe_aligned_sampling=keyframe_aligned_sampling,
+        keyframe_max_shift=keyframe_max_shift,
+        samples_per_video=samples_per_video,
+        sample_pool_size=(batch_size * samples_per_video
+                          if sample_pool_size is None else sample_pool_size),
+        echo_factor=echo_factor,
+        echo_delay=batch_size,
+        clip_cache=clip_cache,
+        reader_cache=reader_cache,
+        video_backend=video_backend,
+        decode_timeout=decode_timeout,
+        max_hung_decodes=max_hung_decodes,
+        record_sample_costs=cost_balanced_sampling,
+        use_sample_index=use_sample_index,
+        index_partition=(rank, world_size) if partition_sample_index else None,
         shared_transform=shared_transform,
         transform=transform)
 
     logger.info('VideoDataset dataset created')
-    if datasets_weights is not None:
+    if partition_sample_index:
+        # Each rank only holds (and samples from) its own partition
+        assert use_sample_index, 'Partitioning requires a sample index'
+        assert not cost_balanced_sampling, \
+            'Cost balancing requires the full index on all ranks'
+        world_size, rank = 1, 0
+    if cost_balanced_sampling:
+        dist_sampler = CostBalancedDistributedSampler(
+            dataset,
+            batch_size=batch_size,
+            weights=dataset.sample_weights,
+            num_replicas=world_size,
+            rank=rank)
+    elif stratified_sampling:
+        dist_sampler = StratifiedDistributedSampler(
+            dataset.num_samples_per_dataset,
+            datasets_weights=datasets_weights,
+            num_replicas=world_size,
+            rank=rank,
+            seed=_GLOBAL_SEED)
+    elif datasets_weights is not None:
         dist_sampler = DistributedWeightedSampler(
             dataset.sample_weights,
             num_replicas=world_size,
@@ -73,6 +199,8 @@ def make_videodataset(
             num_replicas=world_size,
             rank=rank,
             shuffle=True)
+    # Make the position in the epoch checkpointable
+    dist_sampler = ResumableSampler(dist_sampler, batch_size=batch_size)
 
     data_loader = torch.utils.data.DataLoader(
         dataset,
@@ -82,7 +210,9 @@ def make_videodataset(
         drop_last=drop_last,
         pin_memory=pin_mem,
         num_workers=num_workers,
-        persistent_workers=num_workers > 0)
+        worker_init_fn=worker_init_fn,
+        persistent_workers=num_workers > 0,
+        **loader_kwargs)
     logger.info('VideoDataset unsupervised data loader created')
 
     return dataset, data_loader, dist_sampler
@@ -105,6 +235,24 @@ class VideoDataset(torch.utils.data.Dataset):
         filter_short_videos=False,
         filter_long_videos=int(10**9),
         duration=None,  # duration in seconds
+        use_video_metadata=False,
+        blocklist=None,
+        decode_short_side=None,
+        zero_copy_decode=False,
+        keyframe_aligned_sampling=False,
+        keyframe_max_shift=None,
+        samples_per_video=1,
+        sample_pool_size=0,
+        echo_factor=1,
+        echo_delay=0,
+        clip_cache=None,
+        reader_cache=None,
+        video_backend='decord',
+        decode_timeout=None,  # seconds
+        max_hung_decodes=8,
+        record_sample_costs=False,
+        use_sample_index=False,
+        index_partition=None,
     ):
         self.data_paths = data_paths
         self.datasets_weights = datasets_weights
@@ -118,56 +266,229 @@ class VideoDataset(torch.utils.data.Dataset):
         self.filter_short_videos = filter_short_videos
         self.filter_long_videos = filter_long_videos
         self.duration = duration
-
-        if VideoReader is None:
-            raise ImportError('Unable to import "decord" which is required to read videos.')
-
-        # Load video paths and labels
-        samples, labels = [], []
+        self.use_video_metadata = use_video_metadata
+        self.blocklist = blocklist
+        self.decode_short_side = decode_short_side
+        self.zero_copy_decode = zero_copy_decode
+        self.keyframe_aligned_sampling = keyframe_aligned_sampling
+        self.keyframe_max_shift = keyframe_max_shift
+        self.samples_per_video = samples_per_video
+        self.sample_pool_size = sample_pool_size
+        self.echo_factor = echo_factor
+        self.echo_delay = echo_delay
+        self.clip_cache = clip_cache
+        self.reader_cache = reader_cache
+        self.video_backend = video_backend
+        self.decode_timeout = decode_timeout
+        # Decodes that timed out are left running in daemon threads (see
+        # _loadvideo_with_timeout), at most max_hung_decodes per worker
+        self.max_hung_decodes = max_hung_decodes
+        self._hung_threads = []
+        self.use_sample_index = use_sample_index
+        self.index_partition = index_partition
+        # Number of threads used by the decoders (backend default if None),
+        # set in each worker when using a ThreadBudget
+        self.num_decode_threads = None
+
+        if (video_backend != 'auto'
+                and video_backend not in available_backends()):
+            raise ImportError(
+                f'Unable to import the "{video_backend}" backend which is '
+                f'required to read videos.')
+
+        # Load video paths and labels, as compact indices rather than lists
+        indices, metadata = [], []
         self.num_samples_per_dataset = []
         for data_path in self.data_paths:
-
-            if data_path[-4:] == '.csv':
-                data = pd.read_csv(data_path, header=None, delimiter=" ")
-                samples += list(data.values[:, 0])
-                labels += list(data.values[:, 1])
-                num_samples = len(data)
-                self.num_samples_per_dataset.append(num_samples)
-
-            elif data_path[-4:] == '.npy':
-                data = np.load(data_path, allow_pickle=True)
-                data = list(map(lambda x: repr(x)[1:-1], data))
-                samples += data
-                labels += [0] * len(data)
-                num_samples = len(data)
-                self.num_samples_per_dataset.append(len(data))
-
-        # [Optional] Weights for each sample to be used by downstream
-        # weighted video sampler
-        self.sample_weights = None
-        if self.datasets_weights is not None:
-            self.sample_weights = []
-            for dw, ns in zip(self.datasets_weights, self.num_samples_per_dataset):
-                self.sample_weights += [dw / ns] * ns
-
-        self.samples = samples
-        self.labels = labels
+            if self.use_sample_index:
+                # Memory-mapped index written offline, optionally restricted
+                # to the partition of this rank
+                _index = SampleIndex.load(
+                    sample_index_path(data_path),
+                    partition=self.index_partition)
+            else:
+                _index = SampleIndex.from_lists(*read_video_list(data_path))
+            keep = np.ones(len(_index), dtype=bool)
+
+            # [Optional] Use offline-probed video metadata to drop bad, short
+            # or long videos up front instead of when they are sampled
+            if self.use_video_metadata:
+                _metadata = load_video_metadata(data_path, _index.total_len)
+                if _index.partition is not None:
+                    in_partition = np.zeros(_index.total_len, dtype=bool)
+                    start, stop = SampleIndex.partition_range(
+                        _index.total_len, *_index.partition)
+                    in_partition[start:stop] = True
+                    _metadata = select_video_metadata(_metadata, in_partition)
+                keep &= self._filter_by_metadata(_metadata)
+
+            # [Optional] Drop videos that previously failed to load
+            if self.blocklist is not None and len(self.blocklist) > 0:
+                keep &= ~_index.isin(self.blocklist.entries)
+
+            if not keep.all():
+                logger.info(
+                    f'Keeping {keep.sum()}/{len(keep)} videos from {data_path}')
+                _index = _index.select(keep)
+            if self.use_video_metadata:
+                metadata.append(select_video_metadata(_metadata, keep))
+
+            indices.append(_index)
+            self.num_samples_per_dataset.append(len(_index))
+
+        self._sample_weights = None
+        self.video_metadata = None
+        if self.use_video_metadata:
+            self.video_metadata = concat_video_metadata(metadata)
+
+        index = SampleIndex.concat(indices)
+        self.samples = index
+        self.labels = index.labels
+
+        # Backends tried (in order) to decode the videos of each format, and
+        # backend that worked for videos which needed a fallback (local to
+        # each dataloader worker)
+        self.backend_selection = {}
+        self._file_backends = {}
+        if self.video_backend == 'auto':
+            self.backend_selection = self._calibrate_backends()
+
+        # Number of (and time wasted on) samples that failed to load,
+        # accumulated across dataloader workers
+        self.skipped_meter = SharedAverageMeter()
+        # Decoding time per frame, and number of frames that keyframe
+        # alignment spared the decoder from decoding
+        self.decode_meter = SharedAverageMeter()
+        self.keyframe_meter = SharedAverageMeter()
+        # Histogram of the time taken to load a video (from 10ms to ~20s),
+        # for each dataset, and number of loads that timed out
+        self._dataset_ends = np.cumsum(self.num_samples_per_dataset)
+        self.latency_hist = SharedHistogram(
+            [0.01 * 2**i for i in range(12)], num_rows=len(self.data_paths))
+        self.timeout_meter = SharedAverageMeter()
+        # Time taken by a worker to produce a sample (including transforms)
+        self.sample_time_meter = SharedAverageMeter()
+        # [Optional] Last measured loading time of every video (0 if not
+        # measured yet), shared across workers
+        self._sample_costs = None
+        if record_sample_costs:
+            self._sample_costs = RawArray('f', len(self.samples))
+
+        # [Optional] Pool of decoded (but not yet transformed) samples, local
+        # to each dataloader worker, used when several samples are decoded
+        # from each video or when samples are echoed
+        self._sample_pool = []
+        self._echo_queue = deque()
+        self._num_calls = 0
+        # Fraction of the served samples that were not echoes
+        self.unique_meter = SharedAverageMeter()
+        self._stats_time = time.time()
+
+    @property
+    def sample_weights(self):
+        """
+        [Optional] Weights for each sample to be used by downstream weighted
+        video samplers; only built (once) on demand, as the stratified
+        sampler does not need them
+        """
+        if self.datasets_weights is None:
+            return None
+        if self._sample_weights is None:
+            num_samples = np.asarray(self.num_samples_per_dataset)
+            self._sample_weights = np.repeat(
+                np.asarray(self.datasets_weights, dtype=np.float64)
+                / np.maximum(num_samples, 1), num_samples)
+        return self._sample_weights
+
+    def _filter_by_metadata(self, metadata):
+        """ Mask of the videos that can be sampled given their metadata """
+        size, num_frames = metadata['size'], metadata['num_frames']
+        keep = (size >= 1 * 1024) & (size <= self.filter_long_videos) \
+            & (num_frames > 0)
+        if self.filter_short_videos:
+            fstp = self.frame_step
+            if self.duration is not None:
+                fstp = self.duration * metadata['fps'] / self.frames_per_clip
+                fstp = fstp.astype(np.int64)
+            keep &= num_frames >= self.frames_per_clip * fstp
+        return keep
 
     def __getitem__(self, index):
+        start_time = time.time()
+        sample = self._get_sample(index)
+        self.sample_time_meter.update(time.time() - start_time)
+        return sample
+
+    def _get_sample(self, index):
+        if self.samples_per_video == 1 and self.echo_factor == 1:
+            return self._transform_sample(*self._load_samples(index)[0])
+
+        # Decode all the samples of a video at once, and serve samples at
+        # random from the pool so that the samples of a video are spread
+        # over different batches; the pool is only refilled (with the
+        # video at position index) when it falls below sample_pool_size,
+        # so the sampler indices are only used when decoding is needed
+        pool = self._sample_pool
+        self._num_calls += 1
+
+        # Echoed samples return to the pool echo_delay calls after being
+        # served, so that the echoes of a sample end up in different batches
+        while (len(self._echo_queue) > 0
+               and self._echo_queue[0][0] <= self._num_calls):
+            pool.append(self._echo_queue.popleft()[1])
+
+        if len(pool) < max(self.sample_pool_size, 1):
+            pool.extend(
+                [(s, self.echo_factor) for s in self._load_samples(index)])
+        i = np.random.randint(len(pool))
+        pool[i], pool[-1] = pool[-1], pool[i]
+        sample, echoes_left = pool.pop()
+
+        self.unique_meter.update(float(echoes_left == self.echo_factor))
+        if echoes_left > 1:
+            self._echo_queue.append(
+                (self._num_calls + self.echo_delay,
+                 (sample, echoes_left - 1)))
+
+        # Each echo of a sample is augmented independently
+        return self._transform_sample(*sample)
+
+    def _load_samples(self, index):
+        """ Decode the samples_per_video (untransformed) samples of a video """
         sample = self.samples[index]
 
         # Keep trying to load videos until you find a valid sample
         loaded_video = False
         while not loaded_video:
-            buffer, clip_indices = self.loadvideo_decord(sample)  # [T H W 3]
+            start_time = time.time()
+            # [T H W 3]
+            buffer, clip_indices = self._loadvideo_with_timeout(sample, index)
+            dataset_id = int(
+                np.searchsorted(self._dataset_ends, index, side='right'))
+            self.latency_hist.update(time.time() - start_time, row=dataset_id)
             loaded_video = len(buffer) > 0
+            if loaded_video and self._sample_costs is not None:
+                self._sample_costs[index] = time.time() - start_time
             if not loaded_video:
+                self.skipped_meter.update(time.time() - start_time)
                 index = np.random.randint(self.__len__())
                 sample = self.samples[index]
+                while self.blocklist is not None and sample in self.blocklist:
+                    index = np.random.randint(self.__len__())
+                    sample = self.samples[index]
 
         # Label/annotations for video
         label = self.labels[index]
 
+        # Split the decoded clips into samples of num_clips clips
+        nc, fpc = self.num_clips, self.frames_per_clip
+        return [
+            (buffer[j*nc*fpc:(j+1)*nc*fpc], label, clip_indices[j*nc:(j+1)*nc])
+            for j in range(self.samples_per_video)
+        ]
+
+    def _transform_sample(self, buffer, label, clip_indices):
+
         def split_into_clips(video):
             """ Split video into a list of clips """
             fpc = self.frames_per_clip
@@ -183,90 +504,463 @@ class VideoDataset(torch.utils.data.Dataset):
 
         return buffer, label, clip_indices
 
-    def loadvideo_decord(self, sample):
-        """ Load video content using Decord """
+    def _loadvideo_with_timeout(self, sample, index=None):
+        """
+        Load video content, giving up on videos that take longer than
+        decode_timeout seconds (e.g., malformed files that hang the decoder)
+        """
+        if self.decode_timeout is None:
+            return self.loadvideo_decord(sample, index)
 
-        fname = sample
-        if not os.path.exists(fname):
-            warnings.warn(f'video path not found {fname=}')
-            return [], None
+        # Decoders cannot be interrupted, so a hung decode is left running
+        # in a daemon thread while the worker moves on to another video
+        result = []
 
-        _fsize = os.path.getsize(fname)
-        if _fsize < 1 * 1024:  # avoid hanging issue
-            warnings.warn(f'video too short {fname=}')
-            return [], None
-        if _fsize > self.filter_long_videos:
-            warnings.warn(f'skipping long video of size {_fsize=} (bytes)')
+        def load():
+            try:
+                result.append(self.loadvideo_decord(sample, index))
+            except Exception as e:
+                result.append(e)
+
+        thread = threading.Thread(target=load, daemon=True)
+        thread.abandoned = False
+        thread.start()
+        thread.join(self.decode_timeout)
+        if thread.is_alive():
+            # From now on, the thread must not touch the caches, blocklist
+            # or backend selection, which the worker keeps using
+            thread.abandoned = True
+            warnings.warn(
+                f'decoding timed out after {self.decode_timeout}s {sample=}')
+            self.timeout_meter.update(1.)
+            self._block(sample, f'decode timeout ({self.decode_timeout} s)')
+            if self.reader_cache is not None:
+                self.reader_cache.invalidate(sample)
+            # Every hung thread holds on to a decoder (and its memory), so
+            # give up on the worker rather than piling them up
+            self._hung_threads = [
+                t for t in self._hung_threads if t.is_alive()] + [thread]
+            if len(self._hung_threads) > self.max_hung_decodes:
+                raise RuntimeError(
+                    f'{len(self._hung_threads)} decodes hung in this worker '
+                    f'(max_hung_decodes={self.max_hung_decodes})')
             return [], None
+        if isinstance(result[0], Exception):
+            raise result[0]
+        return result[0]
 
-        try:
-            vr = VideoReader(fname, num_threads=-1, ctx=cpu(0))
-        except Exception:
-            return [], None
+    @staticmethod
+    def _abandoned():
+        """ Whether the current thread is a decode that timed out """
+        return getattr(threading.current_thread(), 'abandoned', False)
+
+    def loadvideo_decord(self, sample, index=None):
+        """ Load video content using Decord """
+
+        fname = sample
+        vr, fps = None, None
+        if self.video_metadata is not None and index is not None:
+            # Video was already probed (and filtered) offline, so the clip
+            # indices can be computed without opening the container
+            vlen = int(self.video_metadata['num_frames'][index])
+            fps = float(self.video_metadata['fps'][index])
+        else:
+            if not os.path.exists(fname):
+                warnings.warn(f'video path not found {fname=}')
+                self._block(fname, 'not found')
+                return [], None
+
+            _fsize = os.path.getsize(fname)
+            if _fsize < 1 * 1024:  # avoid hanging issue
+                warnings.warn(f'video too short {fname=}')
+                self._block(fname, f'file too small ({_fsize} bytes)')
+                return [], None
+            if _fsize > self.filter_long_videos:
+                warnings.warn(f'skipping long video of size {_fsize=} (bytes)')
+                return [], None
+
+            try:
+                vr = self._get_reader(fname, index)
+            except Exception as e:
+                self._block(fname, f'unreadable ({e})')
+                return [], None
+            vlen = len(vr)
 
         fpc = self.frames_per_clip
         fstp = self.frame_step
         if self.duration is not None:
             try:
-                fps = vr.get_avg_fps()
+                fps = vr.get_avg_fps() if fps is None else fps
                 fstp = int(self.duration * fps / fpc)
             except Exception as e:
                 warnings.warn(e)
         clip_len = int(fpc * fstp)
 
-        if self.filter_short_videos and len(vr) < clip_len:
-            warnings.warn(f'skipping video of length {len(vr)}')
+        if self.filter_short_videos and vlen < clip_len:
+            warnings.warn(f'skipping video of length {vlen}')
             return [], None
 
-        vr.seek(0)  # Go to start of video before sampling frames
+        all_indices, clip_indices = sample_clip_indices(
+            vlen=vlen,
+            frames_per_clip=fpc,
+            frame_step=fstp,
+            num_clips=self.num_clips * self.samples_per_video,
+            random_clip_sampling=self.random_clip_sampling,
+            allow_clip_overlap=self.allow_clip_overlap)
+
+        # [Optional] Start clips on keyframes to avoid decoding frames that
+        # precede the clips in their group of pictures
+        if self.keyframe_aligned_sampling:
+            if vr is None:
+                keyframes = get_keyframes(self.video_metadata, index)
+            else:
+                keyframes = vr.get_key_indices()
+            all_indices, clip_indices, lead_in = align_clips_to_keyframes(
+                clip_indices, keyframes, vlen,
+                max_shift=self.keyframe_max_shift)
+            self.keyframe_meter.update(lead_in)
+
+        # [Optional] Reuse the clip if it was already decoded by any worker
+        # on this node
+        cache_key = None
+        if self.clip_cache is not None:
+            cache_key = self.clip_cache.make_key(
+                fname, all_indices, self.decode_short_side)
+            buffer = self.clip_cache.get(cache_key)
+            if buffer is not None:
+                return buffer, clip_indices
+
+        if vr is None:
+            try:
+                vr = self._get_reader(fname, index)
+            except Exception as e:
+                self._block(fname, f'unreadable ({e})')
+                return [], None
+
+        start_time = time.time()
+        try:
+            buffer = vr.get_batch(all_indices)
+        except Exception as e:
+            if self.reader_cache is not None:
+                self.reader_cache.invalidate(fname)
+            buffer = self._decode_fallback(
+                fname, index, all_indices, failed_backend=vr.name)
+            if buffer is None:
+                self._block(fname, f'decode error ({e})')
+                return [], None
+        num_frames = sum(int(c[-1] - c[0]) + 1 for c in clip_indices)
+        self.decode_meter.update(
+            (time.time() - start_time) / num_frames, n=num_frames)
+
+        if cache_key is not None and not self._abandoned():
+            self.clip_cache.put(cache_key, buffer)
+        return buffer, clip_indices
+
+    def _get_reader(self, fname, index=None):
+        """ Open a video reader, or reuse a cached one if reader caching is
+        enabled """
+        if self.reader_cache is None:
+            return self._open_reader(fname, index)
+
+        def open_fn(f):
+            reader = self._open_reader(f, index)
+            if self._abandoned():
+                # Keep the reader of a timed out decode out of the cache
+                raise RuntimeError('decode timed out')
+            return reader
+
+        return self.reader_cache.get(fname, open_fn)
+
+    def _open_reader(self, fname, index=None):
+        """ Open a video with the first backend able to, decoding frames at
+        decode_short_side if set """
+        error = None
+        for backend in self._backends(fname, index):
+            try:
+                return self._open_with(backend, fname, index)
+            except Exception as e:
+                error = e
+        raise error
+
+    def _open_with(self, backend, fname, index=None):
+        frame_size = None
+        metadata = self.video_metadata
+        if metadata is not None and 'height' in metadata and index is not None:
+            frame_size = (int(metadata['height'][index]),
+                          int(metadata['width'][index]))
+        kwargs = {}
+        if self.num_decode_threads is not None:
+            kwargs['num_threads'] = self.num_decode_threads
+        return open_video(
+            backend, fname,
+            short_side=self.decode_short_side,
+            frame_size=frame_size,
+            zero_copy=self.zero_copy_decode,
+            **kwargs)
+
+    def _codec(self, index):
+        if (self.video_metadata is None or 'codec' not in self.video_metadata
+                or index is None):
+            return ''
+        return str(self.video_metadata['codec'][index])
+
+    def _backends(self, fname, index=None):
+        """ Backends to try (in order) to decode a video """
+        if self.video_backend != 'auto':
+            return [self.video_backend]
+        backends = self.backend_selection.get(
+            video_format(fname, self._codec(index)), available_backends())
+        if fname in self._file_backends:
+            first = self._file_backends[fname]
+            backends = [first] + [b for b in backends if b != first]
+        return backends
+
+    def _decode_fallback(self, fname, index, indices, failed_backend):
+        """ Decode frames with the other backends, remembering the one that
+        works """
+        for backend in self._backends(fname, index):
+            if backend == failed_backend:
+                continue
+            try:
+                reader = self._open_with(backend, fname, index)
+                buffer = reader.get_batch(indices)
+            except Exception:
+                continue
+            if not self._abandoned():
+                self._file_backends[fname] = backend
+            return buffer
+        return None
+
+    def _calibrate_backends(self, num_videos=256):
+        """
+        Select the fastest backend for each video format, on a random subset
+        of videos; with distributed training, backends are only benchmarked
+        on rank 0, which shares its selection with the other ranks
+        """
+        dist = torch.distributed
+        distributed = (
+            dist.is_available() and dist.is_initialized()
+            and dist.get_world_size() > 1)
+        selection = None
+        if not distributed or dist.get_rank() == 0:
+            rng = np.random.default_rng(_GLOBAL_SEED)
+            subset = rng.permutation(len(self.samples))[:num_videos]
+            selection = calibrate_backends(
+                [self.samples[i] for i in subset],
+                codecs=[self._codec(i) for i in subset],
+                frames_per_clip=self.frames_per_clip,
+                frame_step=self.frame_step,
+                short_side=self.decode_short_side)
+        if distributed:
+            selection = [selection]
+            dist.broadcast_object_list(selection, src=0)
+            selection = selection[0]
+        return selection
+
+    def sample_costs(self, reduce_fn=None):
+        """
+        Estimated loading time of every video: its measured loading time if
+        available, otherwise extrapolated from its file size (when video
+        metadata is available) or the average measured time
+
+        :param reduce_fn: [optional] function merging the measured times
+            with those of other ranks
+        """
+        costs = np.ones(len(self.samples), dtype=np.float32)
+        if self._sample_costs is None:
+            return costs
+        costs = np.ctypeslib.as_array(self._sample_costs).copy()
+        if reduce_fn is not None:
+            costs = reduce_fn(costs)
+        measured = costs > 0
+        if not measured.any():
+            if self.video_metadata is not None:
+                return self.video_metadata['size'].astype(np.float32)
+            return np.ones(len(self.samples), dtype=np.float32)
+        if self.video_metadata is not None:
+            size = self.video_metadata['size'].astype(np.float32)
+            time_per_byte = np.median(
+                costs[measured] / np.maximum(size[measured], 1))
+            costs[~measured] = size[~measured] * time_per_byte
+        else:
+            costs[~measured] = costs[measured].mean()
+        return costs
+
+    def _block(self, fname, reason):
+        if self.blocklist is not None and not self._abandoned():
+            self.blocklist.add(fname, reason)
+
+    def log_stats(self, reset=True):
+        """ Log (and reset) data loading statistics accumulated over the
+        epoch """
+        logger.info(
+            'skipped %d samples that failed to load (%.1f s wasted)'
+            % (self.skipped_meter.count, self.skipped_meter.sum))
+        logger.info(
+            'decoding time: %.2f ms/frame' % (1000. * self.decode_meter.avg))
+        for i, data_path in enumerate(self.data_paths):
+            logger.info(
+                'loading time [%s]: p50 < %.2fs, p90 < %.2fs, p99 < %.2fs, '
+                'max < %.2fs'
+                % (data_path, *[self.latency_hist.percentile(q, row=i)
+                                for q in (50, 90, 99, 100)]))
+        if self.decode_timeout is not None:
+            logger.info('%d videos timed out' % self.timeout_meter.count)
+        if self.keyframe_aligned_sampling:
+            logger.info(
+                'keyframe alignment skipped %.1f frames/video '
+                '(~%.1f s of decoding saved)'
+                % (self.keyframe_meter.avg,
+                   self.keyframe_meter.sum * self.decode_meter.avg))
+        if self.echo_factor > 1:
+            elapsed = time.time() - self._stats_time
+            logger.info(
+                'served %d samples, %.1f%% unique (%.1f unique samples/s)'
+                % (self.unique_meter.count, 100. * self.unique_meter.avg,
+                   self.unique_meter.sum / elapsed))
+        if self.clip_cache is not None:
+            self.clip_cache.log_stats(reset=reset)
+        if self.reader_cache is not None:
+            self.reader_cache.log_stats(reset=reset)
+        if reset:
+            self.skipped_meter.reset()
+            self.decode_meter.reset()
+            self.latency_hist.reset()
+            self.timeout_meter.reset()
+            self.keyframe_meter.reset()
+            self.unique_meter.reset()
+            self._stats_time = time.time()
+
+    def __len__(self):
+        return len(self.samples)
 
-        # Partition video into equal sized segments and sample each clip
-        # from a different segment
-        partition_len = len(vr) // self.num_clips
 
-        all_indices, clip_indices = [], []
-        for i in range(self.num_clips):
+def read_video_list(data_path):
+    """
+    Read the video paths and labels listed in a dataset file, either a
+    space-delimited .csv file of (path, label) rows or a .npy array of paths
+    """
+    if data_path[-4:] == '.csv':
+        data = pd.read_csv(data_path, header=None, delimiter=" ")
+        return list(data.values[:, 0]), list(data.values[:, 1])
 
-            if partition_len > clip_len:
-                # If partition_len > clip len, then sample a random window of
-                # clip_len frames within the segment
-                end_indx = clip_len
-                if self.random_clip_sampling:
-                    end_indx = np.random.randint(clip_len, partition_len)
-                start_indx = end_indx - clip_len
-                indices = np.linspace(start_indx, end_indx, num=fpc)
-                indices = np.clip(indices, start_indx, end_indx-1).astype(np.int64)
+    elif data_path[-4:] == '.npy':
+        data = np.load(data_path, allow_pickle=True)
+        data = list(map(lambda x: repr(x)[1:-1], data))
+        return data, [0] * len(data)
+
+    return [], []
+
+
+def sample_clip_indices(
+    vlen,
+    frames_per_clip,
+    frame_step,
+    num_clips=1,
+    random_clip_sampling=True,
+    allow_clip_overlap=False,
+):
+    """
+    Compute the frame indices to sample from a video of length vlen
+    (in frames), shared by all video datasets so that they use the same
+    clip sampling logic.
+
+    :returns: (all_indices, clip_indices), where all_indices is the flat
+        list of frames to decode and clip_indices contains one array of
+        frame indices per clip
+    """
+    fpc = frames_per_clip
+    fstp = frame_step
+    clip_len = int(fpc * fstp)
+
+    # Partition video into equal sized segments and sample each clip
+    # from a different segment
+    partition_len = vlen // num_clips
+
+    all_indices, clip_indices = [], []
+    for i in range(num_clips):
+
+        if partition_len > clip_len:
+            # If partition_len > clip len, then sample a random window of
+            # clip_len frames within the segment
+            end_indx = clip_len
+            if random_clip_sampling:
+                end_indx = np.random.randint(clip_len, partition_len)
+            start_indx = end_indx - clip_len
+            indices = np.linspace(start_indx, end_indx, num=fpc)
+            indices = np.clip(indices, start_indx, end_indx-1).astype(np.int64)
+            # --
+            indices = indices + i * partition_len
+        else:
+            # If partition overlap not allowed and partition_len < clip_len
+            # then repeatedly append the last frame in the segment until
+            # we reach the desired clip length
+            if not allow_clip_overlap:
+                indices = np.linspace(
+                    0, partition_len, num=partition_len // fstp)
+                indices = np.concatenate((
+                    indices,
+                    np.ones(fpc - partition_len // fstp) * partition_len,))
+                indices = np.clip(indices, 0, partition_len-1).astype(np.int64)
                 # --
                 indices = indices + i * partition_len
-            else:
-                # If partition overlap not allowed and partition_len < clip_len
-                # then repeatedly append the last frame in the segment until
-                # we reach the desired clip length
-                if not self.allow_clip_overlap:
-                    indices = np.linspace(0, partition_len, num=partition_len // fstp)
-                    indices = np.concatenate((indices, np.ones(fpc - partition_len // fstp) * partition_len,))
-                    indices = np.clip(indices, 0, partition_len-1).astype(np.int64)
-                    # --
-                    indices = indices + i * partition_len
-
-                # If partition overlap is allowed and partition_len < clip_len
-                # then start_indx of segment i+1 will lie within segment i
-                else:
-                    sample_len = min(clip_len, len(vr)) - 1
-                    indices = np.linspace(0, sample_len, num=sample_len // fstp)
-                    indices = np.concatenate((indices, np.ones(fpc - sample_len // fstp) * sample_len,))
-                    indices = np.clip(indices, 0, sample_len-1).astype(np.int64)
-                    # --
-                    clip_step = 0
-                    if len(vr) > clip_len:
-                        clip_step = (len(vr) - clip_len) // (self.num_clips - 1)
-                    indices = indices + i * clip_step
-
-            clip_indices.append(indices)
-            all_indices.extend(list(indices))
-
-        buffer = vr.get_batch(all_indices).asnumpy()
-        return buffer, clip_indices
 
-    def __len__(self):
-        return len(self.samples)
+            # If partition overlap is allowed and partition_len < clip_len
+            # then start_indx of segment i+1 will lie within segment i
+            else:
+                sample_len = min(clip_len, vlen) - 1
+                indices = np.linspace(0, sample_len, num=sample_len // fstp)
+                indices = np.concatenate((
+                    indices,
+                    np.ones(fpc - sample_len // fstp) * sample_len,))
+                indices = np.clip(indices, 0, sample_len-1).astype(np.int64)
+                # --
+                clip_step = 0
+                if vlen > clip_len:
+                    clip_step = (vlen - clip_len) // (num_clips - 1)
+                indices = indices + i * clip_step
+
+        clip_indices.append(indices)
+        all_indices.extend(list(indices))
+
+    return all_indices, clip_indices
+
+
+def align_clips_to_keyframes(clip_indices, keyframes, vlen, max_shift=None):
+    """
+    Shift each clip so that it starts on a keyframe, which spares the decoder
+    from decoding the frames between the preceding keyframe and the first
+    frame of the clip. Each clip is moved to the nearest keyframe (at most
+    max_shift frames away) for which it remains within its original segment,
+    so that clips are still spread over the video as in sample_clip_indices.
+
+    :returns: (all_indices, clip_indices, lead_in), where lead_in is the
+        number of frames that no longer need to be decoded before the
+        clips, i.e., the decoding work saved by the alignment
+    """
+    keyframes = np.asarray(keyframes, dtype=np.int64)
+    if len(keyframes) == 0:
+        return [i for c in clip_indices for i in c], clip_indices, 0
+
+    partition_len = vlen // len(clip_indices)
+    all_indices, aligned, lead_in = [], [], 0
+    for i, indices in enumerate(clip_indices):
+        start, span = int(indices[0]), int(indices[-1] - indices[0])
+        seg_start, seg_end = i * partition_len, (i + 1) * partition_len
+
+        # Candidate keyframes are the ones surrounding the start of the clip
+        k = np.searchsorted(keyframes, start, side='right')
+        candidates = [kf for kf in keyframes[max(k-1, 0):k+1]
+                      if seg_start <= kf and kf + span < seg_end]
+        if max_shift is not None:
+            candidates = [
+                kf for kf in candidates if abs(kf - start) <= max_shift]
+        if len(candidates) > 0 and k > 0:
+            kf = min(candidates, key=lambda kf: abs(kf - start))
+            lead_in += start - int(keyframes[k-1])
+            indices = indices + (kf - start)
+
+        aligned.append(indices)
+        all_indices.extend(list(indices))
+
+    return all_indices, aligned, lead_in
@@ -0,0 +1,451 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+import os
+import tarfile
+import warnings
+
+from logging import getLogger
+from multiprocessing import Array
+
+import numpy as np
+
+from braceexpand import braceexpand
+
+try:
+    from decord import VideoReader, cpu
+except ImportError:
+    VideoReader, cpu = None, None
+
+import torch
+
+from src.datasets.utils.thread_budget import ThreadBudget
+from src.datasets.video_dataset import sample_clip_indices
+
+_GLOBAL_SEED = 0
+logger = getLogger()
+
+_VIDEO_EXTENSIONS = ('mp4', 'avi', 'webm', 'mkv', 'mov')
+
+
+def make_videotardataset(
+    data_paths,
+    batch_size,
+    num_batches,
+    frames_per_clip=8,
+    frame_step=4,
+    num_clips=1,
+    random_clip_sampling=True,
+    allow_clip_overlap=False,
+    filter_short_videos=False,
+    filter_long_videos=int(10**9),
+    transform=None,
+    shared_transform=None,
+    rank=0,
+    world_size=1,
+    datasets_weights=None,
+    collator=None,
+    num_workers=10,
+    pin_mem=True,
+    duration=None,
+    shuffle_buffer=1000,
+    log_dir=None,
+    thread_budget=False,
+):
+    # [Optional] Split cores between workers, decoding and torch threads
+    # (before splitting the shards between the workers)
+    worker_init_fn = None
+    if thread_budget:
+        worker_init_fn = ThreadBudget(num_workers)
+        num_workers = worker_init_fn.num_workers
+
+    prefetch_factor = 2
+    dataset = VideoTarDataset(
+        data_paths=data_paths,
+        batch_size=batch_size,
+        num_batches=num_batches,
+        datasets_weights=datasets_weights,
+        frames_per_clip=frames_per_clip,
+        frame_step=frame_step,
+        num_clips=num_clips,
+        random_clip_sampling=random_clip_sampling,
+        allow_clip_overlap=allow_clip_overlap,
+        filter_short_videos=filter_short_videos,
+        filter_long_videos=filter_long_videos,
+        duration=duration,
+        shared_transform=shared_transform,
+        transform=transform,
+        shuffle_buffer=shuffle_buffer,
+        rank=rank,
+        world_size=world_size,
+        num_workers=num_workers,
+        prefetch_factor=prefetch_factor)
+    logger.info('VideoTarDataset dataset created')
+
+    # Workers are restarted for every pass over the loader so that they pick
+    # up the epoch (and resumption cursor) set on the dataset
+    data_loader = torch.utils.data.DataLoader(
+        dataset,
+        collate_fn=collator,
+        batch_size=batch_size,
+        pin_memory=pin_mem,
+        num_workers=num_workers,
+        worker_init_fn=worker_init_fn,
+        prefetch_factor=prefetch_factor if num_workers > 0 else None,
+        persistent_workers=False)
+    data_loader.num_batches = num_batches
+    logger.info('VideoTarDataset unsupervised data loader created')
+
+    # The dataset handles its own shard assignment, so it is also returned as
+    # the "sampler" whose epoch is set by the training loop
+    return dataset, data_loader, dataset
+
+
+class VideoTarDataset(torch.utils.data.IterableDataset):
+    """
+    Streaming video dataset reading (webdataset-style) tar shards
+    sequentially. Each sample is a group of consecutive tar members sharing
+    the same key, e.g. "xxx.mp4" and optionally "xxx.cls" (integer label).
+
+    Every epoch, each rank yields exactly num_batches batches: shards are
+    shuffled, split across ranks and then across dataloader workers, and read
+    in blocks of shuffle_buffer samples that are shuffled before being
+    yielded. The position of every worker in its shards is recorded so that
+    an epoch can be resumed from a shard/offset cursor (see state_dict).
+    """
+
+    def __init__(
+        self,
+        data_paths,
+        batch_size,
+        num_batches,
+        datasets_weights=None,
+        frames_per_clip=16,
+        frame_step=4,
+        num_clips=1,
+        transform=None,
+        shared_transform=None,
+        random_clip_sampling=True,
+        allow_clip_overlap=False,
+        filter_short_videos=False,
+        filter_long_videos=int(10**9),
+        duration=None,  # duration in seconds
+        shuffle_buffer=1000,
+        rank=0,
+        world_size=1,
+        num_workers=1,
+        prefetch_factor=2,
+        seed=_GLOBAL_SEED,
+    ):
+        self.data_paths = data_paths
+        self.batch_size = batch_size
+        self.num_batches = num_batches
+        self.datasets_weights = datasets_weights
+        self.frames_per_clip = frames_per_clip
+        self.frame_step = frame_step
+        self.num_clips = num_clips
+        self.transform = transform
+        self.shared_transform = shared_transform
+        self.random_clip_sampling = random_clip_sampling
+        self.allow_clip_overlap = allow_clip_overlap
+        self.filter_short_videos = filter_short_videos
+        self.filter_long_videos = filter_long_videos
+        self.duration = duration
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.rank = rank
+        self.world_size = world_size
+        self.num_workers = max(1, num_workers)
+        self.seed = seed
+        self.epoch = 0
+        # Number of threads used to decode a video (decord's default if
+        # None), set in each worker when using a ThreadBudget
+        self.num_decode_threads = None
+
+        if VideoReader is None:
+            raise ImportError(
+                'Unable to import "decord" which is required to read videos.')
+
+        # One list of shards per dataset; shard lists may use brace notation,
+        # e.g., /data/k710/shard-{00000..01023}.tar
+        self.shards = [sorted(braceexpand(p)) for p in self.data_paths]
+        for p, shards in zip(self.data_paths, self.shards):
+            if len(shards) < self.world_size * self.num_workers:
+                warnings.warn(
+                    f'{p} has fewer shards than ranks x workers; some shards '
+                    'will be read twice per epoch')
+
+        # Cursor snapshots written by workers after each batch, kept in a
+        # ring large enough to cover all batches in flight
+        self._ring_size = self.num_workers * (prefetch_factor + 2)
+        self._cursor_len = 3 + 4 * len(self.shards)
+        self._cursors = Array('q', self._ring_size * self._cursor_len)
+        self._resume = None
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        if self._resume is not None and self._resume['epoch'] != epoch:
+            self._resume = None
+
+    def _worker_shards(self, shards, worker_id):
+        """ Shards read by one worker of this rank in the current epoch """
+        rng = np.random.default_rng([self.seed, self.epoch])
+        shards = [shards[i] for i in rng.permutation(len(shards))]
+        rank_shards = shards[self.rank::self.world_size] \
+            or [shards[self.rank % len(shards)]]
+        return rank_shards[worker_id::self.num_workers] \
+            or [rank_shards[worker_id % len(rank_shards)]]
+
+    def __iter__(self):
+        worker_info = torch.utils.data.get_worker_info()
+        worker_id = 0 if worker_info is None else worker_info.id
+        num_batches = len(range(worker_id, self.num_batches, self.num_workers))
+
+        streams = [
+            _ShardStream(
+                shards=self._worker_shards(shards, worker_id),
+                block_size=self.shuffle_buffer,
+                seed=[self.seed, self.epoch, self.rank, worker_id, d])
+            for d, shards in enumerate(self.shards)]
+        weights = None
+        if self.datasets_weights is not None:
+            weights = np.array(self.datasets_weights, dtype=np.float64)
+            weights /= weights.sum()
+        rng = np.random.default_rng(
+            [self.seed, self.epoch, self.rank, worker_id])
+
+        def next_dataset():
+            if weights is None:
+                return 0
+            return int(rng.choice(len(weights), p=weights))
+
+        # -- resume from cursor (without reading the samples skipped)
+        start_batch, num_draws = 0, 0
+        if self._resume is not None and self._resume['epoch'] == self.epoch:
+            cursor = self._resume['workers'][worker_id]
+            if cursor is not None:
+                start_batch = cursor['num_batches']
+                num_draws = cursor['num_draws']
+                for stream, state in zip(streams, cursor['streams']):
+                    stream.load_state(state)
+                for _ in range(num_draws):
+                    next_dataset()
+
+        for k in range(start_batch, num_batches):
+            for j in range(self.batch_size):
+                sample = None
+                while sample is None:
+                    d = next_dataset()
+                    num_draws += 1
+                    sample = self._decode_sample(streams[d].next())
+                if j == self.batch_size - 1:
+                    self._save_cursor(
+                        worker_id + k * self.num_workers, k + 1, num_draws,
+                        streams)
+                yield sample
+
+    def _save_cursor(self, batch_id, num_batches, num_draws, streams):
+        offset = (batch_id % self._ring_size) * self._cursor_len
+        state = [self.epoch, batch_id, num_draws]
+        for stream in streams:
+            state += stream.state()
+        with self._cursors.get_lock():
+            self._cursors[offset:offset + self._cursor_len] = state
+
+    def _load_cursor(self, batch_id):
+        offset = (batch_id % self._ring_size) * self._cursor_len
+        with self._cursors.get_lock():
+            state = self._cursors[offset:offset + self._cursor_len]
+        epoch, _batch_id, num_draws = state[:3]
+        if _batch_id != batch_id:
+            raise RuntimeError(
+                f'Cursor of batch {batch_id} is no longer available')
+        streams = [
+            state[3 + 4 * d:7 + 4 * d] for d in range(len(self.shards))]
+        return epoch, dict(num_draws=num_draws, streams=streams)
+
+    def state_dict(self, num_batches_consumed):
+        """
+        Cursor of every worker after the first num_batches_consumed batches of
+        the current pass over the data loader (batches are delivered in
+        round-robin order over the workers)
+        """
+        epoch, workers = self.epoch, []
+        for worker_id in range(self.num_workers):
+            num_batches = len(
+                range(worker_id, num_batches_consumed, self.num_workers))
+            if num_batches == 0:
+                workers.append(None)
+                continue
+            epoch, cursor = self._load_cursor(
+                worker_id + (num_batches - 1) * self.num_workers)
+            cursor['num_batches'] = num_batches
+            workers.append(cursor)
+        return dict(epoch=epoch, workers=workers)
+
+    def load_state_dict(self, state_dict):
+        """ Resume the next pass over the data loader from a saved cursor """
+        if len(state_dict['workers']) != self.num_workers:
+            warnings.warn(
+                'Number of workers changed; restarting the epoch from scratch')
+            self.epoch = state_dict['epoch']
+            return
+        self.epoch = state_dict['epoch']
+        self._resume = state_dict
+
+    def _decode_sample(self, sample):
+        key, files = sample
+        ext = next((e for e in _VIDEO_EXTENSIONS if e in files), None)
+        if ext is None:
+            warnings.warn(f'no video found in tar sample {key=}')
+            return None
+        data = files[ext]
+        if len(data) < 1 * 1024 or len(data) > self.filter_long_videos:
+            warnings.warn(f'skipping video of size {len(data)} (bytes) {key=}')
+            return None
+
+        try:
+            num_threads = self.num_decode_threads or -1
+            vr = VideoReader(
+                io.BytesIO(data), num_threads=num_threads, ctx=cpu(0))
+        except Exception:
+            return None
+
+        fpc = self.frames_per_clip
+        fstp = self.frame_step
+        if self.duration is not None:
+            try:
+                fps = vr.get_avg_fps()
+                fstp = int(self.duration * fps / fpc)
+            except Exception as e:
+                warnings.warn(e)
+        clip_len = int(fpc * fstp)
+
+        if self.filter_short_videos and len(vr) < clip_len:
+            warnings.warn(f'skipping video of length {len(vr)}')
+            return None
+
+        all_indices, clip_indices = sample_clip_indices(
+            vlen=len(vr),
+            frames_per_clip=fpc,
+            frame_step=fstp,
+            num_clips=self.num_clips,
+            random_clip_sampling=self.random_clip_sampling,
+            allow_clip_overlap=self.allow_clip_overlap)
+        try:
+            buffer = vr.get_batch(all_indices).asnumpy()
+        except Exception as e:
+            # e.g., corrupt or truncated video; skip the sample rather than
+            # ending the stream
+            warnings.warn(f'skipping undecodable video {key=} ({e})')
+            return None
+
+        # Label/annotations for video
+        label = int(files['cls'].decode().strip()) if 'cls' in files else 0
+
+        def split_into_clips(video):
+            """ Split video into a list of clips """
+            fpc = self.frames_per_clip
+            nc = self.num_clips
+            return [video[i*fpc:(i+1)*fpc] for i in range(nc)]
+
+        # Parse video into frames & apply data augmentations
+        if self.shared_transform is not None:
+            buffer = self.shared_transform(buffer)
+        buffer = split_into_clips(buffer)
+        if self.transform is not None:
+            buffer = [self.transform(clip) for clip in buffer]
+
+        return buffer, label, clip_indices
+
+
+class _ShardStream(object):
+    """
+    Endless stream of samples from a list of tar shards, read sequentially
+    in blocks of block_size samples that are shuffled before being returned.
+    The state (shard position, sample offset of the current block within
+    that shard, block counter, samples returned from the current block) is
+    enough to resume the stream without re-reading any video.
+    """
+
+    def __init__(self, shards, block_size, seed):
+        self.shards = shards
+        self.block_size = block_size
+        self.seed = seed
+        self.pos, self.offset, self.block_idx, self.within = 0, 0, 0, 0
+        self._block, self._end = None, None
+
+    def state(self):
+        return [self.pos, self.offset, self.block_idx, self.within]
+
+    def load_state(self, state):
+        self.pos, self.offset, self.block_idx, self.within = state
+        self._block, self._end = None, None
+
+    def _read_block(self):
+        block = []
+        pos, offset, num_empty = self.pos, self.offset, 0
+        while len(block) < self.block_size:
+            shard = self.shards[pos % len(self.shards)]
+            num_read = 0
+            for sample in _iter_tar_samples(shard, skip=offset):
+                block.append(sample)
+                num_read += 1
+                if len(block) == self.block_size:
+                    break
+            offset += num_read
+            if len(block) < self.block_size:
+                # Shard exhausted, move on to the next one
+                num_empty = num_empty + 1 if num_read == 0 else 0
+                if num_empty > len(self.shards):
+                    raise RuntimeError(
+                        f'No samples found in shards {self.shards}')
+                pos, offset = pos + 1, 0
+
+        rng = np.random.default_rng(self.seed + [self.block_idx])
+        self._block = [block[i] for i in rng.permutation(len(block))]
+        self._end = (pos, offset)
+
+    def next(self):
+        if self._block is None:
+            self._read_block()
+        sample = self._block[self.within]
+        self.within += 1
+        if self.within == len(self._block):
+            self.pos, self.offset = self._end
+            self.block_idx, self.within = self.block_idx + 1, 0
+            self._block, self._end = None, None
+        return sample
+
+
+def _split_key(name):
+    dirname, basename = os.path.split(name)
+    key, _, ext = basename.partition('.')
+    return os.path.join(dirname, key), ext.lower()
+
+
+def _iter_tar_samples(path, skip=0):
+    """
+    Iterate over the (key, {extension: bytes}) samples of a tar shard,
+    skipping the first skip samples by only reading their headers
+    """
+    with tarfile.open(path, mode='r:') as tf:
+        key, files, count = None, {}, 0
+        for member in tf:
+            if not member.isfile():
+                continue
+            _key, ext = _split_key(member.name)
+            if _key != key:
+                if key is not None:
+                    if count >= skip:
+                        yield key, files
+                    count += 1
+                key, files = _key, {}
+            if count >= skip:
+                files[ext] = tf.extractfile(member).read()
+        if key is not None and count >= skip:
+            yield key, files
@@ -13,6 +13,8 @@ from logging import getLogger
 
 import torch
 
+from src.datasets.utils.batch_ring import collate_clips
+
 _GLOBAL_SEED = 0
 logger = getLogger()
 
@@ -26,8 +28,18 @@ class MaskCollator(object):
         num_frames=16,
         patch_size=(16, 16),
         tubelet_size=2,
+        batch_ring=None,
+        concat_clips=False,
+        batch_transform=None,
     ):
         super(MaskCollator, self).__init__()
+        # [Optional] SharedBatchRing the clips of each batch are written into
+        self.batch_ring = batch_ring
+        # [Optional] Collate all the clips of a batch into a single tensor
+        self.concat_clips = concat_clips
+        # [Optional] Augmentations applied to all the clips of a batch at
+        # once (e.g., BatchVideoTransform), instead of in the dataset
+        self.batch_transform = batch_transform
 
         self.mask_generators = []
         for m in cfgs_mask:
@@ -49,10 +61,36 @@ class MaskCollator(object):
         for mask_generator in self.mask_generators:
             mask_generator.step()
 
+    def state_dict(self, num_batches_consumed):
+        """
+        Iteration counters of the mask generators (which seed their masks)
+        once num_batches_consumed batches have been consumed; the live
+        counters also count batches prefetched by the dataloader workers,
+        which are collated again after resuming
+        """
+        itr_counter = num_batches_consumed - 1
+        return dict(itr_counters=[itr_counter] * len(self.mask_generators))
+
+    def load_state_dict(self, state_dict):
+        counters = state_dict['itr_counters']
+        for mask_generator, value in zip(self.mask_generators, counters):
+            i = mask_generator._itr_counter
+            with i.get_lock():
+                i.value = value
+
     def __call__(self, batch):
 
         batch_size = len(batch)
-        collated_batch = torch.utils.data.default_collate(batch)
+        clips = [sample[0] for sample in batch]
+        if self.batch_transform is not None:
+            # Augment all the clips of the batch at once
+            clips = self.batch_transform(clips)
+        # Clips may go straight into a shared-memory batch slot, while the
+        # remaining fields (labels, clip indices) are collated as usual
+        collated_batch = [collate_clips(
+            clips, batch_ring=self.batch_ring, concat=self.concat_clips)]
+        collated_batch += torch.utils.data.default_collate(
+            [sample[1:] for sample in batch])
 
         collated_masks_pred, collated_masks_enc = [], []
         for i, mask_generator in enumerate(self.mask_generators):
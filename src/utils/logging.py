@@ -8,6 +8,8 @@
 import logging
 import sys
 
+from multiprocessing import Array
+
 import torch
 
 
@@ -116,3 +118,72 @@ def adamw_logger(optimizer):
         exp_avg_stats.update(float(s.get('exp_avg').abs().mean()))
         exp_avg_sq_stats.update(float(s.get('exp_avg_sq').abs().mean()))
     return {'exp_avg': exp_avg_stats, 'exp_avg_sq': exp_avg_sq_stats}
+
+
+class SharedAverageMeter(object):
+    """computes the average of values recorded by several processes
+    (e.g., dataloader workers) through shared memory"""
+
+    def __init__(self):
+        self._state = Array('d', 2)  # [sum, count]
+
+    def reset(self):
+        with self._state.get_lock():
+            self._state[0] = 0.
+            self._state[1] = 0.
+
+    def update(self, val, n=1):
+        with self._state.get_lock():
+            self._state[0] += val * n
+            self._state[1] += n
+
+    @property
+    def sum(self):
+        return self._state[0]
+
+    @property
+    def count(self):
+        return int(self._state[1])
+
+    @property
+    def avg(self):
+        count = self._state[1]
+        return self._state[0] / count if count > 0 else 0.
+
+
+class SharedHistogram(object):
+    """histogram (with one row per group, e.g., per dataset) of values
+    recorded by several processes through shared memory"""
+
+    def __init__(self, bin_edges, num_rows=1):
+        # Values above the last edge are counted in an overflow bin
+        self.bin_edges = list(bin_edges)
+        self.num_rows = num_rows
+        self._counts = Array('q', num_rows * (len(self.bin_edges) + 1))
+
+    def reset(self):
+        with self._counts.get_lock():
+            for i in range(len(self._counts)):
+                self._counts[i] = 0
+
+    def update(self, val, row=0):
+        b = sum(val > e for e in self.bin_edges)
+        with self._counts.get_lock():
+            self._counts[row * (len(self.bin_edges) + 1) + b] += 1
+
+    def counts(self, row=0):
+        n = len(self.bin_edges) + 1
+        return list(self._counts[row * n:(row + 1) * n])
+
+    def percentile(self, q, row=0):
+        """ upper edge of the bin containing the q-th percentile (inf for the
+        overflow bin) """
+        counts = self.counts(row)
+        total, cum = sum(counts), 0
+        if total == 0:
+            return 0.
+        for edge, c in zip(self.bin_edges + [float('inf')], counts):
+            cum += c
+            if cum >= q / 100. * total:
+                return edge
+        return float('inf')
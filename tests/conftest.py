@@ -0,0 +1,75 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import random
+import sys
+
+import numpy as np
+import pytest
+import torch
+
+# Tests import the repository's modules (src, app, evals) from its root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def write_video(fname, num_frames=48, height=128, width=192, fps=24):
+    """ Write a small mp4 of moving gradients (requires PyAV) """
+    av = pytest.importorskip('av')
+    ys, xs = np.mgrid[:height, :width]
+    with av.open(fname, mode='w') as container:
+        stream = container.add_stream('mpeg4', rate=fps)
+        stream.height, stream.width = height, width
+        stream.pix_fmt = 'yuv420p'
+        for t in range(num_frames):
+            frame = np.stack([
+                (xs * 2 + t * 5) % 256,
+                (ys * 3 + t * 3) % 256,
+                (xs + ys + t * 7) % 256,
+            ], axis=-1).astype(np.uint8)
+            av_frame = av.VideoFrame.from_ndarray(frame, format='rgb24')
+            for packet in stream.encode(av_frame):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+    return fname
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    return write_video(str(tmp_path / 'video.mp4'))
+
+
+def _seed_all(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def _make_frames(num_frames=4, height=36, width=52, seed=0):
+    """
+    Decoded uint8 frames (T x H x W x C) of smooth gradients with noise, so
+    that every augmentation changes them
+    """
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[:height, :width]
+    frames = np.stack([
+        np.stack([xs * 4 + t * 9, ys * 6 + t * 5, (xs + ys) * 3], axis=-1)
+        for t in range(num_frames)])
+    frames = frames + rng.integers(-20, 20, size=frames.shape)
+    return np.clip(frames, 0, 255).astype(np.uint8)
+
+
+@pytest.fixture
+def seed_all():
+    """ Seed the python, numpy and torch generators """
+    return _seed_all
+
+
+@pytest.fixture
+def make_frames():
+    return _make_frames
@@ -0,0 +1,83 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+
+decord = pytest.importorskip('decord')
+
+import src.datasets.utils.video.backends as backends  # noqa: E402
+from src.datasets.utils.video.backends import DecordReader  # noqa: E402
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    """ Record the (width, height) of every decord reader opened """
+    calls = []
+    reader_cls = decord.VideoReader
+
+    def video_reader(fname, width=-1, height=-1, **kwargs):
+        calls.append((width, height))
+        return reader_cls(fname, width=width, height=height, **kwargs)
+
+    monkeypatch.setattr(decord, 'VideoReader', video_reader)
+    monkeypatch.setattr(backends, '_FRAME_SIZES', {})
+    return calls
+
+
+def test_no_resize_opens_once(video_file, opened):
+    # 128x192 frames already have a short side of at most 128
+    reader = DecordReader(video_file, short_side=128)
+    assert opened == [(-1, -1)]
+    assert reader.get_batch([0, 1]).shape == (2, 128, 192, 3)
+
+
+def test_resize_opens_at_target_size(video_file, opened):
+    # The frame size is read from the container headers
+    reader = DecordReader(video_file, short_side=64)
+    assert opened == [(96, 64)]
+    assert reader.get_batch([0, 1]).shape == (2, 64, 96, 3)
+
+
+def test_decoded_frame_size_is_cached(video_file, opened, monkeypatch):
+    # Without container headers, the first frame is decoded once per video
+    monkeypatch.setattr(backends, 'probe_frame_size', lambda fname: None)
+    DecordReader(video_file, short_side=64)
+    assert opened == [(-1, -1), (96, 64)]
+    reader = DecordReader(video_file, short_side=64)
+    assert opened == [(-1, -1), (96, 64), (96, 64)]
+    assert reader.get_batch([0]).shape == (1, 64, 96, 3)
+
+
+def test_known_frame_size_opens_once(video_file, opened):
+    reader = DecordReader(video_file, short_side=64, frame_size=(128, 192))
+    assert opened == [(96, 64)]
+    assert reader.get_batch([0]).shape == (1, 64, 96, 3)
+
+
+def test_calibration_times_same_clips_with_every_backend(monkeypatch):
+    decoded = {}
+
+    class _Reader:
+        def __init__(self, backend, fname):
+            self.backend, self.fname = backend, fname
+
+        def __len__(self):
+            return 1000
+
+        def get_batch(self, indices):
+            decoded.setdefault(self.backend, []).append((self.fname, indices))
+
+    monkeypatch.setattr(
+        backends, 'open_video',
+        lambda backend, fname, **kwargs: _Reader(backend, fname))
+    fnames = [f'video_{i}.mp4' for i in range(8)]
+    selection = backends.calibrate_backends(
+        fnames, backends=['a', 'b', 'c'], frames_per_clip=4, frame_step=2)
+
+    assert sorted(selection[('.mp4', '')]) == ['a', 'b', 'c']
+    assert len(decoded['a']) == 4
+    assert decoded['a'] == decoded['b'] == decoded['c']
@@ -0,0 +1,122 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+import torch
+
+from src.datasets.utils.batch_ring import (
+    SharedBatchLoader,
+    SharedBatchRing,
+    SlotRef,
+    collate_clips,
+    num_batch_slots,
+)
+
+
+def _batch(value, batch_size=2, num_clips=2):
+    """ Clips of a batch, one list of num_clips clips per sample """
+    return [
+        [torch.full((3, 4, 4), float(value)) for _ in range(num_clips)]
+        for _ in range(batch_size)]
+
+
+@pytest.fixture
+def ring(tmp_path):
+    return SharedBatchRing(num_slots=3, shm_dir=str(tmp_path), timeout=0.1)
+
+
+def test_collate_matches_default_collate(ring):
+    clips = _batch(1.)
+    clips[1][0] += 1.
+    ref = ring.collate(clips)
+    assert isinstance(ref, SlotRef)
+    out = ring.resolve(ref)
+    expected = collate_clips(clips)
+    assert len(out) == len(expected)
+    for o, e in zip(out, expected):
+        assert torch.equal(o, e)
+
+    # Concatenated clips are ordered by clip, then sample
+    out = ring.resolve(ring.collate(clips, concat=True))
+    assert torch.equal(out, collate_clips(clips, concat=True))
+
+
+def test_acquire_times_out_when_all_slots_are_taken(ring):
+    for _ in range(ring.num_slots):
+        ring.collate(_batch(0.))
+    with pytest.raises(RuntimeError, match='No free batch slot'):
+        ring.collate(_batch(0.))
+
+
+def test_num_batch_slots_covers_batches_in_flight():
+    held = SharedBatchLoader.num_held
+    assert num_batch_slots(4) == 8 + held
+    assert num_batch_slots(4, prefetch_factor=4) == 16 + held
+    assert num_batch_slots(0) == 2 + held
+
+
+def _loader(ring, num_batches, slots_used):
+    """ Collate every batch into the ring when it is requested """
+    for i in range(num_batches):
+        ref = ring.collate(_batch(i))
+        slots_used.append(ref.slot)
+        yield [ref, torch.tensor([i])]
+
+
+def test_slot_is_released_once_the_next_batch_is_requested(ring):
+    slots_used = []
+    loader = SharedBatchLoader(_loader(ring, 6, slots_used), ring)
+    for i, (clips, label) in enumerate(loader):
+        assert int(label) == i
+        assert all(bool((c == i).all()) for c in clips)
+        # Only the batch in use holds a slot
+        assert sum(ring._taken) == 1
+    assert sum(ring._taken) == 0
+
+
+class _Event(object):
+    """ CUDA event whose completion is driven by the test """
+
+    events = []
+
+    def __init__(self):
+        self.synchronized = False
+        _Event.events.append(self)
+
+    def record(self):
+        pass
+
+    def synchronize(self):
+        self.synchronized = True
+
+
+def test_slot_is_not_reused_before_device_copies_complete(
+        ring, monkeypatch):
+    _Event.events = []
+    monkeypatch.setattr(torch.cuda, 'is_available', lambda: True)
+    monkeypatch.setattr(torch.cuda, 'Event', _Event)
+    # Without pinning the slots, which requires an actual device
+    monkeypatch.setattr(
+        SharedBatchRing, 'resolve', lambda self, ref: self._map()[ref.slot])
+
+    slots_used = []
+    loader = SharedBatchLoader(_loader(ring, 8, slots_used), ring)
+    previous = None
+    for i, (clips, _) in enumerate(loader):
+        # The event recorded when batch i was requested guards the copies
+        # of batch i - 1, which must not have been overwritten
+        if previous is not None:
+            assert bool((previous == i - 1).all())
+        previous = clips
+
+        # A slot is only reused once the copies of the batch that last
+        # used it (guarded by the event recorded at the next request)
+        # have completed
+        for j in range(i):
+            if slots_used[j] == slots_used[i]:
+                assert _Event.events[j + 1].synchronized
+    assert sum(ring._taken) == 0
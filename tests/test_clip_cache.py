@@ -0,0 +1,40 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+import pytest
+
+pytest.importorskip('decord')
+
+from src.datasets.video_dataset import make_videodataset  # noqa: E402
+
+
+def _make_dataset(tmp_path, video_file, random_clip_sampling):
+    data_path = tmp_path / 'data.csv'
+    data_path.write_text(f'{video_file} 0\n')
+    dataset, _, _ = make_videodataset(
+        data_paths=[str(data_path)],
+        batch_size=1,
+        frames_per_clip=4,
+        frame_step=2,
+        random_clip_sampling=random_clip_sampling,
+        num_workers=0,
+        clip_cache_dir=str(tmp_path / 'cache'))
+    return dataset
+
+
+def test_cache_disabled_with_random_sampling(tmp_path, video_file):
+    dataset = _make_dataset(tmp_path, video_file, random_clip_sampling=True)
+    assert dataset.clip_cache is None
+
+
+def test_cache_hits_with_deterministic_sampling(tmp_path, video_file):
+    dataset = _make_dataset(tmp_path, video_file, random_clip_sampling=False)
+    first, second = dataset[0], dataset[0]
+    assert dataset.clip_cache.hit_meter.count == 2
+    assert dataset.clip_cache.hit_meter.avg == 0.5
+    np.testing.assert_array_equal(first[0][0], second[0][0])
@@ -0,0 +1,121 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+import torch
+
+from app.vjepa.transforms import VideoTransform
+import src.datasets.utils.video.transforms as video_transforms
+from src.datasets.utils.video.batch_transforms import BatchVideoTransform
+
+
+@pytest.fixture
+def nan_empty(monkeypatch):
+    """ Make uninitialized float tensors hold NaNs """
+    empty = torch.empty
+
+    def nan_filled_empty(*args, **kwargs):
+        out = empty(*args, **kwargs)
+        if out.is_floating_point():
+            out.fill_(float('nan'))
+        return out
+
+    monkeypatch.setattr(torch, 'empty', nan_filled_empty)
+
+
+@pytest.fixture
+def images(make_frames):
+    """ Decoded uint8 frames, as channels-first clips (C x T x H x W) """
+    def images(num_frames=8, height=48, width=64):
+        frames = make_frames(num_frames, height, width)
+        return torch.from_numpy(frames).permute(3, 0, 1, 2)
+    return images
+
+
+def test_crop_with_shift_ignores_uninitialized_padding(
+        nan_empty, seed_all, images):
+    images = images()
+    for seed in range(10):
+        seed_all(seed)
+        # Upsampled crops sample their last row and column exactly
+        out = video_transforms.random_resized_crop_with_shift(
+            images, 32, 32, scale=(0.05, 0.2))
+        assert out.shape == (3, 8, 32, 32)
+        assert torch.isfinite(out).all()
+
+
+def test_crop_with_shift_matches_per_frame_interpolation(seed_all, images):
+    images = images()
+    seed_all(0)
+    boxes = video_transforms._get_param_spatial_crop_with_shift(
+        (0.1, 0.8), (3 / 4, 4 / 3), 48, 64, 8)
+    seed_all(0)
+    out = video_transforms.random_resized_crop_with_shift(
+        images, 24, 24, scale=(0.1, 0.8))
+
+    for t, (i, j, h, w) in enumerate(boxes.tolist()):
+        crop = images[:, t, i:i + h, j:j + w].float()
+        expected = torch.nn.functional.interpolate(
+            crop[None], size=(24, 24), mode='bilinear', align_corners=False)
+        torch.testing.assert_close(
+            out[:, t], expected[0], rtol=0, atol=1e-2)
+
+
+def test_pretrain_transform_with_shift_without_flip(seed_all, make_frames):
+    # Normalization views the clips, which must be contiguous
+    transform = VideoTransform(
+        random_horizontal_flip=False, motion_shift=True, crop_size=16)
+    frames = make_frames(num_frames=8, height=48, width=64)
+    seed_all(0)
+    out = transform(frames)
+    assert out.shape == (3, 8, 16, 16)
+    assert out.is_contiguous()
+
+
+@pytest.fixture
+def clips(make_frames):
+    """ Decoded uint8 clips (T x H x W x C), one list of clips per sample """
+    def clips(num_clips=4, num_frames=4, height=48, width=64):
+        frames = make_frames(num_frames * num_clips, height, width)
+        return [[clip] for clip in torch.from_numpy(frames).split(num_frames)]
+    return clips
+
+
+@pytest.mark.parametrize('motion_shift', [False, True])
+def test_batch_transform_ignores_uninitialized_padding(
+        nan_empty, motion_shift, seed_all, clips):
+    transform = BatchVideoTransform(
+        crop_size=32,
+        random_resize_scale=(0.05, 0.2),
+        motion_shift=motion_shift,
+        uint8_output=False)
+    boxes = torch.tensor([[0, 0, 8, 8], [0, 0, 16, 12]] * 2)
+    crops = transform._slice_crops(
+        [clip for (clip,) in clips()], boxes[:, None].repeat(1, 4, 1))
+    assert (crops[0, :, 8:] == 0).all() and (crops[0, :, :, 8:] == 0).all()
+
+    for seed in range(5):
+        seed_all(seed)
+        # Upsampled crops sample their last row and column exactly
+        out = transform(clips())
+        assert out.shape == (1, 4, 3, 4, 32, 32)
+        assert torch.isfinite(out.float()).all()
+
+
+def test_batch_transform_augments_whole_frames(monkeypatch, clips):
+    transform = BatchVideoTransform(crop_size=16, auto_augment=True)
+    shapes = []
+
+    def autoaug_transform(clips):
+        shapes.append(tuple(clips.shape))
+        return clips
+
+    monkeypatch.setattr(transform, 'autoaug_transform', autoaug_transform)
+    out = transform(clips() + clips(num_clips=2, height=40))
+    # Clips of each frame size are augmented together, before cropping
+    assert sorted(shapes) == [(2, 4, 3, 40, 64), (4, 4, 3, 48, 64)]
+    assert out.shape == (1, 6, 3, 4, 16, 16)
@@ -0,0 +1,88 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import os
+import threading
+
+import pytest
+
+pytest.importorskip('decord')
+
+from src.datasets.video_dataset import make_videodataset  # noqa: E402
+
+
+def _make_dataset(tmp_path, video_file, **kwargs):
+    data_path = tmp_path / 'data.csv'
+    data_path.write_text(f'{video_file} 0\n')
+    dataset, _, _ = make_videodataset(
+        data_paths=[str(data_path)],
+        batch_size=1,
+        frames_per_clip=4,
+        frame_step=2,
+        random_clip_sampling=False,
+        num_workers=0,
+        decode_timeout=0.2,
+        **kwargs)
+    return dataset
+
+
+def _hang_until(release, dataset, monkeypatch, when='open'):
+    """ Make opening (or decoding) the video wait for release """
+    open_reader = dataset._open_reader
+
+    class _HungReader:
+        def __init__(self, reader):
+            self.reader = reader
+
+        def __len__(self):
+            return len(self.reader)
+
+        def get_batch(self, indices):
+            release.wait()
+            return self.reader.get_batch(indices)
+
+    def hung_open_reader(fname, index=None):
+        if when == 'open':
+            release.wait()
+            return open_reader(fname, index)
+        return _HungReader(open_reader(fname, index))
+
+    monkeypatch.setattr(dataset, '_open_reader', hung_open_reader)
+
+
+def test_timed_out_decode_does_not_fill_caches(
+        tmp_path, video_file, monkeypatch):
+    cache_dir = str(tmp_path / 'cache')
+    dataset = _make_dataset(
+        tmp_path, video_file, clip_cache_dir=cache_dir, reader_cache_size=4)
+    sample = dataset.samples[0]
+
+    for when in ('open', 'decode'):
+        release = threading.Event()
+        _hang_until(release, dataset, monkeypatch, when=when)
+        with pytest.warns(UserWarning, match='timed out'):
+            assert dataset._loadvideo_with_timeout(sample, 0) == ([], None)
+        release.set()
+        dataset._hung_threads[-1].join()
+
+        assert not any(f.endswith('.npy') for f in os.listdir(cache_dir))
+        assert sample not in dataset.reader_cache._readers
+
+
+def test_too_many_hung_decodes_fail_the_worker(
+        tmp_path, video_file, monkeypatch):
+    dataset = _make_dataset(tmp_path, video_file, max_hung_decodes=1)
+    sample = dataset.samples[0]
+    release = threading.Event()
+    _hang_until(release, dataset, monkeypatch)
+    try:
+        with pytest.warns(UserWarning, match='timed out'):
+            dataset._loadvideo_with_timeout(sample, 0)
+            with pytest.raises(RuntimeError, match='max_hung_decodes'):
+                dataset._loadvideo_with_timeout(sample, 0)
+    finally:
+        release.set()
@@ -0,0 +1,72 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+import torch
+
+pytest.importorskip('decord')
+
+from src.datasets.multi_source_dataset import (  # noqa: E402
+    MultiSourceVideoLoader,
+)
+from src.utils.logging import AverageMeter  # noqa: E402
+
+
+class _Dataset(torch.utils.data.Dataset):
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.sample_time_meter = AverageMeter()
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        return index
+
+
+class _Sampler(torch.utils.data.Sampler):
+    """ Sampler recording the epochs it is iterated with """
+
+    def __init__(self, num_samples):
+        self.num_samples = num_samples
+        self.epoch = 0
+        self.epochs = []
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def load_state_dict(self, state_dict):
+        self.epoch = state_dict['epoch']
+
+    def __iter__(self):
+        self.epochs.append(self.epoch)
+        g = torch.Generator().manual_seed(self.epoch)
+        return iter(torch.randperm(self.num_samples, generator=g).tolist())
+
+    def __len__(self):
+        return self.num_samples
+
+
+def test_every_pass_of_a_dataset_has_its_own_order():
+    # The small dataset wraps several times per epoch
+    sizes = [4, 64]
+    samplers = [_Sampler(n) for n in sizes]
+    loader = MultiSourceVideoLoader(
+        datasets=[_Dataset(n) for n in sizes],
+        samplers=samplers,
+        batch_size=2,
+        datasets_weights=[1., 1.],
+        num_workers=0,
+        pin_mem=False)
+    for epoch in range(3):
+        loader.set_epoch(epoch)
+        for _ in loader:
+            pass
+    epochs = samplers[0].epochs
+    assert len(epochs) > 3
+    assert len(set(epochs)) == len(epochs)
@@ -0,0 +1,128 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+import torch
+
+from app.vjepa.utils import load_checkpoint
+from src.datasets.utils.weighted_sampler import ResumableSampler
+from src.masks.multiblock3d import MaskCollator as MB3DMaskCollator
+from src.masks.random_tube import MaskCollator as TubeMaskCollator
+
+_MB3D_CFGS = [dict(
+    aspect_ratio=(0.75, 1.5),
+    num_blocks=8,
+    spatial_scale=(0.15, 0.15),
+    temporal_scale=(1.0, 1.0),
+    max_temporal_keep=1.0,
+    max_keep=None)]
+_TUBE_CFGS = [dict(ratio=0.9)]
+
+
+@pytest.mark.parametrize('collator_cls, cfgs_mask', [
+    (MB3DMaskCollator, _MB3D_CFGS * 2),
+    (TubeMaskCollator, _TUBE_CFGS),
+])
+def test_mask_collator_state_ignores_prefetched_batches(
+        collator_cls, cfgs_mask):
+    consumed, prefetched = 5, 3
+
+    def make_collator():
+        return collator_cls(
+            cfgs_mask, crop_size=32, num_frames=4, patch_size=16)
+
+    # Workers have collated (and stepped the counters for) batches that the
+    # training loop has not consumed yet
+    collator = make_collator()
+    for _ in range(consumed + prefetched):
+        collator.step()
+    state = collator.state_dict(consumed)
+
+    # Counters of a collator that collated exactly the consumed batches
+    reference = make_collator()
+    for _ in range(consumed):
+        reference.step()
+
+    resumed = make_collator()
+    resumed.load_state_dict(state)
+    for m, r in zip(resumed.mask_generators, reference.mask_generators):
+        assert m.step() == r.step() == consumed
+
+
+def _make_sampler(batch_size=4):
+    sampler = torch.utils.data.distributed.DistributedSampler(
+        list(range(50)), num_replicas=1, rank=0, shuffle=True, seed=0)
+    return ResumableSampler(sampler, batch_size=batch_size)
+
+
+def test_resumable_sampler_resumes_after_consumed_batches():
+    batch_size, consumed = 4, 3
+
+    sampler = _make_sampler(batch_size)
+    sampler.set_epoch(2)
+    full_pass = list(sampler)
+    state = sampler.state_dict(consumed)
+    assert state == dict(epoch=2, start=consumed * batch_size)
+
+    # The resumed sampler starts at the saved epoch, whatever the current
+    # one, and skips the consumed indices
+    resumed = _make_sampler(batch_size)
+    resumed.set_epoch(0)
+    resumed.load_state_dict(state)
+    assert len(resumed) == len(full_pass) - consumed * batch_size
+    assert list(resumed) == full_pass[consumed * batch_size:]
+
+    # Following passes are not affected by the cursor
+    resumed.set_epoch(3)
+    sampler.set_epoch(3)
+    assert list(resumed) == list(sampler)
+
+
+def test_resumable_sampler_matches_dataloader_batches():
+    batch_size, consumed = 4, 2
+    sampler = _make_sampler(batch_size)
+    loader = torch.utils.data.DataLoader(
+        list(range(50)), batch_size=batch_size, sampler=sampler)
+    batches = [b.tolist() for b in loader]
+
+    state = sampler.state_dict(consumed)
+    resumed = _make_sampler(batch_size)
+    resumed.load_state_dict(state)
+    loader = torch.utils.data.DataLoader(
+        list(range(50)), batch_size=batch_size, sampler=resumed)
+    resumed_batches = [b.tolist() for b in loader]
+    assert resumed_batches == batches[consumed:]
+
+
+def test_load_checkpoint_restores_mask_collator_state(tmp_path):
+    consumed = 7
+
+    def make_collator():
+        return TubeMaskCollator(
+            _TUBE_CFGS, crop_size=32, num_frames=4, patch_size=16)
+
+    modules = [torch.nn.Linear(2, 2) for _ in range(3)]
+    opt = torch.optim.SGD(modules[0].parameters(), lr=0.1)
+    path = str(tmp_path / 'latest.pth.tar')
+    torch.save({
+        'encoder': modules[0].state_dict(),
+        'predictor': modules[1].state_dict(),
+        'target_encoder': modules[2].state_dict(),
+        'opt': opt.state_dict(),
+        'scaler': None,
+        'epoch': 1,
+        'itr': 2,
+        'mask_collator': make_collator().state_dict(consumed),
+    }, path)
+
+    resumed = make_collator()
+    load_checkpoint(
+        r_path=path, encoder=modules[0], predictor=modules[1],
+        target_encoder=modules[2], opt=opt, scaler=None,
+        mask_collator=resumed)
+    for m in resumed.mask_generators:
+        assert m.step() == consumed
@@ -0,0 +1,97 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pickle
+
+import numpy as np
+import pytest
+
+from src.datasets.utils.sample_index import SampleIndex
+
+_PATHS = [f'/data/vidéos/{i:03d}_{"x" * (i % 7)}.mp4' for i in range(23)]
+_LABELS = list(range(100, 123))
+
+
+@pytest.fixture
+def saved_index(tmp_path):
+    fname = str(tmp_path / 'index')
+    SampleIndex.from_lists(_PATHS, _LABELS).save(fname)
+    return fname
+
+
+def test_from_lists_round_trips():
+    index = SampleIndex.from_lists(_PATHS, _LABELS)
+    assert len(index) == len(_PATHS)
+    assert list(index) == _PATHS
+    assert index.labels.tolist() == _LABELS
+
+
+def test_in_memory_index_pickles_by_value():
+    index = pickle.loads(pickle.dumps(SampleIndex.from_lists(_PATHS, _LABELS)))
+    assert list(index) == _PATHS
+    assert index.labels.tolist() == _LABELS
+
+
+def test_loaded_index_pickles_by_reference(saved_index):
+    index = SampleIndex.load(saved_index)
+    assert isinstance(index.blob, np.memmap)
+    # Only the directory is pickled, not the paths
+    assert index.__getstate__() == dict(fname=saved_index, partition=None)
+
+    copy = pickle.loads(pickle.dumps(index))
+    assert isinstance(copy.blob, np.memmap)
+    assert list(copy) == _PATHS
+    assert copy.labels.tolist() == _LABELS
+
+
+@pytest.mark.parametrize('world_size', [1, 2, 3, 5])
+def test_partitions_are_equal_disjoint_and_contiguous(
+        saved_index, world_size):
+    size = len(_PATHS) // world_size
+    partitions = [
+        SampleIndex.load(saved_index, partition=(rank, world_size))
+        for rank in range(world_size)]
+    for rank, index in enumerate(partitions):
+        assert len(index) == size
+        assert index.total_len == len(_PATHS)
+        assert list(index) == _PATHS[rank * size:(rank + 1) * size]
+        assert index.labels.tolist() == _LABELS[rank * size:(rank + 1) * size]
+        # A partition pickles as a reference to its own partition
+        copy = pickle.loads(pickle.dumps(index))
+        assert list(copy) == list(index)
+
+
+def test_select_partition(saved_index):
+    index = SampleIndex.load(saved_index, partition=(1, 2))
+    keep = np.arange(len(index)) % 3 != 0
+    selected = index.select(keep)
+    expected = [p for p, k in zip(_PATHS[11:22], keep) if k]
+    assert list(selected) == expected
+    assert list(pickle.loads(pickle.dumps(selected))) == expected
+
+
+def test_concat_indices(saved_index):
+    first = SampleIndex.load(saved_index, partition=(0, 2))
+    second = SampleIndex.from_lists(['a.mp4', 'b.mp4'], [0, 1])
+    index = SampleIndex.concat([first, second])
+    assert len(index) == len(first) + 2
+    assert index[len(first) - 1] == _PATHS[len(first) - 1]
+    assert index[len(first)] == 'a.mp4'
+    assert list(index) == list(first) + ['a.mp4', 'b.mp4']
+    assert index.labels.tolist() == _LABELS[:len(first)] + [0, 1]
+
+
+def test_isin_matches_paths(saved_index):
+    paths = [_PATHS[3], _PATHS[12], _PATHS[20], '/data/missing.mp4', '']
+    index = SampleIndex.from_lists(_PATHS, _LABELS)
+    expected = np.array([p in paths for p in _PATHS])
+    np.testing.assert_array_equal(index.isin(paths), expected)
+    assert not index.isin([]).any()
+
+    partition = SampleIndex.load(saved_index, partition=(1, 2))
+    np.testing.assert_array_equal(
+        partition.isin(paths), expected[11:22])
@@ -0,0 +1,74 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import random
+
+import numpy as np
+import pytest
+import torch
+
+from PIL import Image
+
+from src.datasets.utils.video import tensor_randaugment
+from src.datasets.utils.video.randaugment import (
+    RandAugment,
+    parse_rand_augment_config,
+)
+from src.datasets.utils.video.tensor_randaugment import TensorRandAugment
+
+_CONFIG = 'rand-m7-n4-mstd0.5-inc1'
+_HPARAMS = dict(translate_const=100, interpolation=Image.BICUBIC)
+# Geometric ops only match PIL up to its bicubic kernel (and the rounding of
+# sampling positions)
+_GEOMETRIC_OPS = (
+    'Rotate', 'ShearX', 'ShearY', 'TranslateXRel', 'TranslateYRel')
+
+
+def _ops():
+    ops, _, _ = parse_rand_augment_config(_CONFIG, _HPARAMS)
+    return ops
+
+
+@pytest.mark.parametrize('op', _ops(), ids=lambda op: op.name)
+def test_op_matches_pil(op, make_frames):
+    frames = make_frames(num_frames=2)
+    random.seed(0)
+    op.prob, op.magnitude_std = 1., 0.
+    level_args = op.sample_level_args()
+
+    expected = np.stack([
+        np.asarray(op.aug_fn(Image.fromarray(f), *level_args, **op.kwargs))
+        for f in frames]).astype(np.int64)
+
+    x = torch.from_numpy(frames).permute(0, 3, 1, 2)[None].float()
+    args = [torch.tensor([a], dtype=torch.float32) for a in level_args]
+    out = tensor_randaugment.NAME_TO_OP[op.name](x, *args, **op.kwargs)
+    out = out.to(torch.uint8)[0].permute(0, 2, 3, 1).numpy().astype(np.int64)
+
+    diff = np.abs(out - expected)
+    if op.name in _GEOMETRIC_OPS:
+        assert diff.mean() < 1. and diff.max() <= 8
+    else:
+        assert diff.max() == 0
+
+
+def test_clip_matches_pil_randaugment(seed_all, make_frames):
+    # With the same seeds, a clip is drawn the same ops and arguments as
+    # its PIL frames (geometric ops left out, to compare exactly)
+    ops = [op for op in _ops() if op.name not in _GEOMETRIC_OPS]
+    frames = make_frames()
+    for seed in range(8):
+        seed_all(seed)
+        expected = RandAugment(ops, num_layers=4)(
+            [Image.fromarray(f) for f in frames])
+        expected = np.stack([np.asarray(img) for img in expected])
+
+        seed_all(seed)
+        clip = torch.from_numpy(frames).permute(0, 3, 1, 2)
+        out = TensorRandAugment(ops, num_layers=4)(clip)
+        assert out.dtype == torch.uint8
+        assert np.array_equal(out.permute(0, 2, 3, 1).numpy(), expected)
@@ -0,0 +1,85 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import pytest
+import torch
+
+from app.vjepa.transforms import (
+    VideoTransform,
+    make_batch_transforms,
+    uint8_normalize,
+)
+
+_MEAN, _STD = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+
+
+def _reference_normalize(clips):
+    mean = torch.tensor(_MEAN, dtype=torch.float64).view(1, -1, 1, 1, 1)
+    std = torch.tensor(_STD, dtype=torch.float64).view(1, -1, 1, 1, 1)
+    return (clips.double() / 255. - mean) / std
+
+
+def _clips(seed=0):
+    g = torch.Generator().manual_seed(seed)
+    return torch.randint(
+        0, 256, (4, 3, 2, 8, 8), dtype=torch.uint8, generator=g)
+
+
+@pytest.mark.parametrize(
+    'dtype', [torch.float32, torch.bfloat16, torch.float16])
+def test_uint8_normalize_is_computed_in_float32(dtype):
+    clips = _clips()
+    out = uint8_normalize(clips, _MEAN, _STD, dtype=dtype)
+    assert out.dtype == dtype
+    # Rounded once, from a float32 result
+    expected = _reference_normalize(clips).to(dtype)
+    ulp = torch.finfo(dtype).eps
+    torch.testing.assert_close(
+        out.double(), expected.double(), rtol=ulp, atol=1e-6)
+
+
+def test_uint8_normalize_erases_after_normalization():
+    clips = _clips()
+    torch.manual_seed(0)
+    out = uint8_normalize(clips, _MEAN, _STD, reprob=1.)
+    expected = _reference_normalize(clips).float()
+    erased = ~torch.isclose(out, expected, atol=1e-5)
+    # A box of every clip, the same in all of its frames and channels
+    assert erased.flatten(1).any(dim=1).all()
+    assert (erased == erased[:, :1, :1]).all()
+    assert not (erased == erased[:, :, :, :1, :1]).all()
+
+    out = uint8_normalize(clips, _MEAN, _STD, reprob=0.)
+    torch.testing.assert_close(out, expected, rtol=0, atol=1e-5)
+
+
+def test_uint8_output_matches_float_output(seed_all, make_frames):
+    kwargs = dict(crop_size=16, random_resize_scale=(0.3, 1.0))
+    frames = make_frames()
+    seed_all(0)
+    expected = VideoTransform(**kwargs)(frames)
+    seed_all(0)
+    clip = VideoTransform(uint8_output=True, **kwargs)(frames)
+    assert clip.dtype == torch.uint8
+
+    out = uint8_normalize(clip[None], _MEAN, _STD)[0]
+    # Up to the rounding of the uint8 clips
+    atol = 0.5 / (255. * min(_STD)) + 1e-5
+    torch.testing.assert_close(out, expected, rtol=0, atol=atol)
+
+
+def test_uint8_output_defers_random_erasing(make_frames):
+    # Erasing happens on the device (see uint8_normalize), so uint8 outputs
+    # are allowed with reprob > 0
+    frames = make_frames()
+    transform = VideoTransform(uint8_output=True, reprob=1., crop_size=16)
+    assert transform(frames).dtype == torch.uint8
+
+    batch_transform = make_batch_transforms(
+        uint8_output=True, reprob=1., crop_size=16)
+    out = batch_transform([[torch.from_numpy(frames)]])
+    assert out.dtype == torch.uint8
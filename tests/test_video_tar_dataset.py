@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import io
+import tarfile
+
+import pytest
+
+pytest.importorskip('decord')
+
+import src.datasets.video_tar_dataset as video_tar_dataset  # noqa: E402
+
+
+def _write_shard(fname, videos):
+    with tarfile.open(fname, 'w') as tar:
+        for key, data in videos.items():
+            info = tarfile.TarInfo(f'{key}.mp4')
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return fname
+
+
+class _FailingReader(video_tar_dataset.VideoReader):
+    """ Reader whose frames cannot be decoded (e.g., truncated video) """
+
+    def get_batch(self, indices):
+        raise RuntimeError('truncated video')
+
+
+def _make_dataset(shard, num_batches=2):
+    return video_tar_dataset.VideoTarDataset(
+        data_paths=[shard],
+        batch_size=1,
+        num_batches=num_batches,
+        frames_per_clip=4,
+        frame_step=2,
+        shuffle_buffer=1,
+        num_workers=1)
+
+
+def test_undecodable_video_is_skipped(tmp_path, video_file, monkeypatch):
+    with open(video_file, 'rb') as f:
+        data = f.read()
+    shard = _write_shard(str(tmp_path / 'shard.tar'), {'a': data})
+    dataset = _make_dataset(shard)
+
+    monkeypatch.setattr(video_tar_dataset, 'VideoReader', _FailingReader)
+    with pytest.warns(UserWarning, match='undecodable'):
+        assert dataset._decode_sample(('a', {'mp4': data})) is None
+
+
+def test_stream_continues_after_undecodable_video(
+        tmp_path, video_file, monkeypatch):
+    with open(video_file, 'rb') as f:
+        data = f.read()
+    shard = _write_shard(str(tmp_path / 'shard.tar'), {'a': data, 'b': data})
+    dataset = _make_dataset(shard, num_batches=3)
+
+    # Every other video fails to decode
+    calls = []
+
+    class _FlakyReader(video_tar_dataset.VideoReader):
+        def get_batch(self, indices):
+            calls.append(len(calls))
+            if len(calls) % 2 == 1:
+                raise RuntimeError('truncated video')
+            return super().get_batch(indices)
+
+    monkeypatch.setattr(video_tar_dataset, 'VideoReader', _FlakyReader)
+    with pytest.warns(UserWarning, match='undecodable'):
+        samples = list(dataset)
+    assert len(samples) == 3
+    for buffer, label, clip_indices in samples:
+        assert buffer[0].shape[0] == 4
+
+
+def test_decoder_uses_the_thread_budget(tmp_path, video_file, monkeypatch):
+    with open(video_file, 'rb') as f:
+        data = f.read()
+    dataset = _make_dataset(_write_shard(str(tmp_path / 'shard.tar'), {}))
+    dataset.num_decode_threads = 3
+
+    threads = []
+
+    class _Reader(video_tar_dataset.VideoReader):
+        def __init__(self, *args, num_threads=0, **kwargs):
+            threads.append(num_threads)
+            super().__init__(*args, num_threads=num_threads, **kwargs)
+
+    monkeypatch.setattr(video_tar_dataset, 'VideoReader', _Reader)
+    assert dataset._decode_sample(('a', {'mp4': data})) is not None
+    assert threads == [3]
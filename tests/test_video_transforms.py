@@ -0,0 +1,88 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+import pytest
+import torch
+import torchvision.transforms as transforms
+
+import src.datasets.utils.video.transforms as video_transforms
+from app.vjepa.transforms import VideoTransform
+from evals.video_classification_frozen.utils import (
+    VideoTransform as EvalVideoTransform,
+)
+
+_CROP_SIZE = 24
+_MEAN = torch.tensor((0.485, 0.456, 0.406)).view(-1, 1, 1, 1)
+_STD = torch.tensor((0.229, 0.224, 0.225)).view(-1, 1, 1, 1)
+# Geometric tensor RandAugment ops match PIL up to its bicubic kernel (by
+# at most 8 levels of a uint8 pixel, and about 1 level on average)
+_TENSOR_AA_ATOL = 8. / 255. / _STD.min().item()
+_TENSOR_AA_MEAN_ATOL = 2. / 255. / _STD.min().item()
+
+
+def _float_first(frames, auto_augment=False, motion_shift=False):
+    """
+    Reference pipeline: frames augmented as PIL images and converted to float
+    before cropping, as the transforms did before cropping uint8 clips
+    """
+    if auto_augment:
+        autoaug_transform = video_transforms.create_random_augment(
+            input_size=(_CROP_SIZE, _CROP_SIZE),
+            auto_augment='rand-m7-n4-mstd0.5-inc1',
+            interpolation='bicubic')
+        frames = autoaug_transform(
+            [transforms.ToPILImage()(frame) for frame in frames])
+        frames = np.stack([np.asarray(img) for img in frames])
+    buffer = torch.tensor(frames, dtype=torch.float32).permute(3, 0, 1, 2)
+    spatial_transform = video_transforms.random_resized_crop_with_shift \
+        if motion_shift else video_transforms.random_resized_crop
+    buffer = spatial_transform(
+        images=buffer,
+        target_height=_CROP_SIZE,
+        target_width=_CROP_SIZE,
+        scale=(0.3, 1.0),
+        ratio=(3/4, 4/3))
+    buffer, _ = video_transforms.horizontal_flip(0.5, buffer)
+    return (buffer / 255. - _MEAN) / _STD
+
+
+def _pretrain_transform(**kwargs):
+    return VideoTransform(crop_size=_CROP_SIZE, **kwargs)
+
+
+def _eval_transform(**kwargs):
+    transform = EvalVideoTransform(crop_size=_CROP_SIZE, **kwargs)
+    return lambda frames: transform(frames)[0]
+
+
+@pytest.mark.parametrize('make_transform', [
+    _pretrain_transform, _eval_transform], ids=['pretrain', 'eval'])
+@pytest.mark.parametrize('motion_shift', [False, True])
+@pytest.mark.parametrize('auto_augment', [None, 'pil', 'tensor'])
+def test_transform_matches_float_first_pipeline(
+        make_transform, motion_shift, auto_augment, seed_all, make_frames):
+    transform = make_transform(
+        motion_shift=motion_shift,
+        auto_augment=auto_augment is not None,
+        tensor_auto_augment=auto_augment == 'tensor')
+    atol, mean_atol = 1e-4, 1e-5
+    if auto_augment == 'tensor':
+        atol, mean_atol = _TENSOR_AA_ATOL, _TENSOR_AA_MEAN_ATOL
+    for seed in range(4):
+        frames = make_frames(seed=seed)
+        seed_all(seed)
+        expected = _float_first(
+            frames, auto_augment=auto_augment is not None,
+            motion_shift=motion_shift)
+        seed_all(seed)
+        out = transform(frames)
+        assert out.dtype == torch.float32
+        assert out.shape == expected.shape == (3, 4, _CROP_SIZE, _CROP_SIZE)
+        diff = (out - expected).abs()
+        assert diff.max().item() <= atol
+        assert diff.mean().item() <= mean_atol
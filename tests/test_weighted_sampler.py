@@ -0,0 +1,140 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+#
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+#
+
+import numpy as np
+import pytest
+
+from src.datasets.utils.weighted_sampler import (
+    CostBalancedDistributedSampler,
+    StratifiedDistributedSampler,
+    feistel_permutation,
+)
+
+
+class _CostedDataset:
+    """ Dataset of samples with the given decoding costs """
+
+    def __init__(self, costs):
+        self.costs = np.asarray(costs, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.costs)
+
+    def sample_costs(self, reduce_fn=None):
+        return self.costs if reduce_fn is None else reduce_fn(self.costs)
+
+
+def _rank_batches(dataset, batch_size, num_replicas, weights=None, epoch=0):
+    """ Batches of every rank, with dimensions num_replicas x steps x bs """
+    batches = []
+    for rank in range(num_replicas):
+        sampler = CostBalancedDistributedSampler(
+            dataset, batch_size, weights=weights,
+            num_replicas=num_replicas, rank=rank, seed=0)
+        sampler.set_epoch(epoch)
+        indices = list(sampler)
+        assert len(indices) == len(sampler)
+        batches.append(np.asarray(indices).reshape(-1, batch_size))
+    return np.stack(batches)
+
+
+@pytest.mark.parametrize('weighted', [False, True])
+def test_steps_hold_the_same_samples_whatever_the_costs(weighted):
+    rng = np.random.default_rng(0)
+    weights = rng.random(100) if weighted else None
+    uniform = _rank_batches(
+        _CostedDataset(np.ones(100)), 3, 4, weights=weights)
+    costed = _rank_batches(
+        _CostedDataset(rng.random(100)), 3, 4, weights=weights)
+
+    assert uniform.shape == costed.shape == (4, 100 // 12, 3)
+    for step in range(uniform.shape[1]):
+        samples = costed[:, step].reshape(-1)
+        # Ranks get disjoint samples, the ones drawn without costs
+        assert len(set(samples.tolist())) == len(samples)
+        assert sorted(samples) == sorted(uniform[:, step].reshape(-1))
+
+
+def test_serpentine_dealing_balances_batch_costs():
+    costs = np.random.default_rng(0).pareto(1.5, size=400) + 1
+    batches = _rank_batches(_CostedDataset(costs), 4, 8)
+    for step in range(batches.shape[1]):
+        step_costs = np.sort(costs[batches[:, step].reshape(-1)])[::-1]
+        batch_costs = costs[batches[:, step]].sum(axis=1)
+        # Each round of the deal moves the lead by at most the largest cost
+        # of the round
+        assert batch_costs.max() - batch_costs.min() <= step_costs[0]
+        # Rank 0 gets the most costly sample, then the least costly one of
+        # the second round
+        assert costs[batches[0, step]].max() == step_costs[0]
+        assert costs[batches[0, step]][1] == step_costs[15]
+
+
+def test_epochs_draw_different_samples():
+    dataset = _CostedDataset(np.random.default_rng(0).random(100))
+    first = _rank_batches(dataset, 3, 4, epoch=0)
+    second = _rank_batches(dataset, 3, 4, epoch=1)
+    assert not np.array_equal(first, second)
+    np.testing.assert_array_equal(first, _rank_batches(dataset, 3, 4))
+
+
+@pytest.mark.parametrize('n', [1, 2, 3, 7, 64, 1000, 4099])
+def test_feistel_permutation_is_a_permutation(n):
+    for key in range(3):
+        perm = feistel_permutation(np.arange(n), n, key)
+        assert sorted(perm.tolist()) == list(range(n))
+        # Positions map the same, whatever the positions asked along
+        np.testing.assert_array_equal(
+            feistel_permutation(np.arange(n)[::-1], n, key), perm[::-1])
+    if n >= 64:
+        assert not np.array_equal(perm, np.arange(n))
+        assert not np.array_equal(perm, feistel_permutation(
+            np.arange(n), n, key + 1))
+
+
+def _stratified(num_replicas=4, epoch=0, **kwargs):
+    """ Indices drawn by every rank """
+    out = []
+    for rank in range(num_replicas):
+        sampler = StratifiedDistributedSampler(
+            num_replicas=num_replicas, rank=rank, **kwargs)
+        sampler.set_epoch(epoch)
+        indices = list(sampler)
+        assert len(indices) == len(sampler)
+        out.append(indices)
+    return out
+
+
+def test_stratified_ranks_draw_disjoint_samples():
+    # A single dataset is a permutation interleaved across ranks
+    ranks = _stratified(num_samples_per_dataset=[1000], chunk_size=64)
+    samples = sum(ranks, [])
+    assert len(samples) == 1000
+    assert sorted(samples) == list(range(1000))
+
+
+def test_stratified_sampling_follows_dataset_weights():
+    ranks = _stratified(
+        num_samples_per_dataset=[3000, 1000],
+        datasets_weights=[0.25, 0.75],
+        chunk_size=500)
+    for indices in ranks:
+        indices = np.asarray(indices)
+        assert len(indices) == 1000
+        assert ((indices >= 0) & (indices < 4000)).all()
+        assert abs((indices >= 3000).mean() - 0.75) < 0.05
+    # Within each pass over the small dataset, ranks draw distinct samples
+    second = np.concatenate([np.asarray(r)[np.asarray(r) >= 3000][:200]
+                             for r in ranks])
+    assert len(np.unique(second)) == len(second)
+
+
+def test_stratified_sampling_is_deterministic():
+    kwargs = dict(num_samples_per_dataset=[500, 300], chunk_size=128)
+    assert _stratified(**kwargs) == _stratified(**kwargs)
+    assert _stratified(**kwargs) != _stratified(epoch=1, **kwargs)
+    assert _stratified(**kwargs) != _stratified(seed=1, **kwargs)